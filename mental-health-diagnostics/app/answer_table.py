@@ -0,0 +1,190 @@
+import numpy as np
+import pandas as pd
+import json
+import os
+import time
+
+try:
+    from app.model_bundle import load_artifacts
+except ImportError:
+    from model_bundle import load_artifacts
+
+# The modified model only sees the categorical columns of data_utils_modified, so every
+# possible input is one cell of the cartesian product of the encoder classes (a few million).
+# build_answer_table() runs the forest once over all of them and stores the predicted class
+# in a flat array indexed by the mixed-radix number of the codes; serving is then one lookup.
+
+# 2: the meta records the size and mtime of the .npy files it was written with
+TABLE_VERSION = 2
+
+
+def table_radices(encoders, feature_cols):
+    missing = [col for col in feature_cols if col not in encoders]
+    if missing:
+        raise ValueError(f"Answer table needs every feature to be categorical, not encoded: {missing}")
+    return [len(encoders[col].classes_) for col in feature_cols]
+
+
+def table_paths(table_path):
+    base, _ = os.path.splitext(table_path)
+    return table_path, base + '_proba.npy', base + '.json'
+
+
+def file_stamp(path):
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def build_answer_table(model, model_hash, encoders, feature_cols, table_path, chunk_size=500000, with_proba=False):
+    radices = table_radices(encoders, feature_cols)
+    total = int(np.prod(radices, dtype=np.int64))
+    classes = np.asarray(model.classes_)
+    if classes.min() < 0 or classes.max() > 255:
+        raise ValueError("Answer table stores classes as uint8, got labels outside 0..255")
+
+    pred_path, proba_path, meta_path = table_paths(table_path)
+    print(f"Enumerating {total} combinations of {len(feature_cols)} features...")
+
+    # written straight into memory-mapped .npy files so the full table never sits in RAM twice.
+    # They are built next to the live files and renamed over them at the end: a running API
+    # keeps its mmap of the old files and only ever loads a complete table
+    tmp = f".tmp-{os.getpid()}"
+    try:
+        write_table(model, feature_cols, radices, total, classes, pred_path + tmp,
+                    proba_path + tmp if with_proba else None, chunk_size)
+        meta = {
+            "version": TABLE_VERSION,
+            "model_hash": model_hash,
+            "feature_cols": list(feature_cols),
+            "classes": {col: [str(c) for c in encoders[col].classes_] for col in feature_cols},
+            "radices": radices,
+            "with_proba": with_proba,
+            # the files this meta belongs to. It is renamed into place last, so AnswerTable.load()
+            # can tell a table that was replaced while it was loading
+            "files": {"preds": file_stamp(pred_path + tmp)},
+        }
+        if with_proba:
+            meta["files"]["probas"] = file_stamp(proba_path + tmp)
+        with open(meta_path + tmp, 'w') as f:
+            json.dump(meta, f, indent=2)
+        os.replace(pred_path + tmp, pred_path)
+        if with_proba:
+            os.replace(proba_path + tmp, proba_path)
+        os.replace(meta_path + tmp, meta_path)
+    finally:
+        for path in (pred_path, proba_path, meta_path):
+            if os.path.exists(path + tmp):
+                os.remove(path + tmp)
+    print(f"Answer table saved to {pred_path}")
+    return meta
+
+
+def write_table(model, feature_cols, radices, total, classes, pred_path, proba_path, chunk_size):
+    preds = np.lib.format.open_memmap(pred_path, mode='w+', dtype=np.uint8, shape=(total,))
+    probas = None
+    if proba_path is not None:
+        probas = np.lib.format.open_memmap(proba_path, mode='w+', dtype=np.float32, shape=(total, len(classes)))
+
+    start_time = time.time()
+    for start in range(0, total, chunk_size):
+        stop = min(start + chunk_size, total)
+        codes = np.unravel_index(np.arange(start, stop, dtype=np.int64), radices)
+        X = pd.DataFrame({col: codes[i] for i, col in enumerate(feature_cols)})
+        if probas is not None:
+            proba = model.predict_proba(X)
+            probas[start:stop] = proba
+            # same argmax rule RandomForestClassifier.predict uses
+            preds[start:stop] = classes[np.argmax(proba, axis=1)]
+        else:
+            preds[start:stop] = model.predict(X)
+        print(f"  {stop}/{total} rows ({stop / (time.time() - start_time):.0f} rows/s)")
+
+    preds.flush()
+    if probas is not None:
+        probas.flush()
+
+
+class AnswerTable:
+    def __init__(self, preds, probas, radices, feature_cols):
+        self.preds = preds
+        self.probas = probas
+        self.radices = radices
+        self.feature_cols = feature_cols
+        # C order: the last feature varies fastest, matching np.unravel_index in the build
+        self.strides = np.cumprod([1] + radices[:0:-1], dtype=np.int64)[::-1].copy()
+
+    @classmethod
+    def load(cls, table_path, model_hash, encoders, feature_cols):
+        # returns None when the table is missing or was built for a different model/encoders,
+        # so the caller just keeps using the forest
+        pred_path, proba_path, meta_path = table_paths(table_path)
+        if not (os.path.exists(pred_path) and os.path.exists(meta_path)):
+            return None
+        with open(meta_path) as f:
+            meta = json.load(f)
+
+        try:
+            radices = table_radices(encoders, feature_cols)
+        except ValueError:
+            return None
+        classes = {col: [str(c) for c in encoders[col].classes_] for col in feature_cols}
+        if (meta.get("version") != TABLE_VERSION
+                or meta.get("feature_cols") != list(feature_cols)
+                or meta.get("classes") != classes
+                or meta.get("model_hash") != model_hash):
+            print("Answer table is stale for the loaded model, falling back to the forest.")
+            return None
+
+        # loaded after the meta: if a rebuild renamed new files in since, they no longer match it
+        try:
+            preds = np.load(pred_path, mmap_mode='r')
+            probas = np.load(proba_path, mmap_mode='r') if meta.get("with_proba") else None
+            current = file_stamp(pred_path) == meta["files"]["preds"] and (
+                probas is None or file_stamp(proba_path) == meta["files"]["probas"])
+        except FileNotFoundError:
+            current = False
+        if not current:
+            print("Answer table changed while loading, falling back to the forest.")
+            return None
+        if preds.shape != (int(np.prod(radices, dtype=np.int64)),):
+            return None
+        return cls(preds, probas, radices, list(feature_cols))
+
+    def index(self, X):
+        # X is the encoded frame in feature_cols order, so the mixed-radix index is one dot product
+        if isinstance(X, pd.DataFrame):
+            if list(X.columns) != self.feature_cols:
+                X = X[self.feature_cols]
+            X = X.to_numpy(dtype=np.int64)
+        return np.asarray(X, dtype=np.int64) @ self.strides
+
+    def predict(self, X):
+        return self.preds[self.index(X)].astype(np.int64)
+
+    def predict_proba(self, X):
+        if self.probas is None:
+            return None
+        return np.asarray(self.probas[self.index(X)])
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Precompute every answer of the modified treatment model")
+    parser.add_argument('--chunk-size', type=int, default=500000)
+    parser.add_argument('--with-proba', action='store_true', help="also store class probabilities")
+    args = parser.parse_args()
+
+    BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+    MODELS_DIR = os.path.join(BASE_DIR, '..', 'models')
+
+    print("Loading models...")
+    try:
+        artifacts = load_artifacts(MODELS_DIR, 'modified')
+    except FileNotFoundError:
+        print("Models not found. Please run train_model_modified.py first.")
+        raise SystemExit(1)
+
+    build_answer_table(artifacts.model('treatment'), artifacts.model_hash('treatment'), artifacts.encoders, artifacts.feature_cols,
+                       os.path.join(MODELS_DIR, 'answer_table_modified.npy'),
+                       chunk_size=args.chunk_size, with_proba=args.with_proba)
@@ -1,15 +1,34 @@
-from fastapi import FastAPI, HTTPException, Header
+import time
+# read before anything heavy is imported, for the startup timings (GET /startup)
+IMPORT_STARTED = time.perf_counter()
+
+from fastapi import FastAPI, HTTPException, Header, Body
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-import pandas as pd
-import joblib
+from fastapi.responses import JSONResponse, Response
+from pydantic import BaseModel, ValidationError
+from typing import Any, List
+import numpy as np
+import importlib.util
 import os
+import warnings
+from types import SimpleNamespace
 from dotenv import load_dotenv
-from data_utils import clean_gender, preprocess_input
+from data_utils import clean_gender, preprocess_input, compile_encoders
+from micro_batcher import MicroBatcher
+from model_bundle import load_artifacts, artifact_signature
+from model_reloader import ModelReloader
+from inference_executor import Overloaded
+from metrics import collect_runtime, collect_drift, MetricsMiddleware, StageTimer, NULL_TIMER, current_timer, StartupClock
+from flat_forest import FlatForest, sample_rows, sample_matrix, validate
+from contributions import explainers, explain_targets
+from drift import DriftMonitor
+import runtime
 
 # Load environment variables
 load_dotenv()
 
+startup = StartupClock(IMPORT_STARTED)
+
 app = FastAPI(title="Mental Health Diagnostics API")
 
 app.add_middleware(
@@ -23,23 +42,165 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Prometheus metrics on /metrics (METRICS=0 turns them off); SERVER_TIMING=1 adds a per-request
+# Server-Timing header with the same stage timings
+METRICS = os.getenv("METRICS", "1") == "1"
+SERVER_TIMING = os.getenv("SERVER_TIMING", "0") == "1"
+
+# executor, metrics and prediction cache are shared with the other model family when both
+# are served from one process (service.py)
+metrics = runtime.metrics()
+if METRICS:
+    app.add_middleware(MetricsMiddleware, metrics=metrics, server_timing=SERVER_TIMING)
+
+# max number of questionnaires accepted by one /predict/batch call
+MAX_BATCH_SIZE = int(os.getenv("MAX_BATCH_SIZE", "1000"))
+
+# opt-in micro-batching: concurrent /predict calls are coalesced into one model call
+MICRO_BATCHING = os.getenv("MICRO_BATCHING", "0") == "1"
+MICRO_BATCH_MAX_SIZE = int(os.getenv("MICRO_BATCH_MAX_SIZE", "64"))
+MICRO_BATCH_MAX_WAIT_MS = float(os.getenv("MICRO_BATCH_MAX_WAIT_MS", "5"))
+
+# LRU cache of predictions keyed on the encoded feature row (PREDICTION_CACHE=0 turns it off)
+PREDICTION_CACHE = os.getenv("PREDICTION_CACHE", "1") == "1"
+PREDICTION_CACHE_SIZE = int(os.getenv("PREDICTION_CACHE_SIZE", "10000"))
+PREDICTION_CACHE_TTL = float(os.getenv("PREDICTION_CACHE_TTL", "3600"))
+
+# FAST_PATH=1: validated payloads are encoded straight into a numpy row in feature_cols order and
+# small batches run on the flat forests, so with a model bundle neither pandas nor sklearn is
+# imported at startup (faster cold starts); sklearn is loaded for the first bigger batch. Without
+# a bundle the pickles still need them.
+FAST_PATH = os.getenv("FAST_PATH", "0") == "1"
+if FAST_PATH:
+    # batches that go to sklearn get the same numpy rows, already in feature_cols order, so its
+    # check for the DataFrame column names it was fitted with has nothing to check
+    warnings.filterwarnings('ignore', message='X does not have valid feature names', category=UserWarning)
+
+# FLAT_FOREST=1 serves predictions from flattened numpy copies of the forests (checked against sklearn at load)
+FLAT_FOREST = os.getenv("FLAT_FOREST", "0") == "1"
+# bigger batches than this still go to sklearn, which walks large batches faster. The default
+# is the most rows the flat forest walks through all trees at once; past that it is slower
+FLAT_FOREST_MAX_ROWS = int(os.getenv("FLAT_FOREST_MAX_ROWS", str(FlatForest.ALL_TREES_MAX_ROWS)))
+
+# FOREST_VOTING=exact or early adds class probabilities and the number of trees evaluated to
+# every prediction, computed on the flat forests (FlatForest.vote). exact walks every tree and
+# matches predict_proba; early stops a row's trees once its label can't change any more, or
+# once the leading class has FOREST_VOTING_CONFIDENCE of the votes (approximate) if that is set
+FOREST_VOTING = os.getenv("FOREST_VOTING", "off")
+FOREST_VOTING_CHUNK = int(os.getenv("FOREST_VOTING_CHUNK", "16"))
+FOREST_VOTING_CONFIDENCE = float(os.getenv("FOREST_VOTING_CONFIDENCE", "0")) or None
+if FOREST_VOTING not in ('off', 'exact', 'early'):
+    raise ValueError(f"FOREST_VOTING must be off, exact or early, got {FOREST_VOTING!r}")
+
+# /explain: per-feature contributions to each prediction from the contribution index stored
+# in the model bundle (EXPLAIN=0 turns the endpoint off and skips loading the index)
+EXPLAIN = os.getenv("EXPLAIN", "1") == "1"
+
+# GET /drift: per input column counts of what the models are fed, answers the encoders have
+# never seen and the divergence from the training data (drift.py); reset when the models are
+# (re)loaded. DRIFT=0 turns it off. A column is reported as drifted once it has DRIFT_MIN_ROWS
+# answers and a divergence above DRIFT_THRESHOLD; DRIFT_TOP_K unseen answers are kept per column
+DRIFT = os.getenv("DRIFT", "1") == "1"
+DRIFT_THRESHOLD = float(os.getenv("DRIFT_THRESHOLD", "0.1"))
+DRIFT_MIN_ROWS = int(os.getenv("DRIFT_MIN_ROWS", "100"))
+DRIFT_TOP_K = int(os.getenv("DRIFT_TOP_K", "20"))
+
+# reload the models when their files change, polling every this many seconds (0 = only via /admin/reload)
+MODEL_WATCH_INTERVAL = float(os.getenv("MODEL_WATCH_INTERVAL", "0"))
+
+# model calls run on a dedicated pool (INFERENCE_EXECUTOR=thread or process): INFERENCE_WORKERS at once
+# (default: one per CPU) and at most INFERENCE_QUEUE_SIZE waiting, beyond that requests get a 503
+INFERENCE_EXECUTOR = os.getenv("INFERENCE_EXECUTOR", "thread")
+INFERENCE_WORKERS = int(os.getenv("INFERENCE_WORKERS", "0")) or None
+INFERENCE_QUEUE_SIZE = int(os.getenv("INFERENCE_QUEUE_SIZE", "64"))
+# seconds a rejected client is asked to wait before retrying
+INFERENCE_RETRY_AFTER = int(os.getenv("INFERENCE_RETRY_AFTER", "1"))
+
 # Get the directory of the current file (api.py)
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 # Path to models directory
-MODELS_DIR = os.path.join(BASE_DIR, '..', 'models')
-
-# loading all the models here so we don't have to do it every time
-print("Loading models...")
-try:
-    condition_model = joblib.load(os.path.join(MODELS_DIR, 'condition_model.pkl'))
-    treatment_model = joblib.load(os.path.join(MODELS_DIR, 'treatment_model.pkl'))
-    le_condition = joblib.load(os.path.join(MODELS_DIR, 'le_condition.pkl'))
-    le_treatment = joblib.load(os.path.join(MODELS_DIR, 'le_treatment.pkl'))
-    encoders = joblib.load(os.path.join(MODELS_DIR, 'encoders.pkl'))
-    feature_cols = joblib.load(os.path.join(MODELS_DIR, 'feature_cols.pkl'))
-    print("Models loaded successfully.")
-except FileNotFoundError:
-    print("Error: Models not found. Please run train_model.py first.")
+MODELS_DIR = os.getenv("MODELS_DIR", os.path.join(BASE_DIR, '..', 'models'))
+
+def load_models():
+    # loading all the models here so we don't have to do it every time
+    # everything a prediction touches lives in one object, so a reload swaps it all at once
+    print("Loading models...")
+    try:
+        # the versioned bundle from train_model.py if there is one, else the separate pickles
+        artifacts = load_artifacts(MODELS_DIR, 'original')
+    except FileNotFoundError:
+        print("Error: Models not found. Please run train_model.py first.")
+        raise
+    except ValueError as e:
+        print(f"Error: Model bundle is invalid: {e}")
+        raise
+    # lookup tables are built once here instead of on every request
+    encoder = compile_encoders(artifacts.encoders)
+    if FAST_PATH and artifacts.source != 'bundle':
+        print("FAST_PATH: no model bundle, the separate pickles need pandas and sklearn.")
+    # the fast path keeps small batches on the flat forests. Bigger ones are about 2x faster in
+    # sklearn, which is only loaded when the first one comes in; without sklearn installed every
+    # batch stays on the flat forests
+    flat = FLAT_FOREST or FAST_PATH
+    max_rows = FLAT_FOREST_MAX_ROWS
+    if FAST_PATH and importlib.util.find_spec('sklearn') is None:
+        max_rows = MAX_BATCH_SIZE
+    models = SimpleNamespace(
+        artifacts=artifacts,
+        le_condition=artifacts.labels['condition'],
+        le_treatment=artifacts.labels['treatment'],
+        feature_cols=artifacts.feature_cols,
+        encoder=encoder,
+        # one forest answering both targets when training wrote a joint model, else None
+        joint_predictor=artifacts.joint_predictor(['condition', 'treatment'], encoder, flat=flat, max_rows=max_rows),
+        # whatever answers .predict(X) for each target
+        condition_predictor=artifacts.predictor('condition', encoder, flat=flat, max_rows=max_rows),
+        treatment_predictor=artifacts.predictor('treatment', encoder, flat=flat, max_rows=max_rows),
+        voters=voting_forests(artifacts, encoder) if FOREST_VOTING != 'off' else None,
+        explainers=explainers(artifacts, ['condition', 'treatment'], encoder) if EXPLAIN else None,
+        drift=DriftMonitor(encoder, artifacts.drift_profile(), top_k=DRIFT_TOP_K) if DRIFT else None,
+        # one cache per process; entries are keyed on family and model version
+        cache=runtime.prediction_cache(PREDICTION_CACHE_SIZE, PREDICTION_CACHE_TTL) if PREDICTION_CACHE else None,
+    )
+    print(f"Models loaded successfully (version {artifacts.version} from {artifacts.source}, {artifacts.load_seconds * 1000:.0f} ms).")
+    return models
+
+def voting_forests(artifacts, encoder):
+    # [(flat forest, [(target, class labels of that output), ...]), ...] for FOREST_VOTING:
+    # the joint forest if there is one, else one forest per target
+    joint = artifacts.joint_name(['condition', 'treatment'])
+    voters = []
+    for name in ([joint] if joint is not None else ['condition', 'treatment']):
+        if artifacts.source == 'bundle':
+            # checked against sklearn when the bundle was written
+            forest = artifacts.load_forest(name)
+        else:
+            forest = FlatForest.from_sklearn(artifacts.model(name))
+            if not validate(forest, artifacts.model(name), sample_rows(encoder, artifacts.feature_cols)):
+                raise ValueError(f"Flat copy of the {name} model does not match sklearn")
+        targets = artifacts.joint.get(name, [name])
+        outputs = [(target, artifacts.labels[target].inverse_transform(forest.classes[a:b]))
+                   for target, a, b in zip(targets, forest.splits[:-1], forest.splits[1:])]
+        voters.append((forest, outputs))
+    return voters
+
+def warm_up(models):
+    # one small and one large batch of encoded rows, so both the flat and the sklearn path
+    # are loaded and exercised before the models go live
+    sample = sample_matrix if FAST_PATH else sample_rows
+    X = sample(models.encoder, models.feature_cols)
+    for rows in (X[:1], X):
+        if len(predict_encoded(rows, models)) != len(rows):
+            raise ValueError("Warm-up prediction returned the wrong number of rows")
+    if models.explainers is not None:
+        explain_targets(models.explainers, X[:1])
+
+def current_models():
+    # read once per request; a reload that lands meanwhile doesn't affect this request
+    models = reloader.current
+    if models is None:
+        raise HTTPException(status_code=503, detail="Models are not loaded")
+    return models
 
 class PatientData(BaseModel):
     Age: str  # using string for age just in case
@@ -57,50 +218,323 @@ class PatientData(BaseModel):
     mental_health_interview: str
     yoga: str
 
+def verify_api_key(x_api_key):
+    # Security check
+    secret_key = os.getenv("API_SECRET_KEY")
+    if secret_key and x_api_key != secret_key:
+        raise HTTPException(status_code=403, detail="Unauthorized access")
+
 @app.get("/")
 def read_root():
     return {"message": "Mental Health Diagnostics API is running"}
 
+def predict_frame(df, models=None, timer=NULL_TIMER):
+    # encode and predict a whole frame of questionnaires with one call per model
+    models = models or current_models()
+    with timer.stage('preprocess'):
+        df = preprocess_input(df, models.encoder)
+        X = models.encoder.features(df, models.feature_cols)
+    return predict_features(X, models, timer)
+
+def encode_rows(rows, models, timer=NULL_TIMER):
+    # validated PatientData dicts -> encoded feature rows: a numpy array on the fast path,
+    # else a DataFrame through preprocess_input
+    if FAST_PATH:
+        with timer.stage('preprocess'):
+            return models.encoder.encode_records(rows, models.feature_cols)
+    import pandas as pd
+    with timer.stage('dataframe'):
+        df = pd.DataFrame(rows)
+    with timer.stage('preprocess'):
+        df = preprocess_input(df, models.encoder)
+        return models.encoder.features(df, models.feature_cols)
+
+def predict_features(X, models, timer=NULL_TIMER):
+    if models.cache is None:
+        return predict_encoded(X, models, timer)
+    return models.cache.predict(X, lambda rows: predict_encoded(rows, models, timer), ('original', models.artifacts.version))
+
+def predict_encoded(X, models, timer=NULL_TIMER):
+    # one (condition, treatment) pair per row of the encoded feature matrix, plus the
+    # probabilities and trees evaluated with FOREST_VOTING
+    metrics.inc('rows_predicted_total', len(X), {'family': 'original'})
+    if models.voters is not None:
+        with timer.stage('vote'):
+            return vote_encoded(X, models)
+    if models.joint_predictor is not None:
+        # one walk through one forest yields both labels
+        with timer.stage('predict_joint'):
+            idxs = models.joint_predictor.predict(X)
+        cond_idxs, treat_idxs = idxs[:, 0], idxs[:, 1]
+    else:
+        with timer.stage('predict_condition'):
+            cond_idxs = models.condition_predictor.predict(X)
+        with timer.stage('predict_treatment'):
+            treat_idxs = models.treatment_predictor.predict(X)
+    with timer.stage('decode'):
+        conditions = models.le_condition.inverse_transform(cond_idxs)
+        treatments = models.le_treatment.inverse_transform(treat_idxs)
+    return list(zip(conditions, treatments))
+
+def vote_encoded(X, models):
+    labels = {}
+    details = [{"probabilities": {}, "trees_evaluated": {}} for _ in range(len(X))]
+    for forest, outputs in models.voters:
+        proba, trees = forest.vote(X, chunk=FOREST_VOTING_CHUNK, confidence=FOREST_VOTING_CONFIDENCE,
+                                   early_exit=FOREST_VOTING == 'early')
+        if forest.n_outputs == 1:
+            proba = [proba]
+        for (target, classes), p in zip(outputs, proba):
+            # the label predict() would give: first class with the highest probability
+            labels[target] = classes[np.argmax(p, axis=1)]
+            for i, row in enumerate(p.tolist()):
+                details[i]["probabilities"][target] = dict(zip(classes.tolist(), row))
+                details[i]["trees_evaluated"][target] = int(trees[i])
+    return list(zip(labels['condition'], labels['treatment'], details))
+
+def observe_inputs(rows, models):
+    # counted on the request's own thread, before caching, batching or worker processes
+    if models.drift is not None:
+        with current_timer.get().stage('drift'):
+            models.drift.observe_records(rows)
+
+def predict_rows(rows, models=None, timer=NULL_TIMER):
+    models = models or current_models()
+    return predict_features(encode_rows(rows, models, timer), models, timer)
+
+def explain_rows(rows, models=None, timer=NULL_TIMER):
+    # one explanation per questionnaire: the predicted labels and, per target, how much each
+    # PatientData field moved the probability of the predicted class away from the baseline
+    models = models or current_models()
+    X = encode_rows(rows, models, timer)
+    metrics.inc('rows_explained_total', len(X), {'family': 'original'})
+    with timer.stage('explain'):
+        explained = explain_targets(models.explainers, X)
+    # training features the API doesn't take are always filled in with 0 (encoder.features);
+    # their share is reported as one number so everything adds up to the probability
+    fields = [(field, models.feature_cols.index(field)) for field in PatientData.model_fields if field in models.feature_cols]
+    defaulted = [i for i, col in enumerate(models.feature_cols) if col not in PatientData.model_fields]
+    results = []
+    for i in range(len(X)):
+        result = {}
+        for target, (labels, probability, baseline, contributions) in explained.items():
+            row = contributions[i]
+            result[target] = {
+                "label": labels[i],
+                "probability": float(probability[i]),
+                "baseline": float(baseline[i]),
+                # biggest effect first
+                "contributions": dict(sorted(((field, float(row[j])) for field, j in fields),
+                                             key=lambda item: -abs(item[1]))),
+                "defaulted_features": float(row[defaulted].sum()),
+            }
+        results.append(result)
+    return results
+
+startup.imported()
+
+reloader = ModelReloader(load_models, warm_up)
+reloader.reload()
+if MODEL_WATCH_INTERVAL > 0:
+    reloader.watch(lambda: artifact_signature(MODELS_DIR, 'original'), MODEL_WATCH_INTERVAL)
+
+executor = runtime.executor(INFERENCE_EXECUTOR, INFERENCE_WORKERS, INFERENCE_QUEUE_SIZE, INFERENCE_RETRY_AFTER)
+if executor.kind == 'process':
+    # workers are forked with the models already loaded, so a reload (or unload) needs fresh workers
+    reloader.listeners.append(lambda models: executor.restart())
+
+batcher = None
+if MICRO_BATCHING:
+    if executor.kind == 'process':
+        print("MICRO_BATCHING is ignored with INFERENCE_EXECUTOR=process.")
+    else:
+        # a coalesced batch belongs to no single request, so its stages only go to /metrics
+        batcher = MicroBatcher(lambda rows: predict_rows(rows, timer=StageTimer(metrics) if METRICS else NULL_TIMER),
+                               max_batch_size=MICRO_BATCH_MAX_SIZE, max_wait_ms=MICRO_BATCH_MAX_WAIT_MS)
+
+async def run_inference(rows, models):
+    # the model work happens on the inference executor, never on the event loop
+    with startup.first_request():
+        if executor.kind == 'process':
+            # worker processes predict with the models they were forked with (their stage timings
+            # stay in the worker)
+            return await executor.run(predict_rows, rows)
+        if batcher is not None and len(rows) == 1:
+            # the micro-batcher thread does the work, the executor only bounds how many wait for it
+            return [await executor.run_future(lambda: batcher.enqueue(rows[0]))]
+        return await executor.run(predict_rows, rows, models, current_timer.get())
+
+async def run_explain(rows, models):
+    with startup.first_request():
+        if executor.kind == 'process':
+            return await executor.run(explain_rows, rows)
+        return await executor.run(explain_rows, rows, models, current_timer.get())
+
+@app.exception_handler(Overloaded)
+async def overloaded_handler(request, exc):
+    return JSONResponse(status_code=503, content={"detail": str(exc)}, headers={"Retry-After": str(exc.retry_after)})
+
 @app.post("/predict")
-def predict_condition(data: PatientData, x_api_key: str = Header(None)):
-    # Security check
-    secret_key = os.getenv("API_SECRET_KEY")
-    if secret_key and x_api_key != secret_key:
-        raise HTTPException(status_code=403, detail="Unauthorized access")
+async def predict_condition(data: PatientData, x_api_key: str = Header(None)):
+    # FastAPI has already read and validated the body by now
+    current_timer.get().since_start('parse')
+    verify_api_key(x_api_key)
             
     # making it a dict
     input_data = data.model_dump()
-    
-    # Create DataFrame
-    df = pd.DataFrame([input_data])
-    
-    # --- doing the same preprocessing stuff as before ---
-    df = preprocess_input(df, encoders)
-
-    # making sure columns are right
-    # Add missing columns if any (though Pydantic ensures we get what we expect)
-    for col in feature_cols:
-        if col not in df.columns:
-            df[col] = 0
-            
-    X = df[feature_cols]
+    models = current_models()
+    observe_inputs([input_data], models)
     
     # --- time to predict! ---
     try:
-        # Condition
-        cond_idx = condition_model.predict(X)[0]
-        condition = le_condition.inverse_transform([cond_idx])[0]
-        
-        # Treatment
-        treat_idx = treatment_model.predict(X)[0]
-        treatment = le_treatment.inverse_transform([treat_idx])[0]
+        condition, treatment, *details = (await run_inference([input_data], models))[0]
         
-        return {
+        response = {
             "predicted_condition": condition,
             "treatment_needed": treatment
         }
+        # FOREST_VOTING: probabilities and trees evaluated per target
+        for extra in details:
+            response.update(extra)
+        return response
+    except Overloaded:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/predict/batch")
+async def predict_batch(items: List[Any] = Body(...), x_api_key: str = Header(None)):
+    # the body is only parsed as JSON here, the items are validated below
+    timer = current_timer.get()
+    timer.since_start('parse')
+    verify_api_key(x_api_key)
+
+    if len(items) > MAX_BATCH_SIZE:
+        raise HTTPException(status_code=413, detail=f"Batch too large: {len(items)} items, limit is {MAX_BATCH_SIZE}")
+
+    # validate every item on its own so one bad questionnaire doesn't fail the batch
+    results = [None] * len(items)
+    valid_idx = []
+    valid_rows = []
+    with timer.stage('validate'):
+        for i, item in enumerate(items):
+            try:
+                valid_rows.append(PatientData.model_validate(item).model_dump())
+                valid_idx.append(i)
+            except ValidationError as e:
+                results[i] = {
+                    "index": i,
+                    "success": False,
+                    "errors": [{"loc": list(err["loc"]), "msg": err["msg"], "type": err["type"]} for err in e.errors()]
+                }
+
+    if valid_rows:
+        models = current_models()
+        observe_inputs(valid_rows, models)
+        try:
+            predictions = await run_inference(valid_rows, models)
+        except Overloaded:
+            raise
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(e))
+
+        for n, i in enumerate(valid_idx):
+            condition, treatment, *details = predictions[n]
+            results[i] = {
+                "index": i,
+                "success": True,
+                "predicted_condition": condition,
+                "treatment_needed": treatment
+            }
+            for extra in details:
+                results[i].update(extra)
+
+    return {"results": results}
+
+@app.post("/explain")
+async def explain_prediction(data: PatientData, x_api_key: str = Header(None)):
+    # same prediction as /predict, plus why: per target the probability of the predicted
+    # class = baseline + sum of the field contributions + defaulted_features
+    current_timer.get().since_start('parse')
+    verify_api_key(x_api_key)
+    if not EXPLAIN:
+        raise HTTPException(status_code=404, detail="Explanations are disabled")
+    models = current_models()
+    rows = [data.model_dump()]
+    observe_inputs(rows, models)
+    try:
+        explanation = (await run_explain(rows, models))[0]
+    except Overloaded:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    return {
+        "predicted_condition": explanation["condition"]["label"],
+        "treatment_needed": explanation["treatment"]["label"],
+        "explanations": explanation,
+    }
+
+@app.get("/cache/stats")
+def cache_stats():
+    models = reloader.current
+    if models is None or models.cache is None:
+        return {"enabled": False}
+    return models.cache.stats()
+
+@app.get("/metrics")
+def metrics_endpoint():
+    if not METRICS:
+        raise HTTPException(status_code=404, detail="Metrics are disabled")
+    collect_runtime(metrics, reloader, executor, 'original')
+    startup.collect(metrics, 'original')
+    collect_drift(metrics, reloader, 'original')
+    return Response(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.get("/drift")
+def drift_report():
+    # how far each input column has moved from the training data since the models were loaded
+    if not DRIFT:
+        raise HTTPException(status_code=404, detail="Drift monitoring is disabled")
+    models = current_models()
+    return dict(models.drift.report(DRIFT_THRESHOLD, DRIFT_MIN_ROWS), model_version=models.artifacts.version)
+
+@app.get("/executor/stats")
+def executor_stats():
+    return executor.stats()
+
+@app.get("/model")
+def model_info():
+    # active model version and how long it took to load, for checking rollouts
+    return reloader.status()
+
+@app.get("/startup")
+def startup_info():
+    # cold start timings: import, model load and warm-up, first prediction
+    return dict(startup.status(), model_load_seconds=reloader.load_seconds, fast_path=FAST_PATH)
+
+@app.post("/admin/reload")
+def reload_models(wait: bool = False, x_api_key: str = Header(None)):
+    # loads and warms up the new models next to the old ones; requests keep being served
+    # by the old version until the new one is swapped in
+    verify_api_key(x_api_key)
+    if not wait:
+        started = reloader.reload_in_background()
+        return {"started": started, "model": reloader.status()}
+    reloaded = reloader.reload(blocking=False)
+    if reloaded is None:
+        raise HTTPException(status_code=409, detail="A reload is already running")
+    if not reloaded:
+        raise HTTPException(status_code=500, detail=f"Reload failed, models unchanged: {reloader.last_error}")
+    return {"started": True, "model": reloader.status()}
+
+@app.post("/admin/unload")
+def unload_models(x_api_key: str = Header(None)):
+    # drops the models of this API so their memory is freed once in-flight requests finish;
+    # predictions get a 503 until /admin/reload loads them again
+    verify_api_key(x_api_key)
+    if not reloader.unload():
+        raise HTTPException(status_code=409, detail="A reload is running")
+    return {"model": reloader.status()}
 
 if __name__ == "__main__":
     import uvicorn
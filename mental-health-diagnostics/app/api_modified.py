@@ -1,19 +1,77 @@
-from fastapi import FastAPI, HTTPException, Header
+import time
+# read before anything heavy is imported, for the startup timings (GET /startup)
+IMPORT_STARTED = time.perf_counter()
+
+from fastapi import FastAPI, HTTPException, Header, Body
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from fastapi.responses import JSONResponse, Response
+from pydantic import BaseModel, ValidationError
+from typing import Any, List
 import pandas as pd
-import joblib
 import os
+from types import SimpleNamespace
 from dotenv import load_dotenv
 
 try:
-    from app.data_utils_modified import clean_gender, preprocess_input
+    from app.data_utils_modified import clean_gender, preprocess_input, compile_encoders
+except ImportError:
+    from data_utils_modified import clean_gender, preprocess_input, compile_encoders
+
+try:
+    from app.micro_batcher import MicroBatcher
 except ImportError:
-    from data_utils_modified import clean_gender, preprocess_input
+    from micro_batcher import MicroBatcher
+
+try:
+    from app.answer_table import AnswerTable
+except ImportError:
+    from answer_table import AnswerTable
+
+try:
+    from app.model_bundle import load_artifacts, artifact_signature
+except ImportError:
+    from model_bundle import load_artifacts, artifact_signature
+
+try:
+    from app.model_reloader import ModelReloader
+except ImportError:
+    from model_reloader import ModelReloader
+
+try:
+    from app.flat_forest import FlatForest
+except ImportError:
+    from flat_forest import FlatForest
+
+try:
+    from app.inference_executor import Overloaded
+except ImportError:
+    from inference_executor import Overloaded
+
+try:
+    from app.metrics import collect_runtime, collect_drift, MetricsMiddleware, StageTimer, NULL_TIMER, current_timer, StartupClock
+except ImportError:
+    from metrics import collect_runtime, collect_drift, MetricsMiddleware, StageTimer, NULL_TIMER, current_timer, StartupClock
+
+try:
+    from app.drift import DriftMonitor
+except ImportError:
+    from drift import DriftMonitor
+
+try:
+    from app.flat_forest import sample_rows
+except ImportError:
+    from flat_forest import sample_rows
+
+try:
+    from app import runtime
+except ImportError:
+    import runtime
 
 # Load environment variables
 load_dotenv()
 
+startup = StartupClock(IMPORT_STARTED)
+
 app = FastAPI(title="Mental Health Diagnostics API (Modified)")
 
 app.add_middleware(
@@ -27,21 +85,110 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Prometheus metrics on /metrics (METRICS=0 turns them off); SERVER_TIMING=1 adds a per-request
+# Server-Timing header with the same stage timings
+METRICS = os.getenv("METRICS", "1") == "1"
+SERVER_TIMING = os.getenv("SERVER_TIMING", "0") == "1"
+
+# executor, metrics and prediction cache are shared with the other model family when both
+# are served from one process (service.py)
+metrics = runtime.metrics()
+if METRICS:
+    app.add_middleware(MetricsMiddleware, metrics=metrics, server_timing=SERVER_TIMING)
+
+# max number of questionnaires accepted by one /predict/batch call
+MAX_BATCH_SIZE = int(os.getenv("MAX_BATCH_SIZE", "1000"))
+
+# opt-in micro-batching: concurrent /predict calls are coalesced into one model call
+MICRO_BATCHING = os.getenv("MICRO_BATCHING", "0") == "1"
+MICRO_BATCH_MAX_SIZE = int(os.getenv("MICRO_BATCH_MAX_SIZE", "64"))
+MICRO_BATCH_MAX_WAIT_MS = float(os.getenv("MICRO_BATCH_MAX_WAIT_MS", "5"))
+
+# LRU cache of predictions keyed on the encoded feature row (PREDICTION_CACHE=0 turns it off)
+PREDICTION_CACHE = os.getenv("PREDICTION_CACHE", "1") == "1"
+PREDICTION_CACHE_SIZE = int(os.getenv("PREDICTION_CACHE_SIZE", "10000"))
+PREDICTION_CACHE_TTL = float(os.getenv("PREDICTION_CACHE_TTL", "3600"))
+
+# precomputed answers from answer_table.py, used when present and built for the loaded model
+ANSWER_TABLE = os.getenv("ANSWER_TABLE", "1") == "1"
+
+# FLAT_FOREST=1 serves predictions from flattened numpy copies of the forests (checked against sklearn at load)
+FLAT_FOREST = os.getenv("FLAT_FOREST", "0") == "1"
+# bigger batches than this still go to sklearn, which walks large batches faster. The default
+# is the most rows the flat forest walks through all trees at once; past that it is slower
+FLAT_FOREST_MAX_ROWS = int(os.getenv("FLAT_FOREST_MAX_ROWS", str(FlatForest.ALL_TREES_MAX_ROWS)))
+
+# GET /drift: per input column counts of what the model is fed, answers the encoders have
+# never seen and the divergence from the training data (drift.py), like api.py
+DRIFT = os.getenv("DRIFT", "1") == "1"
+DRIFT_THRESHOLD = float(os.getenv("DRIFT_THRESHOLD", "0.1"))
+DRIFT_MIN_ROWS = int(os.getenv("DRIFT_MIN_ROWS", "100"))
+DRIFT_TOP_K = int(os.getenv("DRIFT_TOP_K", "20"))
+
+# reload the models when their files change, polling every this many seconds (0 = only via /admin/reload)
+MODEL_WATCH_INTERVAL = float(os.getenv("MODEL_WATCH_INTERVAL", "0"))
+
+# model calls run on a dedicated pool (INFERENCE_EXECUTOR=thread or process): INFERENCE_WORKERS at once
+# (default: one per CPU) and at most INFERENCE_QUEUE_SIZE waiting, beyond that requests get a 503
+INFERENCE_EXECUTOR = os.getenv("INFERENCE_EXECUTOR", "thread")
+INFERENCE_WORKERS = int(os.getenv("INFERENCE_WORKERS", "0")) or None
+INFERENCE_QUEUE_SIZE = int(os.getenv("INFERENCE_QUEUE_SIZE", "64"))
+# seconds a rejected client is asked to wait before retrying
+INFERENCE_RETRY_AFTER = int(os.getenv("INFERENCE_RETRY_AFTER", "1"))
+
 # Get the directory of the current file (api.py)
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 # Path to models directory
-MODELS_DIR = os.path.join(BASE_DIR, '..', 'models')
+MODELS_DIR = os.getenv("MODELS_DIR", os.path.join(BASE_DIR, '..', 'models'))
 
-# loading all the models here so we don't have to do it every time
-print("Loading models...")
-try:
-    treatment_model = joblib.load(os.path.join(MODELS_DIR, 'treatment_model_modified.pkl'))
-    le_treatment = joblib.load(os.path.join(MODELS_DIR, 'le_treatment_modified.pkl'))
-    encoders = joblib.load(os.path.join(MODELS_DIR, 'encoders_modified.pkl'))
-    feature_cols = joblib.load(os.path.join(MODELS_DIR, 'feature_cols_modified.pkl'))
-    print("Models loaded successfully.")
-except FileNotFoundError:
-    print("Error: Models not found. Please run train_model_modified.py first.")
+def load_models():
+    # loading all the models here so we don't have to do it every time
+    # everything a prediction touches lives in one object, so a reload swaps it all at once
+    print("Loading models...")
+    try:
+        # the versioned bundle from train_model_modified.py if there is one, else the separate pickles
+        artifacts = load_artifacts(MODELS_DIR, 'modified')
+    except FileNotFoundError:
+        print("Error: Models not found. Please run train_model_modified.py first.")
+        raise
+    except ValueError as e:
+        print(f"Error: Model bundle is invalid: {e}")
+        raise
+    # lookup tables are built once here instead of on every request
+    encoder = compile_encoders(artifacts.encoders)
+    answer_table = None
+    if ANSWER_TABLE:
+        answer_table = AnswerTable.load(os.path.join(MODELS_DIR, 'answer_table_modified.npy'), artifacts.model_hash('treatment'), artifacts.encoders, artifacts.feature_cols)
+        if answer_table is not None:
+            print("Using precomputed answer table.")
+    models = SimpleNamespace(
+        artifacts=artifacts,
+        le_treatment=artifacts.labels['treatment'],
+        feature_cols=artifacts.feature_cols,
+        encoder=encoder,
+        answer_table=answer_table,
+        treatment_predictor=artifacts.predictor('treatment', encoder, flat=FLAT_FOREST, max_rows=FLAT_FOREST_MAX_ROWS),
+        drift=DriftMonitor(encoder, artifacts.drift_profile(), top_k=DRIFT_TOP_K) if DRIFT else None,
+        # one cache per process; entries are keyed on family and model version
+        cache=runtime.prediction_cache(PREDICTION_CACHE_SIZE, PREDICTION_CACHE_TTL) if PREDICTION_CACHE else None,
+    )
+    print(f"Models loaded successfully (version {artifacts.version} from {artifacts.source}, {artifacts.load_seconds * 1000:.0f} ms).")
+    return models
+
+def warm_up(models):
+    # one small and one large batch of encoded rows, so every prediction path is loaded and
+    # exercised before the models go live
+    X = sample_rows(models.encoder, models.feature_cols)
+    for rows in (X.iloc[:1], X):
+        if len(predict_encoded(rows, models)) != len(rows):
+            raise ValueError("Warm-up prediction returned the wrong number of rows")
+
+def current_models():
+    # read once per request; a reload that lands meanwhile doesn't affect this request
+    models = reloader.current
+    if models is None:
+        raise HTTPException(status_code=503, detail="Models are not loaded")
+    return models
 
 class PatientData(BaseModel):
     Gender: str
@@ -59,47 +206,217 @@ class PatientData(BaseModel):
     CareOptions: str
     MoodSwings: str = "Medium" # Default value if not provided
 
+def verify_api_key(x_api_key):
+    # Security check
+    secret_key = os.getenv("API_SECRET_KEY")
+    if secret_key and x_api_key != secret_key:
+        raise HTTPException(status_code=403, detail="Unauthorized access")
+
 @app.get("/")
 def read_root():
     return {"message": "Mental Health Diagnostics API (Modified) is running"}
 
+def predict_frame(df, models=None, timer=NULL_TIMER):
+    # encode and predict a whole frame of questionnaires with one call per model
+    models = models or current_models()
+    with timer.stage('preprocess'):
+        df = preprocess_input(df, models.encoder)
+        X = models.encoder.features(df, models.feature_cols)
+    if models.cache is None:
+        return predict_encoded(X, models, timer)
+    return models.cache.predict(X, lambda rows: predict_encoded(rows, models, timer), ('modified', models.artifacts.version))
+
+def predict_encoded(X, models, timer=NULL_TIMER):
+    metrics.inc('rows_predicted_total', len(X), {'family': 'modified'})
+    if models.answer_table is not None:
+        with timer.stage('answer_table'):
+            treat_idxs = models.answer_table.predict(X)
+    else:
+        with timer.stage('predict_treatment'):
+            treat_idxs = models.treatment_predictor.predict(X)
+    with timer.stage('decode'):
+        return list(models.le_treatment.inverse_transform(treat_idxs))
+
+def observe_inputs(rows, models):
+    # counted on the request's own thread, before caching, batching or worker processes
+    if models.drift is not None:
+        with current_timer.get().stage('drift'):
+            models.drift.observe_records(rows)
+
+def predict_rows(rows, models=None, timer=NULL_TIMER):
+    with timer.stage('dataframe'):
+        df = pd.DataFrame(rows)
+    return predict_frame(df, models, timer)
+
+startup.imported()
+
+reloader = ModelReloader(load_models, warm_up)
+reloader.reload()
+if MODEL_WATCH_INTERVAL > 0:
+    reloader.watch(lambda: artifact_signature(MODELS_DIR, 'modified'), MODEL_WATCH_INTERVAL)
+
+executor = runtime.executor(INFERENCE_EXECUTOR, INFERENCE_WORKERS, INFERENCE_QUEUE_SIZE, INFERENCE_RETRY_AFTER)
+if executor.kind == 'process':
+    # workers are forked with the models already loaded, so a reload (or unload) needs fresh workers
+    reloader.listeners.append(lambda models: executor.restart())
+
+batcher = None
+if MICRO_BATCHING:
+    if executor.kind == 'process':
+        print("MICRO_BATCHING is ignored with INFERENCE_EXECUTOR=process.")
+    else:
+        # a coalesced batch belongs to no single request, so its stages only go to /metrics
+        batcher = MicroBatcher(lambda rows: predict_rows(rows, timer=StageTimer(metrics) if METRICS else NULL_TIMER),
+                               max_batch_size=MICRO_BATCH_MAX_SIZE, max_wait_ms=MICRO_BATCH_MAX_WAIT_MS)
+
+async def run_inference(rows, models):
+    # the model work happens on the inference executor, never on the event loop
+    with startup.first_request():
+        if executor.kind == 'process':
+            # worker processes predict with the models they were forked with (their stage timings
+            # stay in the worker)
+            return await executor.run(predict_rows, rows)
+        if batcher is not None and len(rows) == 1:
+            # the micro-batcher thread does the work, the executor only bounds how many wait for it
+            return [await executor.run_future(lambda: batcher.enqueue(rows[0]))]
+        return await executor.run(predict_rows, rows, models, current_timer.get())
+
+@app.exception_handler(Overloaded)
+async def overloaded_handler(request, exc):
+    return JSONResponse(status_code=503, content={"detail": str(exc)}, headers={"Retry-After": str(exc.retry_after)})
+
 @app.post("/predict")
-def predict_condition(data: PatientData, x_api_key: str = Header(None)):
-    # Security check
-    secret_key = os.getenv("API_SECRET_KEY")
-    if secret_key and x_api_key != secret_key:
-        raise HTTPException(status_code=403, detail="Unauthorized access")
+async def predict_condition(data: PatientData, x_api_key: str = Header(None)):
+    # FastAPI has already read and validated the body by now
+    current_timer.get().since_start('parse')
+    verify_api_key(x_api_key)
             
     # making it a dict
     input_data = data.model_dump()
-    
-    # Create DataFrame
-    df = pd.DataFrame([input_data])
-    
-    # --- doing the same preprocessing stuff as before ---
-    df = preprocess_input(df, encoders)
-
-    # making sure columns are right
-    # Add missing columns if any (though Pydantic ensures we get what we expect)
-    for col in feature_cols:
-        if col not in df.columns:
-            df[col] = 0
-            
-    X = df[feature_cols]
+    models = current_models()
+    observe_inputs([input_data], models)
     
     # --- time to predict! ---
     try:
         # Treatment
-        treat_idx = treatment_model.predict(X)[0]
-        treatment = le_treatment.inverse_transform([treat_idx])[0]
+        treatment = (await run_inference([input_data], models))[0]
         
         return {
             "success": True,
             "treatment_needed": treatment
         }
+    except Overloaded:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/predict/batch")
+async def predict_batch(items: List[Any] = Body(...), x_api_key: str = Header(None)):
+    # the body is only parsed as JSON here, the items are validated below
+    timer = current_timer.get()
+    timer.since_start('parse')
+    verify_api_key(x_api_key)
+
+    if len(items) > MAX_BATCH_SIZE:
+        raise HTTPException(status_code=413, detail=f"Batch too large: {len(items)} items, limit is {MAX_BATCH_SIZE}")
+
+    # validate every item on its own so one bad questionnaire doesn't fail the batch
+    results = [None] * len(items)
+    valid_idx = []
+    valid_rows = []
+    with timer.stage('validate'):
+        for i, item in enumerate(items):
+            try:
+                valid_rows.append(PatientData.model_validate(item).model_dump())
+                valid_idx.append(i)
+            except ValidationError as e:
+                results[i] = {
+                    "index": i,
+                    "success": False,
+                    "errors": [{"loc": list(err["loc"]), "msg": err["msg"], "type": err["type"]} for err in e.errors()]
+                }
+
+    if valid_rows:
+        models = current_models()
+        observe_inputs(valid_rows, models)
+        try:
+            treatments = await run_inference(valid_rows, models)
+        except Overloaded:
+            raise
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(e))
+
+        for n, i in enumerate(valid_idx):
+            results[i] = {"index": i, "success": True, "treatment_needed": treatments[n]}
+
+    return {"results": results}
+
+@app.get("/cache/stats")
+def cache_stats():
+    models = reloader.current
+    if models is None or models.cache is None:
+        return {"enabled": False}
+    return models.cache.stats()
+
+@app.get("/metrics")
+def metrics_endpoint():
+    if not METRICS:
+        raise HTTPException(status_code=404, detail="Metrics are disabled")
+    collect_runtime(metrics, reloader, executor, 'modified')
+    startup.collect(metrics, 'modified')
+    collect_drift(metrics, reloader, 'modified')
+    return Response(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.get("/drift")
+def drift_report():
+    # how far each input column has moved from the training data since the models were loaded
+    if not DRIFT:
+        raise HTTPException(status_code=404, detail="Drift monitoring is disabled")
+    models = current_models()
+    return dict(models.drift.report(DRIFT_THRESHOLD, DRIFT_MIN_ROWS), model_version=models.artifacts.version)
+
+@app.get("/executor/stats")
+def executor_stats():
+    return executor.stats()
+
+@app.get("/startup")
+def startup_info():
+    # cold start timings: import, model load and warm-up, first prediction
+    return dict(startup.status(), model_load_seconds=reloader.load_seconds)
+
+@app.get("/model")
+def model_info():
+    # active model version and how long it took to load, for checking rollouts
+    models = reloader.current
+    status = reloader.status()
+    if models is not None:
+        status["answer_table"] = models.answer_table is not None
+    return status
+
+@app.post("/admin/reload")
+def reload_models(wait: bool = False, x_api_key: str = Header(None)):
+    # loads and warms up the new models next to the old ones; requests keep being served
+    # by the old version until the new one is swapped in
+    verify_api_key(x_api_key)
+    if not wait:
+        started = reloader.reload_in_background()
+        return {"started": started, "model": reloader.status()}
+    reloaded = reloader.reload(blocking=False)
+    if reloaded is None:
+        raise HTTPException(status_code=409, detail="A reload is already running")
+    if not reloaded:
+        raise HTTPException(status_code=500, detail=f"Reload failed, models unchanged: {reloader.last_error}")
+    return {"started": True, "model": reloader.status()}
+
+@app.post("/admin/unload")
+def unload_models(x_api_key: str = Header(None)):
+    # drops the models of this API so their memory is freed once in-flight requests finish;
+    # predictions get a 503 until /admin/reload loads them again
+    verify_api_key(x_api_key)
+    if not reloader.unload():
+        raise HTTPException(status_code=409, detail="A reload is running")
+    return {"model": reloader.status()}
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -1,86 +1,366 @@
 import pandas as pd
-import joblib
-from data_utils import clean_gender
+import numpy as np
+import argparse
+import json
+import os
+import sys
+import time
+import contextlib
+from collections import deque
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from data_utils import compile_encoders
+from flat_forest import FlatForest, export_model
+from contributions import explainers, explain_targets
+from drift import DriftMonitor
+from model_bundle import load_artifacts
+import table_io
 
-def batch_predict(input_file='../data/unlabeled_data.csv', output_file='../data/predictions.csv'):
-    print(f"Loading data from {input_file}...")
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+MODELS_DIR = os.path.join(BASE_DIR, '..', 'models')
+# flat exports of the separate pickles; a model bundle already carries its own
+FLAT_DIR = os.path.join(MODELS_DIR, 'flat')
+TARGETS = ['condition', 'treatment']
+# output column per target for --explain
+EXPLANATION_COLUMNS = {'condition': 'Condition_Explanation', 'treatment': 'Treatment_Explanation'}
+
+def load_models(flat=False, explain=None):
+    # with flat=True the forests are memory-mapped FlatForest arrays instead of sklearn models;
+    # with explain=N predictions come from the contribution index and every row gets its top N
+    # feature contributions per target
     try:
-        df = pd.read_csv(input_file)
+        artifacts = load_artifacts(MODELS_DIR, 'original')
+        models = {
+            'artifacts': artifacts,
+            'le_condition': artifacts.labels['condition'],
+            'le_treatment': artifacts.labels['treatment'],
+            'encoders': artifacts.encoders,
+            'feature_cols': artifacts.feature_cols,
+        }
+        # a joint forest (train_model.py --joint) predicts both targets in one pass
+        joint = artifacts.joint_name(TARGETS)
+        if joint is not None:
+            models['joint_model'] = artifacts.load_forest(joint) if flat else artifacts.load_model(joint)
+        else:
+            for target in TARGETS:
+                if not flat:
+                    models[f'{target}_model'] = artifacts.model(target)
+                elif artifacts.source == 'bundle':
+                    models[f'{target}_model'] = artifacts.forest(target)
+                else:
+                    models[f'{target}_model'] = FlatForest.load(os.path.join(FLAT_DIR, f'{target}_model'), mmap_mode='r')
     except FileNotFoundError:
-        print(f"File {input_file} not found.")
+        print("Models not found. Please run train_model.py first.")
+        return None
+    models['encoder'] = compile_encoders(models['encoders'])
+    if explain:
+        models['explainers'] = explainers(artifacts, TARGETS, models['encoder'])
+        models['explain_top'] = explain
+    return models
+
+def predict_chunk(df, models):
+    # Preprocess: gender, age and all categoricals in one vectorized pass per column
+    encoder = models['encoder']
+    X = encoder.transform(df.copy())
+
+    # Reorder columns to match training
+    # Add missing columns with default values if necessary
+    X = encoder.features(X, models['feature_cols'])
+
+    if 'explainers' in models:
+        return explain_chunk(df, X, models)
+
+    if 'joint_model' in models:
+        idxs = models['joint_model'].predict(X)
+        cond_idxs, treat_idxs = idxs[:, 0], idxs[:, 1]
+    else:
+        cond_idxs = models['condition_model'].predict(X)
+        treat_idxs = models['treatment_model'].predict(X)
+
+    # Add predictions to original dataframe
+    df['Predicted_Condition'] = models['le_condition'].inverse_transform(cond_idxs)
+    df['Treatment_Needed'] = models['le_treatment'].inverse_transform(treat_idxs)
+    return df
+
+def explain_chunk(df, X, models):
+    # same labels as predict_chunk, plus one JSON column per target with the features that
+    # moved the probability of the predicted class most (feature -> contribution)
+    explained = explain_targets(models['explainers'], X)
+    df['Predicted_Condition'] = explained['condition'][0]
+    df['Treatment_Needed'] = explained['treatment'][0]
+    feature_cols = list(models['feature_cols'])
+    for target, column in EXPLANATION_COLUMNS.items():
+        contributions = explained[target][3]
+        top = np.argsort(-np.abs(contributions), axis=1, kind='stable')[:, :models['explain_top']]
+        df[column] = [json.dumps({feature_cols[j]: round(float(row[j]), 4) for j in order})
+                      for row, order in zip(contributions, top)]
+    return df
+
+# --- parallel scoring ---
+# Workers never unpickle their own copy of the forests, so the tree data exists once no matter
+# how many workers run:
+# - where fork is available the parent loads the sklearn models once and forks the pool; the
+#   node buffers are only ever read, so every worker shares the parent's pages copy-on-write
+#   and keeps sklearn's compiled tree walk.
+# - otherwise (or with mmap_models=True) every worker memory-maps the same flat .npy node
+#   arrays through the page cache: the model bundle's own, or a one-off export of the separate
+#   pickles. The numpy walk is slower per core than sklearn's, so this is the fallback.
+# Chunks are handed out to the pool and collected back in input order, with at most two chunks
+# per worker in flight so memory stays bounded.
+
+worker_models = None
+
+def init_worker(flat, explain=None):
+    global worker_models
+    if flat:
+        worker_models = load_models(flat=True, explain=explain)
+
+def worker_predict(chunk):
+    return predict_chunk(chunk, worker_models)
+
+def export_flat_models(flat_dir=FLAT_DIR):
+    artifacts = load_artifacts(MODELS_DIR, 'original')
+    if artifacts.source == 'bundle':
         return
+    for target in TARGETS:
+        name = f'{target}_model'
+        if export_model(artifacts.model_paths[target], os.path.join(flat_dir, name), artifacts.model_hash(target)):
+            print(f"Exported {name} to {flat_dir}")
+
+def predict_chunks(chunks, workers=1, mmap_models=False, explain=None):
+    # yields the predicted chunks in input order
+    global worker_models
+    if workers <= 1:
+        models = load_models(explain=explain)
+        if models is None:
+            return
+        for chunk in chunks:
+            yield predict_chunk(chunk, models)
+        return
+
+    if mmap_models or 'fork' not in multiprocessing.get_all_start_methods():
+        try:
+            export_flat_models()
+        except FileNotFoundError:
+            print("Models not found. Please run train_model.py first.")
+            return
+        context = None
+        flat = True
+    else:
+        # loaded before the pool exists, so the forked workers inherit it
+        worker_models = load_models(explain=explain)
+        if worker_models is None:
+            return
+        context = multiprocessing.get_context('fork')
+        flat = False
+
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=init_worker, initargs=(flat, explain)) as pool:
+        pending = deque()
+        for chunk in chunks:
+            pending.append(pool.submit(worker_predict, chunk))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+# --- file formats ---
+# Input and output formats come from the file extensions (table_io.py): CSV, Parquet, Arrow or
+# JSONL, and '-' as the output streams JSONL to stdout for the next job in a pipe (progress
+# messages then go to stderr). Parquet and Arrow inputs are read column-pruned, only the feature
+# columns plus keep_columns, and the predicted labels are written dictionary-encoded.
+
+def table_options(artifacts, input_file, keep_columns=None):
+    # read options for the input and the categories of the output columns
+    read = {'categorical': list(artifacts.encoders)}
+    if table_io.file_format(input_file) in ('parquet', 'arrow'):
+        feature_cols = list(artifacts.feature_cols)
+        read['columns'] = feature_cols + [c for c in keep_columns or [] if c not in feature_cols]
+    categories = {
+        'Predicted_Condition': list(artifacts.labels['condition'].classes_),
+        'Treatment_Needed': list(artifacts.labels['treatment'].classes_),
+    }
+    return read, categories
+
+def print_summary(df):
+    print("\n--- Prediction Results ---")
+    print(f"{len(df)} rows")
+    for column in ('Predicted_Condition', 'Treatment_Needed'):
+        print(df[column].value_counts().to_string())
+
+# --- drift report ---
+# With drift_report, every predicted chunk is also counted by a DriftMonitor (drift.py) in the
+# parent process, and the report (divergence from the training data, unseen answers per
+# column) is written to that JSON file at the end. A resumed run only counts its own rows.
+
+def write_drift_report(monitor, path):
+    report = monitor.report()
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2)
+    drifted = report['drifted_features']
+    print(f"Drift report saved to {path} (max divergence {report['max_divergence']}, "
+          f"drifted: {', '.join(drifted) or 'none'})")
+
+def batch_predict(input_file='../data/unlabeled_data.csv', output_file='../data/predictions.csv', chunk_size=None, resume=False, workers=1, mmap_models=False, explain=None, keep_columns=None, drift_report=None):
+    args = (input_file, output_file, chunk_size, resume, workers, mmap_models, explain, keep_columns, drift_report)
+    if output_file == table_io.STDOUT:
+        # stdout carries the results, so everything else is printed to stderr
+        with contextlib.redirect_stdout(sys.stderr):
+            return batch_predict_file(*args)
+    return batch_predict_file(*args)
 
-    print("Loading models...")
+def batch_predict_file(input_file, output_file, chunk_size=None, resume=False, workers=1, mmap_models=False, explain=None, keep_columns=None, drift_report=None):
+    if not os.path.exists(input_file):
+        print(f"File {input_file} not found.")
+        return
     try:
-        condition_model = joblib.load('../models/condition_model.pkl')
-        treatment_model = joblib.load('../models/treatment_model.pkl')
-        le_condition = joblib.load('../models/le_condition.pkl')
-        le_treatment = joblib.load('../models/le_treatment.pkl')
-        encoders = joblib.load('../models/encoders.pkl')
-        feature_cols = joblib.load('../models/feature_cols.pkl')
+        artifacts = load_artifacts(MODELS_DIR, 'original')
     except FileNotFoundError:
         print("Models not found. Please run train_model.py first.")
         return
+    read, categories = table_options(artifacts, input_file, keep_columns)
+    monitor = DriftMonitor(compile_encoders(artifacts.encoders), artifacts.drift_profile()) if drift_report else None
+
+    if chunk_size:
+        stream_predict(input_file, output_file, chunk_size, resume=resume, workers=workers, mmap_models=mmap_models,
+                       explain=explain, read=read, categories=categories, monitor=monitor)
+        if monitor is not None and monitor.rows:
+            write_drift_report(monitor, drift_report)
+        return
+
+    print(f"Loading data from {input_file}...")
+    df = table_io.read_frame(input_file, **read)
 
     # Ensure all feature columns are present
     # If the CSV is missing some columns that were in training, we need to handle it.
     # assuming the csv is good for now
-    
-    X = df.copy()
-    
-    # Preprocess
-    # 1. Clean Gender
-    if 'Gender' in X.columns:
-        X['Gender'] = X['Gender'].apply(clean_gender)
-        
-    # 2. Handle Age
-    if 'Age' in X.columns:
-        X['Age'] = pd.to_numeric(X['Age'], errors='coerce')
-        X['Age'] = X['Age'].fillna(30)
-        
-    # 3. Encode categorical
-    for col, le in encoders.items():
-        if col in X.columns:
-            # Handle unseen labels
-            X[col] = X[col].fillna('Unknown')
-            
-            # Safe transform helper
-            known_labels = set(le.classes_)
-            def safe_transform(val):
-                if val in known_labels:
-                    return le.transform([val])[0]
-                else:
-                    if 'Unknown' in known_labels:
-                        return le.transform(['Unknown'])[0]
-                    return 0 # Fallback
-            
-            X[col] = X[col].apply(safe_transform)
 
-    # Reorder columns to match training
-    # Add missing columns with default values if necessary
-    for col in feature_cols:
-        if col not in X.columns:
-            X[col] = 0 # Or appropriate default
-            
-    X = X[feature_cols]
-    
     # Predict
-    print("Predicting...")
-    cond_idxs = condition_model.predict(X)
-    treat_idxs = treatment_model.predict(X)
-    
-    conditions = le_condition.inverse_transform(cond_idxs)
-    treatments = le_treatment.inverse_transform(treat_idxs)
-    
-    # Add predictions to original dataframe
-    df['Predicted_Condition'] = conditions
-    df['Treatment_Needed'] = treatments
-    
-    print("\n--- Prediction Results ---")
-    print(df[['Age', 'Gender', 'Predicted_Condition', 'Treatment_Needed']])
-    
-    df.to_csv(output_file, index=False)
-    print(f"\nFull results saved to {output_file}")
+    print("Loading models and predicting...")
+    parts = [df]
+    if workers > 1:
+        n_parts = max(1, min(len(df), 4 * workers))
+        parts = [df.iloc[i * len(df) // n_parts:(i + 1) * len(df) // n_parts].copy() for i in range(n_parts)]
+    parts = list(predict_chunks(parts, workers, mmap_models, explain))
+    if not parts:
+        return
+    df = pd.concat(parts)
+    if monitor is not None:
+        monitor.observe_frame(df)
+
+    print_summary(df)
+
+    writer = table_io.FrameWriter(output_file, categories)
+    try:
+        writer.write(df)
+    except BaseException:
+        writer.abort()
+        raise
+    writer.close()
+    if output_file != table_io.STDOUT:
+        print(f"\nFull results saved to {output_file}")
+    if monitor is not None:
+        write_drift_report(monitor, drift_report)
+
+# --- streaming mode ---
+# Reads, predicts and appends chunk_size rows at a time, so memory is bounded by the chunk
+# and not the file. After every chunk is flushed to disk a small checkpoint file records how
+# many input rows and output bytes are done; --resume truncates the output back to that point
+# (dropping any half-written chunk) and carries on from the next row. Only CSV and JSONL files
+# can be cut back like that, so Parquet, Arrow and stdout outputs are written without one.
+
+def checkpoint_path(output_file):
+    return output_file + '.progress'
+
+def input_signature(input_file):
+    stat = os.stat(input_file)
+    return {"input_file": os.path.abspath(input_file), "input_size": stat.st_size, "input_mtime": stat.st_mtime}
+
+def read_checkpoint(input_file, output_file):
+    path = checkpoint_path(output_file)
+    if not os.path.exists(path) or not os.path.exists(output_file):
+        return None
+    with open(path) as f:
+        state = json.load(f)
+    if any(state.get(k) != v for k, v in input_signature(input_file).items()):
+        print("Checkpoint was written for a different input file, starting over.")
+        return None
+    return state
+
+def write_checkpoint(output_file, state):
+    # write-then-rename so a crash never leaves a half-written checkpoint
+    path = checkpoint_path(output_file)
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(state, f)
+    os.replace(tmp, path)
+
+def stream_predict(input_file, output_file, chunk_size, resume=False, workers=1, mmap_models=False, explain=None, read=None, categories=None, monitor=None):
+    if not os.path.exists(input_file):
+        print(f"File {input_file} not found.")
+        return
+
+    # only CSV and JSONL outputs ever get a checkpoint
+    state = read_checkpoint(input_file, output_file) if resume else None
+    if state is not None:
+        print(f"Resuming after {state['rows_done']} rows...")
+        writer = table_io.FrameWriter(output_file, categories, offset=state['output_bytes'])
+    else:
+        state = dict(input_signature(input_file), rows_done=0, output_bytes=0)
+        if os.path.exists(checkpoint_path(output_file)):
+            # left by an earlier run; it no longer matches the output that's about to be rewritten
+            os.remove(checkpoint_path(output_file))
+        writer = table_io.FrameWriter(output_file, categories)
+
+    print(f"Streaming {input_file} in chunks of {chunk_size} rows...")
+    start = time.time()
+    rows_this_run = 0
+    reader = table_io.iter_frames(input_file, chunk_size, skip_rows=state['rows_done'], **(read or {}))
+    try:
+        for chunk in predict_chunks(reader, workers, mmap_models, explain):
+            writer.write(chunk)
+            if monitor is not None:
+                monitor.observe_frame(chunk)
+            state['rows_done'] += len(chunk)
+            rows_this_run += len(chunk)
+            if writer.resumable:
+                state['output_bytes'] = writer.tell()
+                write_checkpoint(output_file, state)
+
+            elapsed = time.time() - start
+            print(f"  {state['rows_done']} rows written ({rows_this_run / elapsed:.0f} rows/s)")
+    except BaseException:
+        writer.abort()
+        raise
+    writer.close()
+
+    if writer.resumable:
+        if not os.path.exists(checkpoint_path(output_file)):
+            # models were missing, nothing was written
+            return
+        os.remove(checkpoint_path(output_file))
+    elif rows_this_run == 0:
+        return
+    if output_file != table_io.STDOUT:
+        print(f"\nFull results saved to {output_file} ({state['rows_done']} rows in {time.time() - start:.1f}s)")
 
 if __name__ == "__main__":
-    batch_predict()
+    parser = argparse.ArgumentParser(description="Predict condition and treatment for a file of questionnaires "
+                                                 "(CSV, Parquet, Arrow or JSONL, picked from the extension)")
+    parser.add_argument('input_file', nargs='?', default='../data/unlabeled_data.csv')
+    parser.add_argument('output_file', nargs='?', default='../data/predictions.csv',
+                        help="'-' writes JSONL to stdout")
+    parser.add_argument('--chunk-size', type=int, default=None, help="stream the input this many rows at a time")
+    parser.add_argument('--resume', action='store_true', help="continue a streamed run from its last written chunk")
+    parser.add_argument('--workers', type=int, default=1, help="score chunks on this many processes")
+    parser.add_argument('--mmap-models', action='store_true', help="workers memory-map flat exports of the forests instead of sharing the parent's")
+    parser.add_argument('--explain', type=int, nargs='?', const=5, default=None, metavar='N',
+                        help="add the N (default 5) biggest feature contributions per target as JSON columns")
+    parser.add_argument('--keep-columns', default='', metavar='A,B',
+                        help="Parquet/Arrow input only reads the feature columns; also read and write these (e.g. an id)")
+    parser.add_argument('--drift-report', default=None, metavar='PATH',
+                        help="write how far the input columns are from the training data to this JSON file")
+    args = parser.parse_args()
+
+    batch_predict(args.input_file, args.output_file, chunk_size=args.chunk_size, resume=args.resume,
+                  workers=args.workers, mmap_models=args.mmap_models, explain=args.explain,
+                  keep_columns=[c for c in args.keep_columns.split(',') if c], drift_report=args.drift_report)
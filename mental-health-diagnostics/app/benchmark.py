@@ -0,0 +1,365 @@
+import argparse
+import contextlib
+import importlib.util
+import io
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import warnings
+import numpy as np
+import pandas as pd
+import sklearn
+
+import synthetic_data
+import data_utils
+import data_utils_modified
+import train_model
+import train_model_modified
+import batch_predict
+from model_bundle import ModelBundle, PickleArtifacts, FAMILIES, load_artifacts
+from contributions import explainers, explain_targets
+from drift import DriftMonitor
+
+# Benchmarks for the whole pipeline on synthetic data:
+#   train        train_model.py / train_model_modified.py wall time
+#   load         artifact load time (bundle manifest only, bundle with forests, separate pickles)
+#   preprocess   preprocess_input + feature ordering throughput, and the drift counters
+#   predict      single-row latency and batched throughput, sklearn and flat forests, and
+#                FlatForest.vote with every tree vs early exit, and /explain's contributions
+#   batch        batch_predict.py rows/s, in memory and streamed, and Parquet in and out when
+#                pyarrow is installed
+#   startup      cold start of api.py in a fresh interpreter, default path vs FAST_PATH
+#
+# Everything runs in a temporary workspace with fixed seeds, so two runs on the same machine
+# measure the same work. Results are written as JSON; --baseline (or the compare command)
+# checks them against an earlier file and exits with status 1 when something got slower.
+#
+#   python benchmark.py --output bench.json
+#   python benchmark.py --baseline bench.json
+#   python benchmark.py compare old.json new.json
+
+BENCH_FORMAT = 1
+GROUPS = ('train', 'load', 'preprocess', 'predict', 'batch', 'startup')
+
+# small grid so training finishes in seconds; --full-grid uses the training scripts' own
+QUICK_GRIDS = {
+    'original': {'n_estimators': [100], 'max_depth': [None, 10], 'min_samples_split': [2], 'min_samples_leaf': [1]},
+    'modified': {'n_estimators': [100], 'max_depth': [None, 10], 'min_samples_split': [2], 'min_samples_leaf': [1]},
+}
+TRAINERS = {'original': train_model, 'modified': train_model_modified}
+PREPROCESSORS = {'original': data_utils, 'modified': data_utils_modified}
+ROW_MAKERS = {'original': synthetic_data.original_rows, 'modified': synthetic_data.modified_rows}
+
+# run in a fresh interpreter by bench_startup: import api.py (which loads and warms up the
+# models), then one prediction; prints the timings as JSON on its last line
+STARTUP_SCRIPT = '''
+import json, sys, time
+start = time.perf_counter()
+import api
+ready = time.perf_counter() - start
+models = api.reloader.current
+row = {field: '35' if field == 'Age' else next(iter(models.encoder.tables[field])) for field in api.PatientData.model_fields}
+start = time.perf_counter()
+api.predict_rows([row])
+first = time.perf_counter() - start
+print(json.dumps({"import": api.startup.import_seconds, "ready": ready, "first_request": first,
+                  "heavy_modules": api.startup.heavy_modules()}))
+'''
+
+
+def timed(fn, repeat=5):
+    # median wall time of repeat runs, in seconds
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return float(np.median(times))
+
+
+@contextlib.contextmanager
+def quiet():
+    # the scripts under test print progress; keep it out of the benchmark output
+    with contextlib.redirect_stdout(io.StringIO()), warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        yield
+
+
+class Benchmark:
+    def __init__(self, workspace, rows, repeat, seed, full_grid=False):
+        self.workspace = workspace
+        self.data_dir = os.path.join(workspace, 'data')
+        self.models_dir = os.path.join(workspace, 'models')
+        self.rows = rows
+        self.repeat = repeat
+        self.seed = seed
+        self.full_grid = full_grid
+        self.results = {}
+
+    def record(self, name, value, unit, better):
+        self.results[name] = {"value": round(float(value), 6), "unit": unit, "better": better}
+        print(f"  {name:<45} {value:>14.3f} {unit}")
+
+    def encoded_rows(self, family, artifacts, n):
+        module = PREPROCESSORS[family]
+        encoder = module.compile_encoders(artifacts.encoders)
+        df = ROW_MAKERS[family](n, seed=self.seed + 1, labels=False)
+        return encoder.features(module.preprocess_input(df, encoder), artifacts.feature_cols)
+
+    def bench_train(self, train_rows):
+        print("train")
+        os.makedirs(self.models_dir, exist_ok=True)
+        synthetic_data.write_datasets(self.data_dir, train_rows, self.seed)
+        for family, module in TRAINERS.items():
+            grid = module.PARAM_GRID if self.full_grid else QUICK_GRIDS[family]
+            start = time.perf_counter()
+            with quiet():
+                module.train(data_dir=self.data_dir, models_dir=self.models_dir, param_grid=grid)
+            self.record(f"train.{family}.seconds", time.perf_counter() - start, 's', 'lower')
+
+    def bench_load(self):
+        print("load")
+        for family, spec in FAMILIES.items():
+            bundle_dir = os.path.join(self.models_dir, spec['bundle_dir'])
+            targets = list(spec['targets'])
+
+            def bundle_full():
+                bundle = ModelBundle(bundle_dir)
+                for target in targets:
+                    bundle.forest(target)
+                    bundle.model(target)
+
+            def pickles():
+                artifacts = PickleArtifacts(self.models_dir, family)
+                for target in targets:
+                    artifacts.model(target)
+
+            # repeated loads read from the page cache, so these are warm-cache numbers
+            for name, load in (('bundle_manifest', lambda: ModelBundle(bundle_dir)), ('bundle_full', bundle_full), ('pickles', pickles)):
+                with quiet():
+                    seconds = timed(load, self.repeat)
+                self.record(f"load.{family}.{name}.ms", seconds * 1000, 'ms', 'lower')
+
+    def bench_preprocess(self):
+        print("preprocess")
+        for family, module in PREPROCESSORS.items():
+            artifacts = load_artifacts(self.models_dir, family)
+            encoder = module.compile_encoders(artifacts.encoders)
+            df = ROW_MAKERS[family](self.rows, seed=self.seed + 1, labels=False)
+            seconds = timed(lambda: encoder.features(module.preprocess_input(df.copy(), encoder), artifacts.feature_cols), self.repeat)
+            self.record(f"preprocess.{family}.rows_per_s", self.rows / seconds, 'rows/s', 'higher')
+            if artifacts.drift_profile() is None:
+                continue
+            # drift counting for one API request and for a whole batch_predict chunk
+            monitor = DriftMonitor(encoder, artifacts.drift_profile())
+            records = df.iloc[:1].to_dict('records')
+            self.record(f"preprocess.{family}.drift_single.us", timed(lambda: monitor.observe_records(records), 200) * 1e6, 'us', 'lower')
+            seconds = timed(lambda: monitor.observe_frame(df), self.repeat)
+            self.record(f"preprocess.{family}.drift_frame.rows_per_s", self.rows / seconds, 'rows/s', 'higher')
+
+    def bench_predict(self, single_calls=200, batch_sizes=(64, 1000)):
+        print("predict")
+        for family, spec in FAMILIES.items():
+            artifacts = load_artifacts(self.models_dir, family)
+            X = self.encoded_rows(family, artifacts, max(batch_sizes))
+            encoder = PREPROCESSORS[family].compile_encoders(artifacts.encoders)
+            for kind in ('sklearn', 'flat'):
+                # a joint forest answers every target in one call
+                joint = artifacts.joint_predictor(list(spec['targets']), encoder, flat=kind == 'flat')
+                predictors = [joint] if joint is not None else [artifacts.predictor(target, encoder, flat=kind == 'flat')
+                                                                 for target in spec['targets']]
+                single = X.iloc[:1]
+                for predictor in predictors:
+                    predictor.predict(single)
+
+                latencies = []
+                for i in range(single_calls):
+                    row = X.iloc[i % len(X):i % len(X) + 1]
+                    start = time.perf_counter()
+                    for predictor in predictors:
+                        predictor.predict(row)
+                    latencies.append(time.perf_counter() - start)
+                self.record(f"predict.{family}.{kind}.single_p50.ms", np.percentile(latencies, 50) * 1000, 'ms', 'lower')
+                self.record(f"predict.{family}.{kind}.single_p95.ms", np.percentile(latencies, 95) * 1000, 'ms', 'lower')
+
+                for size in batch_sizes:
+                    batch = X.iloc[:size]
+                    seconds = timed(lambda: [predictor.predict(batch) for predictor in predictors], self.repeat)
+                    self.record(f"predict.{family}.{kind}.batch{size}.rows_per_s", size / seconds, 'rows/s', 'higher')
+
+            # per-feature contributions from the contribution index, to hold against the predictions above
+            explaining = explainers(artifacts, list(spec['targets']), encoder)
+            single = X.iloc[:1]
+            self.record(f"predict.{family}.explain.single_p50.ms",
+                        timed(lambda: explain_targets(explaining, single), single_calls) * 1000, 'ms', 'lower')
+            batch = X.iloc[:max(batch_sizes)]
+            seconds = timed(lambda: explain_targets(explaining, batch), self.repeat)
+            self.record(f"predict.{family}.explain.batch{len(batch)}.rows_per_s", len(batch) / seconds, 'rows/s', 'higher')
+
+            if artifacts.source != 'bundle':
+                continue
+            # FOREST_VOTING: every tree vs early exit on the flat forests, and the trees early exit needed
+            forests = [artifacts.load_forest(name) for name in {artifacts.forest_name(t)[0] for t in spec['targets']}]
+            batch = X.iloc[:max(batch_sizes)]
+            for mode, early_exit in (('exact', False), ('early', True)):
+                seconds = timed(lambda: [forest.vote(batch, early_exit=early_exit) for forest in forests], self.repeat)
+                self.record(f"predict.{family}.vote_{mode}.batch{len(batch)}.rows_per_s", len(batch) / seconds, 'rows/s', 'higher')
+            trees = np.mean([forest.vote(batch)[1].mean() / forest.n_trees for forest in forests])
+            self.record(f"predict.{family}.vote_early.trees_share", trees, 'share', 'lower')
+
+    def bench_batch(self, chunk_size=50000):
+        print("batch")
+        input_file = synthetic_data.write_csv(os.path.join(self.data_dir, 'unlabeled_data.csv'),
+                                              synthetic_data.original_rows, self.rows, self.seed + 2, labels=False)
+        output_file = os.path.join(self.data_dir, 'predictions.csv')
+        # batch_predict reads its models from this module global
+        batch_predict.MODELS_DIR = self.models_dir
+        with quiet():
+            seconds = timed(lambda: batch_predict.batch_predict(input_file, output_file), self.repeat)
+        self.record("batch.in_memory.rows_per_s", self.rows / seconds, 'rows/s', 'higher')
+        with quiet():
+            seconds = timed(lambda: batch_predict.batch_predict(input_file, output_file, chunk_size=chunk_size), self.repeat)
+        self.record("batch.streamed.rows_per_s", self.rows / seconds, 'rows/s', 'higher')
+        # Parquet needs pyarrow, which is optional
+        if importlib.util.find_spec('pyarrow') is None:
+            return
+        parquet_input = os.path.join(self.data_dir, 'unlabeled_data.parquet')
+        pd.read_csv(input_file).to_parquet(parquet_input, index=False)
+        parquet_output = os.path.join(self.data_dir, 'predictions.parquet')
+        with quiet():
+            seconds = timed(lambda: batch_predict.batch_predict(parquet_input, parquet_output), self.repeat)
+        self.record("batch.parquet.rows_per_s", self.rows / seconds, 'rows/s', 'higher')
+
+    def bench_startup(self):
+        print("startup")
+        app_dir = os.path.dirname(os.path.abspath(__file__))
+        for mode, fast_path in (('default', '0'), ('fast_path', '1')):
+            env = dict(os.environ, MODELS_DIR=self.models_dir, FAST_PATH=fast_path, MODEL_WATCH_INTERVAL='0')
+            runs = []
+            for _ in range(self.repeat):
+                out = subprocess.run([sys.executable, '-c', STARTUP_SCRIPT], cwd=app_dir, env=env,
+                                     capture_output=True, text=True, check=True).stdout
+                runs.append(json.loads(out.strip().splitlines()[-1]))
+            # import: the API module's own imports; ready: import including model load and warm-up
+            for key in ('import', 'ready', 'first_request'):
+                self.record(f"startup.original.{mode}.{key}.ms", np.median([r[key] for r in runs]) * 1000, 'ms', 'lower')
+            print(f"    heavy modules loaded: {', '.join(runs[-1]['heavy_modules']) or 'none'}")
+
+
+def environment():
+    return {
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+        "sklearn": sklearn.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def compare(baseline, current, tolerance=0.1):
+    # returns the names of the benchmarks that got worse by more than tolerance
+    if baseline.get("config") != current.get("config"):
+        print("Warning: the runs used different settings, the numbers may not be comparable.")
+    if baseline.get("environment") != current.get("environment"):
+        print("Warning: the runs come from different environments.")
+
+    regressions = []
+    print(f"{'benchmark':<45} {'baseline':>12} {'current':>12} {'change':>8}")
+    for name, new in current["results"].items():
+        old = baseline["results"].get(name)
+        if old is None or not old["value"]:
+            print(f"{name:<45} {'-':>12} {new['value']:>12.3f}      new")
+            continue
+        change = new["value"] / old["value"] - 1
+        worse = change < -tolerance if new["better"] == 'higher' else change > tolerance
+        flag = '  REGRESSION' if worse else ''
+        print(f"{name:<45} {old['value']:>12.3f} {new['value']:>12.3f} {change:>+8.1%}{flag}")
+        if worse:
+            regressions.append(name)
+    for name in baseline["results"]:
+        if name not in current["results"]:
+            print(f"{name:<45} missing from the current run")
+    print(f"\n{len(regressions)} regression(s) beyond {tolerance:.0%}.")
+    return regressions
+
+
+def run(args):
+    workspace = tempfile.mkdtemp(prefix='nura-bench-')
+    bench = Benchmark(workspace, args.rows, args.repeat, args.seed, args.full_grid)
+    groups = args.only.split(',') if args.only else GROUPS
+    try:
+        if args.models_dir:
+            shutil.copytree(args.models_dir, bench.models_dir)
+        else:
+            # later groups need trained models, so training always runs; it's only reported when asked for
+            if 'train' not in groups:
+                with quiet():
+                    bench.bench_train(args.train_rows)
+                bench.results.clear()
+            else:
+                bench.bench_train(args.train_rows)
+        for group in groups:
+            if group != 'train':
+                getattr(bench, f'bench_{group}')()
+    finally:
+        if args.keep:
+            print(f"Workspace kept at {workspace}")
+        else:
+            shutil.rmtree(workspace, ignore_errors=True)
+
+    return {
+        "format": BENCH_FORMAT,
+        "created_at": time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        "config": {"rows": args.rows, "train_rows": args.train_rows, "repeat": args.repeat, "seed": args.seed,
+                   "full_grid": args.full_grid, "models_dir": bool(args.models_dir), "groups": list(groups)},
+        "environment": environment(),
+        "results": bench.results,
+    }
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == 'compare':
+        parser = argparse.ArgumentParser(prog='benchmark.py compare', description="Compare two benchmark result files")
+        parser.add_argument('baseline')
+        parser.add_argument('current')
+        parser.add_argument('--tolerance', type=float, default=0.1, help="allowed slowdown before flagging, as a fraction")
+        args = parser.parse_args(sys.argv[2:])
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        with open(args.current) as f:
+            current = json.load(f)
+        sys.exit(1 if compare(baseline, current, args.tolerance) else 0)
+
+    parser = argparse.ArgumentParser(description="Benchmark preprocessing, inference, loading and training")
+    parser.add_argument('--rows', type=int, default=100000, help="rows for the preprocess and batch benchmarks")
+    parser.add_argument('--train-rows', type=int, default=5000, help="rows of synthetic training data per family")
+    parser.add_argument('--repeat', type=int, default=5, help="timed runs per benchmark, the median is reported")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--full-grid', action='store_true', help="train with the full hyperparameter grids of the training scripts")
+    parser.add_argument('--models-dir', help="benchmark these trained models instead of training on synthetic data")
+    parser.add_argument('--only', help=f"comma separated subset of {','.join(GROUPS)}")
+    parser.add_argument('--output', help="write the results to this JSON file")
+    parser.add_argument('--baseline', help="compare against this earlier results file")
+    parser.add_argument('--tolerance', type=float, default=0.1, help="allowed slowdown before flagging, as a fraction")
+    parser.add_argument('--keep', action='store_true', help="keep the temporary workspace")
+    args = parser.parse_args()
+
+    if args.only and not set(args.only.split(',')) <= set(GROUPS):
+        parser.error(f"--only takes a subset of {','.join(GROUPS)}")
+
+    report = run(args)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"\nResults saved to {args.output}")
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        print()
+        sys.exit(1 if compare(baseline, report, args.tolerance) else 0)
@@ -0,0 +1,311 @@
+import argparse
+import copy
+import json
+import os
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+import joblib
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.model_selection import train_test_split
+import feature_cache
+from flat_forest import FlatForest, sample_rows
+from incremental_train import PREPROCESSORS, LABEL_COLUMNS, stored_forests, load_forest, encode_labels, pad_classes, accuracy
+from joint_model import median_seconds, flat_bytes, pickled_size
+from model_bundle import FAMILIES, load_artifacts, write_bundle
+
+# Smaller versions of the trained forests, for when serving latency or memory matters more
+# than the last bit of accuracy. Three kinds of variant are built for every stored forest:
+#
+#   trees-K        the K trees that best reproduce the full forest's probabilities, picked
+#                  greedily one at a time on training rows (a random K would need more trees
+#                  for the same agreement)
+#   depth-D        every tree cut off at depth D; the cut nodes become leaves holding the class
+#                  distribution they already store, so no retraining and no new splits
+#   distill-TxD    a new forest of T trees of depth D trained on the original forest's own
+#                  predictions, over the training rows plus random answer combinations
+#
+# Every variant is scored on the held-out test rows of the training split (same
+# train_test_split as train_model.py): accuracy against the labels, agreement with the
+# original forest's predictions (also on random rows), single-row and batch latency for
+# sklearn and the flat path, and pickle / flat array size. The report goes to
+# models/compaction_report.json. With --save the chosen variant (the smallest one that still
+# agrees with the original on --min-agreement of the test rows, or --pick) replaces the model
+# in the bundle and the separate pickles, where the API and batch jobs pick it up.
+#
+#   python compact_forest.py --trees 10,25,50 --depths 8,12 --distill 25x12 --min-agreement 0.99 --save
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DATA_DIR = os.path.join(BASE_DIR, '..', 'data')
+MODELS_DIR = os.path.join(BASE_DIR, '..', 'models')
+
+DATASETS = {'original': 'dataset.csv', 'modified': 'Mental Health dataset.csv'}
+REPORTS = {'original': 'compaction_report.json', 'modified': 'compaction_report_modified.json'}
+# training rows used to pick trees; the greedy search holds every tree's probabilities for them
+SELECT_ROWS = 4000
+
+
+def as_float(X):
+    # forests are fitted on float32 arrays, the trees inside them take plain arrays
+    return np.ascontiguousarray(np.asarray(X, dtype=np.float32))
+
+
+def tree_proba(estimator, X):
+    # one row per sample, the class probabilities of all outputs side by side
+    proba = estimator.predict_proba(X)
+    return np.hstack(proba) if isinstance(proba, list) else proba
+
+
+def select_trees(model, X, max_trees):
+    # greedy forward selection: each step adds the tree that brings the mean probabilities of
+    # the trees picked so far closest (squared error) to the full forest's; returns tree indices
+    X = as_float(X)
+    per_tree = np.stack([tree_proba(est, X) for est in model.estimators_])
+    target = per_tree.mean(axis=0)
+    total = np.zeros_like(target)
+    picked = []
+    remaining = list(range(len(per_tree)))
+    for k in range(min(max_trees, len(per_tree))):
+        errors = (((total + per_tree[remaining]) / (k + 1) - target) ** 2).sum(axis=(1, 2))
+        best = remaining.pop(int(np.argmin(errors)))
+        picked.append(best)
+        total += per_tree[best]
+    return picked
+
+
+def with_trees(model, indices):
+    compact = copy.copy(model)
+    compact.estimators_ = [model.estimators_[i] for i in indices]
+    compact.n_estimators = len(indices)
+    return compact
+
+
+def truncate_tree(tree, max_depth):
+    # a copy of an sklearn Tree with every node below max_depth removed; nodes at max_depth
+    # become leaves. Rebuilt from the tree's pickled state so the dropped nodes are freed.
+    cls, args, state = tree.__reduce__()
+    nodes, values = state['nodes'], state['values']
+    left, right = nodes['left_child'], nodes['right_child']
+    depth = np.full(state['node_count'], -1)
+    depth[0] = 0
+    level = np.array([0])
+    while len(level):
+        level = level[left[level] != -1]
+        children = np.concatenate([left[level], right[level]])
+        depth[children] = np.concatenate([depth[level] + 1] * 2)
+        level = children[depth[children] < max_depth]
+
+    keep = (depth >= 0) & (depth <= max_depth)
+    new_index = np.cumsum(keep) - 1
+    kept = nodes[keep].copy()
+    leaf = (kept['left_child'] == -1) | (depth[keep] == max_depth)
+    kept['left_child'] = np.where(leaf, -1, new_index[np.where(leaf, 0, kept['left_child'])])
+    kept['right_child'] = np.where(leaf, -1, new_index[np.where(leaf, 0, kept['right_child'])])
+    kept['feature'] = np.where(leaf, -2, kept['feature'])
+    kept['threshold'] = np.where(leaf, -2.0, kept['threshold'])
+
+    truncated = cls(*args)
+    truncated.__setstate__(dict(state, node_count=int(keep.sum()), nodes=kept,
+                                values=np.ascontiguousarray(values[keep]),
+                                max_depth=int(min(max_depth, state['max_depth']))))
+    return truncated
+
+
+def with_depth(model, max_depth):
+    compact = copy.copy(model)
+    compact.estimators_ = []
+    for est in model.estimators_:
+        est = copy.copy(est)
+        est.tree_ = truncate_tree(est.tree_, max_depth)
+        est.max_depth = max_depth
+        compact.estimators_.append(est)
+    compact.max_depth = max_depth
+    return compact
+
+
+def distill(model, X, n_trees, max_depth, seed=0):
+    # a forest fitted on the original forest's predictions; classes the original never
+    # predicts on X are padded in with zero weight so the label codes stay the same
+    Y = model.predict(X).reshape(len(X), -1)
+    n_outputs = getattr(model, 'n_outputs_', 1)
+    n_classes = [len(c) for c in model.classes_] if n_outputs > 1 else [len(model.classes_)]
+    X_fit, Y_fit, weight = pad_classes(X, Y, n_classes)
+    student = RandomForestClassifier(n_estimators=n_trees, max_depth=max_depth, random_state=seed)
+    student.fit(X_fit, Y_fit if n_outputs > 1 else Y_fit[:, 0], sample_weight=weight)
+    return student
+
+
+def parse_list(value, kind=int):
+    return [kind(v) for v in value.split(',') if v.strip()] if value else []
+
+
+def parse_distill(value):
+    # "25x12,50x8" -> [(25, 12), (50, 8)]; "25x0" means unlimited depth
+    specs = []
+    for spec in parse_list(value, str):
+        trees, depth = spec.lower().split('x')
+        specs.append((int(trees), int(depth) or None))
+    return specs
+
+
+def build_variants(model, X_select, X_distill, trees, depths, distill_specs, seed=0):
+    # variant name -> (model, seconds to build)
+    variants = {}
+    n_trees = len(model.estimators_)
+    sizes = [k for k in trees if k < n_trees]
+    if sizes:
+        start = time.perf_counter()
+        order = select_trees(model, X_select, max(sizes))
+        seconds = time.perf_counter() - start
+        for k in sizes:
+            variants[f'trees-{k}'] = (with_trees(model, order[:k]), seconds)
+
+    deepest = max(est.tree_.max_depth for est in model.estimators_)
+    for d in depths:
+        if d < deepest:
+            start = time.perf_counter()
+            variants[f'depth-{d}'] = (with_depth(model, d), time.perf_counter() - start)
+
+    for n, d in distill_specs:
+        start = time.perf_counter()
+        variants[f'distill-{n}x{d or 0}'] = (distill(model, X_distill, n, d, seed), time.perf_counter() - start)
+    return variants
+
+
+def measure(model, reference, targets, X_test, Y_test, X_random, single_calls=200, repeat=5):
+    flat = FlatForest.from_sklearn(model)
+    n_single = min(single_calls, len(X_test))
+    rows = [X_test.iloc[i:i + 1] for i in range(n_single)]
+
+    def per_row(predictor):
+        return float(np.median([median_seconds(lambda: predictor.predict(row), 1) for row in rows]))
+
+    return {
+        "trees": flat.n_trees,
+        "nodes": flat.n_nodes,
+        "max_depth": int(flat.depths.max()),
+        "accuracy": accuracy(model, X_test, Y_test, targets),
+        "agreement": accuracy(model, X_test, reference.predict(X_test).reshape(len(X_test), -1), targets),
+        "agreement_random_rows": accuracy(model, X_random, reference.predict(X_random).reshape(len(X_random), -1), targets),
+        "latency_ms": {
+            "single_row": round(per_row(model) * 1000, 4),
+            "single_row_flat": round(per_row(flat) * 1000, 4),
+            f"batch{len(X_test)}": round(median_seconds(lambda: model.predict(X_test), repeat) * 1000, 4),
+        },
+        "pickle_bytes": pickled_size(model),
+        "flat_bytes": flat_bytes(flat),
+    }
+
+
+def choose(variants, min_agreement):
+    # the variant with the smallest flat arrays whose worst per-target agreement clears the bar
+    passing = [name for name, info in variants.items() if min(info["agreement"].values()) >= min_agreement]
+    return min(passing, key=lambda name: variants[name]["flat_bytes"]) if passing else 'original'
+
+
+def load_split(family, data_dir, artifacts):
+    # the training CSV with the model's encoders, split exactly like the training script did
+    module = PREPROCESSORS[family]
+    with tempfile.TemporaryDirectory() as tmp:
+        # preprocess_data writes the encoders it fits; keep them away from the models dir
+        df, encoders = feature_cache.load_features(module, os.path.join(data_dir, DATASETS[family]),
+                                                   os.path.join(tmp, 'encoders.pkl'))
+    for col in artifacts.feature_cols:
+        if col in encoders and list(encoders[col].classes_) != list(artifacts.encoders[col].classes_):
+            raise ValueError(f"{DATASETS[family]} encodes {col} differently from the model, "
+                             "was the model trained on another file?")
+    labels, known = encode_labels(df, artifacts, family)
+    X = df.loc[known, artifacts.feature_cols]
+    Y = labels[known].to_numpy(dtype=np.int64)
+    X_train, X_test, Y_train, Y_test = train_test_split(X, Y, test_size=0.2, random_state=42)
+    return X_train, X_test, Y_train, Y_test
+
+
+def compact(family='original', data_dir=DATA_DIR, models_dir=MODELS_DIR, trees=(10, 25, 50), depths=(8, 12),
+            distill_specs=((25, 12),), min_agreement=0.99, pick=None, save=False, seed=0):
+    artifacts = load_artifacts(models_dir, family)
+    print(f"Compacting model version {artifacts.version} ({artifacts.source})...")
+    X_train, X_test, Y_train, Y_test = load_split(family, data_dir, artifacts)
+    encoder = PREPROCESSORS[family].compile_encoders(artifacts.encoders)
+    X_random = sample_rows(encoder, artifacts.feature_cols, n_rows=2000, seed=seed + 1)
+    X_select = X_train.iloc[:SELECT_ROWS]
+    # the student sees the training rows and as many random answer combinations
+    X_distill = pd.concat([X_train, sample_rows(encoder, artifacts.feature_cols, len(X_train), seed)], ignore_index=True)
+
+    target_index = {target: k for k, target in enumerate(LABEL_COLUMNS[family])}
+    report = {"family": family, "version": artifacts.version, "test_rows": len(X_test),
+              "min_agreement": min_agreement, "forests": {}}
+    chosen_models = {}
+    for name, targets in stored_forests(artifacts).items():
+        model = load_forest(artifacts, name)
+        Y = Y_test[:, [target_index[t] for t in targets]]
+        print(f"\n--- {name} ({len(model.estimators_)} trees) ---")
+        variants = build_variants(model, X_select, X_distill, trees, depths, distill_specs, seed)
+        results = {"original": measure(model, model, targets, X_test, Y, X_random)}
+        for vname, (variant, seconds) in variants.items():
+            results[vname] = dict(measure(variant, model, targets, X_test, Y, X_random), build_seconds=round(seconds, 3))
+
+        if pick is not None and pick not in results:
+            raise ValueError(f"No variant {pick} for {name}, built: {', '.join(results)}")
+        chosen = pick or choose(results, min_agreement)
+        print_forest(results, chosen)
+        report["forests"][name] = {"targets": targets, "variants": results, "chosen": chosen}
+        chosen_models[name] = model if chosen == 'original' else variants[chosen][0]
+
+    report_path = os.path.join(models_dir, REPORTS[family])
+    with open(report_path, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"\nReport saved to {report_path}")
+
+    if not save:
+        print("Nothing saved, pass --save to serve the chosen variants.")
+        return report
+    if all(info["chosen"] == 'original' for info in report["forests"].values()):
+        print("No variant chosen, models unchanged.")
+        return report
+
+    spec = FAMILIES[family]
+    if not artifacts.joint:
+        # keep the separate pickles in step with the bundle, like the training scripts do
+        for target, model in chosen_models.items():
+            joblib.dump(model, os.path.join(models_dir, spec['targets'][target][0]))
+    manifest = write_bundle(models_dir, family, models=chosen_models, labels=artifacts.labels,
+                            encoders=artifacts.encoders, feature_cols=artifacts.feature_cols,
+                            sample_X=X_test.iloc[:256], joint=artifacts.joint or None,
+                            profile=artifacts.drift_profile())
+    report["saved_version"] = manifest["version"]
+    with open(report_path, 'w') as f:
+        json.dump(report, f, indent=2)
+    if family == 'modified':
+        print("Rebuild the answer table (python answer_table.py) so the API stops falling back to the forest.")
+    return report
+
+
+def print_forest(results, chosen):
+    print(f"{'variant':<16}{'trees':>6}{'nodes':>9}{'accuracy':>10}{'agree':>8}{'agree rnd':>10}"
+          f"{'1 row ms':>10}{'flat ms':>9}{'flat KB':>10}")
+    for vname, info in results.items():
+        print(f"{vname:<16}{info['trees']:>6}{info['nodes']:>9}{min(info['accuracy'].values()):>10.4f}"
+              f"{min(info['agreement'].values()):>8.4f}{min(info['agreement_random_rows'].values()):>10.4f}"
+              f"{info['latency_ms']['single_row']:>10.3f}{info['latency_ms']['single_row_flat']:>9.3f}"
+              f"{info['flat_bytes'] / 1024:>10.0f}{'  <- chosen' if vname == chosen else ''}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build smaller versions of the trained forests and report what they cost in accuracy")
+    parser.add_argument('--family', choices=sorted(FAMILIES), default='original')
+    parser.add_argument('--data-dir', default=DATA_DIR)
+    parser.add_argument('--models-dir', default=MODELS_DIR)
+    parser.add_argument('--trees', default='10,25,50', help="tree counts to keep, picked by contribution")
+    parser.add_argument('--depths', default='8,12', help="depths to cut every tree at")
+    parser.add_argument('--distill', default='25x12', help="trees x depth of distilled forests (depth 0 = unlimited)")
+    parser.add_argument('--min-agreement', type=float, default=0.99,
+                        help="smallest share of test rows a variant must predict like the original")
+    parser.add_argument('--pick', default=None, help="save this variant (e.g. trees-25) instead of choosing by agreement")
+    parser.add_argument('--save', action='store_true', help="replace the served model with the chosen variant")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    compact(args.family, args.data_dir, args.models_dir, parse_list(args.trees), parse_list(args.depths),
+            parse_distill(args.distill), args.min_agreement, args.pick, args.save, args.seed)
@@ -0,0 +1,127 @@
+import math
+import numpy as np
+
+
+class CompiledEncoder:
+    # Built once from the fitted LabelEncoders in encoders.pkl.
+    # Every column gets a plain dict lookup table (class -> code) and an explicit code for
+    # unseen values, so a whole column is encoded with one factorize + take instead of
+    # calling le.transform once per cell. Codes match the old safe_transform path exactly:
+    # known label -> its index in le.classes_, otherwise the 'Unknown' code, otherwise 0.
+    #
+    # transform() works on DataFrames; encode_records() gives the same codes for a few plain
+    # dicts (validated API payloads) without pandas, which is then never imported.
+
+    def __init__(self, encoders, gender_map=None, numeric_defaults=None, gender_col='Gender'):
+        self.columns = list(encoders.keys())
+        self.tables = {}
+        self.unseen_codes = {}
+        for col, le in encoders.items():
+            table = {label: idx for idx, label in enumerate(le.classes_)}
+            self.tables[col] = table
+            self.unseen_codes[col] = table.get('Unknown', 0)
+
+        self.numeric_defaults = dict(numeric_defaults or {})
+
+        # gender cleaning folded straight into the code table: raw alias -> final code
+        self.gender_col = gender_col if gender_map is not None else None
+        self.gender_map = gender_map
+        self.gender_codes = None
+        if self.gender_col in self.tables:
+            table = self.tables[self.gender_col]
+            unseen = self.unseen_codes[self.gender_col]
+            self.gender_codes = {alias: table.get(canon, unseen) for alias, canon in gender_map.items()}
+            self.gender_other_code = table.get('Other', unseen)
+
+    def clean_gender(self, val):
+        return self.gender_map.get(str(val).lower().strip(), 'Other')
+
+    def lookup(self, col, val):
+        # code for a single raw value (used on the uniques of a column, never per row)
+        if col == self.gender_col:
+            return self.gender_codes.get(str(val).lower().strip(), self.gender_other_code)
+        return self.tables[col].get(val, self.unseen_codes[col])
+
+    def missing_code(self, col):
+        if col == self.gender_col:
+            # clean_gender turns NaN into 'Other' before the encoder ever sees it
+            return self.lookup(col, np.nan)
+        return self.lookup(col, 'Unknown')
+
+    def encode_column(self, col, values):
+        import pandas as pd
+
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            # already dictionary-encoded (Parquet/Arrow input): one lookup per category
+            codes, uniques = values.cat.codes.to_numpy(), values.cat.categories
+        else:
+            codes, uniques = pd.factorize(pd.Series(values, dtype=object))
+        lut = np.empty(len(uniques) + 1, dtype=np.int64)
+        for i, val in enumerate(uniques):
+            lut[i] = self.lookup(col, val)
+        # factorize and categoricals mark missing values with -1, which picks the last slot
+        lut[-1] = self.missing_code(col)
+        return lut[codes]
+
+    def transform(self, df):
+        # same contract as preprocess_input: encodes df in place and returns it
+        import pandas as pd
+
+        if self.gender_col is not None and self.gender_col in df.columns and self.gender_col not in self.tables:
+            df[self.gender_col] = self.encode_strings(df[self.gender_col], self.clean_gender)
+
+        for col, default in self.numeric_defaults.items():
+            if col in df.columns:
+                df[col] = pd.to_numeric(df[col], errors='coerce').fillna(default)
+
+        for col in self.columns:
+            if col in df.columns:
+                df[col] = self.encode_column(col, df[col])
+        return df
+
+    def encode_strings(self, series, fn):
+        import pandas as pd
+
+        codes, uniques = pd.factorize(series.astype(object))
+        mapped = np.array([fn(val) for val in uniques] + [fn(np.nan)], dtype=object)
+        return mapped[codes]
+
+    def features(self, df, feature_cols):
+        # add missing columns if any and keep the training column order
+        for col in feature_cols:
+            if col not in df.columns:
+                df[col] = 0
+        return df[feature_cols]
+
+    def encode_records(self, records, feature_cols):
+        # transform() + features() for a list of dicts of raw answers: one float64 row per
+        # record in feature_cols order, a column a record doesn't have is 0 like in features()
+        X = np.zeros((len(records), len(feature_cols)), dtype=np.float64)
+        for j, col in enumerate(feature_cols):
+            for i, record in enumerate(records):
+                if col not in record:
+                    continue
+                val = record[col]
+                if col in self.tables:
+                    X[i, j] = self.lookup(col, val)
+                elif col in self.numeric_defaults:
+                    X[i, j] = to_number(val, self.numeric_defaults[col])
+                else:
+                    X[i, j] = float(val)
+        return X
+
+
+def to_number(val, default):
+    # pd.to_numeric(errors='coerce') + fillna(default) for one value
+    if isinstance(val, (int, float)) and not isinstance(val, bool):
+        number = float(val)
+    else:
+        text = str(val).strip()
+        # float() also takes '1_000' and non-ASCII digits, pandas doesn't
+        if '_' in text or not text.isascii():
+            return default
+        try:
+            number = float(text)
+        except ValueError:
+            return default
+    return default if math.isnan(number) else number
@@ -0,0 +1,146 @@
+import numpy as np
+import os
+
+try:
+    from app.flat_forest import FlatForest, sample_rows, validate
+except ImportError:
+    from flat_forest import FlatForest, sample_rows, validate
+
+# Per-feature explanations of forest predictions, from the decision paths.
+#
+# Every node of a tree stores the class distribution of the training rows that reached it,
+# so the probabilities a tree returns are its root's distribution plus, for every split on
+# the way down, how much that step changed the distribution. Each of those changes is put on
+# the feature the split tested. Averaged over the trees:
+#
+#   probability = baseline (mean of the roots) + sum of the contributions of all features
+#
+# The change at every node (its value minus its parent's) is computed once when the bundle
+# is written and stored next to the flat tree arrays, so explaining a row is one walk through
+# all trees, like a prediction, plus one bincount per class over the steps it took.
+# Probabilities come from the leaves the same way predict_proba takes them, so the labels are
+# exactly the forest's.
+
+
+class ContributionIndex:
+    FILE = 'contrib_delta.npy'
+    # rows x trees walked per pass, so big batches keep a small working set
+    MAX_PAIRS = 32768
+
+    def __init__(self, forest, delta):
+        self.forest = forest
+        # delta[node] = value[node] - value[parent], zero for the roots
+        self.delta = delta
+        self.baseline = forest.value[forest.roots].sum(axis=0) / forest.n_trees
+
+    @classmethod
+    def from_forest(cls, forest):
+        n_nodes = forest.n_nodes
+        own = np.arange(n_nodes)
+        internal = forest.children[:, 0] != own
+        parent = own.copy()
+        parent[forest.children[internal, 0]] = own[internal]
+        parent[forest.children[internal, 1]] = own[internal]
+        value = np.asarray(forest.value)
+        return cls(forest, value - value[parent])
+
+    def save(self, directory):
+        np.save(os.path.join(directory, self.FILE), self.delta)
+
+    @classmethod
+    def load(cls, forest, directory, mmap_mode='r'):
+        # None when the index was never written there (bundles from before explanations)
+        path = os.path.join(directory, cls.FILE)
+        if not os.path.exists(path):
+            return None
+        return cls(forest, np.load(path, mmap_mode=mmap_mode))
+
+    def explain(self, X):
+        # (proba, contributions): proba like FlatForest.predict_proba but one array with all
+        # outputs side by side, contributions shaped (rows, features, classes) so that
+        # baseline + contributions.sum(axis=1) == proba up to rounding
+        forest = self.forest
+        X = forest.as_array(X)
+        n_rows, n_features = X.shape
+        n_values = forest.value.shape[1]
+        proba = np.empty((n_rows, n_values), dtype=np.float64)
+        contributions = np.zeros((n_rows, n_features, n_values), dtype=np.float64)
+        step = max(1, self.MAX_PAIRS // forest.n_trees)
+        for start in range(0, n_rows, step):
+            rows = X[start:start + step]
+            leaves, slots, nodes = self.paths(rows)
+            # in tree order, exactly like predict_proba
+            proba[start:start + len(rows)] = np.add.accumulate(forest.value[leaves.T], axis=0)[-1]
+            out = contributions[start:start + len(rows)].reshape(-1, n_values)
+            for k in range(n_values):
+                out[:, k] = np.bincount(slots, weights=self.delta[nodes, k], minlength=len(out))
+        proba /= forest.n_trees
+        contributions /= forest.n_trees
+        return proba, contributions
+
+    def paths(self, X):
+        # the leaves of every (row, tree) pair, and every step taken on the way: the
+        # (row, feature) slot it is credited to and the node it went to
+        forest = self.forest
+        n_rows, n_features = X.shape
+        X_flat = X.reshape(-1)
+        row_base = (np.arange(n_rows) * n_features)[:, np.newaxis]
+        nodes = np.broadcast_to(forest.roots, (n_rows, forest.n_trees)).copy()
+        slots, reached = [], []
+        for _ in range(forest.max_depth):
+            slot = row_base + forest.feature[nodes]
+            go_right = X_flat[slot] > forest.threshold[nodes]
+            children = forest.children_flat[nodes * 2 + go_right]
+            # leaves point at themselves; only real steps count
+            moved = children != nodes
+            slots.append(slot[moved])
+            reached.append(children[moved])
+            nodes = children
+        return nodes, np.concatenate(slots), np.concatenate(reached)
+
+    def check(self, X):
+        # True when the contributions add up to the probabilities on X
+        proba, contributions = self.explain(X)
+        return np.allclose(self.baseline + contributions.sum(axis=1), proba, atol=1e-9)
+
+
+def explainers(artifacts, targets, encoder=None):
+    # [(index, [(target, class labels, output columns), ...]), ...]: the joint forest if
+    # there is one, else one forest per target. Bundles carry the index (checked when written);
+    # the separate pickles are flattened and checked here
+    joint = artifacts.joint_name(targets)
+    result = []
+    for name in ([joint] if joint is not None else targets):
+        if artifacts.source == 'bundle':
+            index = artifacts.contributions(name)
+        else:
+            model = artifacts.model(name)
+            index = ContributionIndex.from_forest(FlatForest.from_sklearn(model))
+            X = sample_rows(encoder, artifacts.feature_cols)
+            if not validate(index.forest, model, X) or not index.check(X):
+                raise ValueError(f"Explanations of the {name} model do not match sklearn")
+        splits = index.forest.splits
+        outputs = [(target, artifacts.labels[target].inverse_transform(index.forest.classes[a:b]), slice(a, b))
+                   for target, a, b in zip(artifacts.joint.get(name, [name]), splits[:-1], splits[1:])]
+        result.append((index, outputs))
+    return result
+
+
+def explain_targets(explainers, X):
+    # target -> (labels, probability of the label, baseline of the label, contributions of
+    # every feature towards the label (rows x features)), one entry per row
+    explained = {}
+    for index, outputs in explainers:
+        proba, contributions = index.explain(X)
+        for target, classes, columns in outputs:
+            p = proba[:, columns]
+            # first class with the highest probability, like predict()
+            best = np.argmax(p, axis=1)
+            rows = np.arange(len(p))
+            explained[target] = (
+                classes[best],
+                p[rows, best],
+                index.baseline[columns][best],
+                contributions[:, :, columns][rows, :, best],
+            )
+    return explained
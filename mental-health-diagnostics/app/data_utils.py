@@ -1,18 +1,29 @@
-import pandas as pd
 import numpy as np
-from sklearn.preprocessing import LabelEncoder
-import joblib
 import re
+from compiled_encoder import CompiledEncoder
+
+# pandas, sklearn and joblib are only imported by preprocess_data: api.py imports this module
+# for the encoders and its fast path never needs them
+
+MALE_ALIASES = ['male', 'm', 'male-ish', 'maile', 'cis male', 'mal', 'male (cis)', 'make', 'male ', 'man', 'msle', 'mail', 'malr', 'cis man', 'guy (-ish) ^_^']
+FEMALE_ALIASES = ['female', 'f', 'woman', 'femake', 'female ', 'cis-female/femme', 'female (cis)', 'femail', 'cis female', 'trans-female', 'trans woman', 'female (trans)']
+
+# one dict lookup instead of scanning both lists for every row
+GENDER_MAP = {alias: 'Male' for alias in MALE_ALIASES}
+GENDER_MAP.update({alias: 'Female' for alias in FEMALE_ALIASES})
+
+# part of the feature cache key (feature_cache.py); bump when preprocess_data's output changes
+PREPROCESS_VERSION = 1
 
 def clean_gender(gender):
     gender = str(gender).lower().strip()
-    if gender in ['male', 'm', 'male-ish', 'maile', 'cis male', 'mal', 'male (cis)', 'make', 'male ', 'man', 'msle', 'mail', 'malr', 'cis man', 'guy (-ish) ^_^']:
-        return 'Male'
-    if gender in ['female', 'f', 'woman', 'femake', 'female ', 'cis-female/femme', 'female (cis)', 'femail', 'cis female', 'trans-female', 'trans woman', 'female (trans)']:
-        return 'Female'
-    return 'Other'
+    return GENDER_MAP.get(gender, 'Other')
 
 def preprocess_data(filepath, encoders_path='../models/encoders.pkl', is_training=True):
+    import pandas as pd
+    from sklearn.preprocessing import LabelEncoder
+    import joblib
+
     df = pd.read_csv(filepath)
     
     # Clean Gender
@@ -68,32 +79,13 @@ def preprocess_data(filepath, encoders_path='../models/encoders.pkl', is_trainin
         
     return df, encoders
 
+def compile_encoders(encoders):
+    # build the vectorized encoder once from the fitted LabelEncoders in encoders.pkl
+    # Age is coerced to numeric with 30 as the default, categoricals get their label codes
+    return CompiledEncoder(encoders, gender_map=GENDER_MAP, numeric_defaults={'Age': 30})
+
 def preprocess_input(df, encoders):
-    # 1. Clean Gender
-    if 'Gender' in df.columns:
-        df['Gender'] = df['Gender'].apply(clean_gender)
-        
-    # 2. Handle Age
-    if 'Age' in df.columns:
-        df['Age'] = pd.to_numeric(df['Age'], errors='coerce')
-        # Fill with default if invalid
-        df['Age'] = df['Age'].fillna(30)
-        
-    # 3. Encode categorical
-    for col, le in encoders.items():
-        if col in df.columns:
-            # Handle unseen labels
-            df[col] = df[col].fillna('Unknown')
-            
-            # Safe transform helper
-            known_labels = set(le.classes_)
-            def safe_transform(val):
-                if val in known_labels:
-                    return le.transform([val])[0]
-                else:
-                    if 'Unknown' in known_labels:
-                        return le.transform(['Unknown'])[0]
-                    return 0 # Fallback
-            
-            df[col] = df[col].apply(safe_transform)
-    return df
+    # encoders can be the raw dict from encoders.pkl or an already compiled encoder
+    if not isinstance(encoders, CompiledEncoder):
+        encoders = compile_encoders(encoders)
+    return encoders.transform(df)
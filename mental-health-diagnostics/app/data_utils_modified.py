@@ -4,13 +4,24 @@ from sklearn.preprocessing import LabelEncoder
 import joblib
 import re
 
+try:
+    from app.compiled_encoder import CompiledEncoder
+except ImportError:
+    from compiled_encoder import CompiledEncoder
+
+MALE_ALIASES = ['male', 'm', 'male-ish', 'maile', 'cis male', 'mal', 'male (cis)', 'make', 'male ', 'man', 'msle', 'mail', 'malr', 'cis man', 'guy (-ish) ^_^']
+FEMALE_ALIASES = ['female', 'f', 'woman', 'femake', 'female ', 'cis-female/femme', 'female (cis)', 'femail', 'cis female', 'trans-female', 'trans woman', 'female (trans)']
+
+# one dict lookup instead of scanning both lists for every row
+GENDER_MAP = {alias: 'Male' for alias in MALE_ALIASES}
+GENDER_MAP.update({alias: 'Female' for alias in FEMALE_ALIASES})
+
+# part of the feature cache key (feature_cache.py); bump when preprocess_data's output changes
+PREPROCESS_VERSION = 1
+
 def clean_gender(gender):
     gender = str(gender).lower().strip()
-    if gender in ['male', 'm', 'male-ish', 'maile', 'cis male', 'mal', 'male (cis)', 'make', 'male ', 'man', 'msle', 'mail', 'malr', 'cis man', 'guy (-ish) ^_^']:
-        return 'Male'
-    if gender in ['female', 'f', 'woman', 'femake', 'female ', 'cis-female/femme', 'female (cis)', 'femail', 'cis female', 'trans-female', 'trans woman', 'female (trans)']:
-        return 'Female'
-    return 'Other'
+    return GENDER_MAP.get(gender, 'Other')
 
 def preprocess_data(filepath, encoders_path='../models/encoders_modified.pkl', is_training=True):
     df = pd.read_csv(filepath)
@@ -63,27 +74,12 @@ def preprocess_data(filepath, encoders_path='../models/encoders_modified.pkl', i
         
     return df, encoders
 
+def compile_encoders(encoders):
+    # build the vectorized encoder once from the fitted LabelEncoders in encoders.pkl
+    return CompiledEncoder(encoders, gender_map=GENDER_MAP)
+
 def preprocess_input(df, encoders):
-    # 1. Clean Gender
-    if 'Gender' in df.columns:
-        df['Gender'] = df['Gender'].apply(clean_gender)
-        
-    # 2. Encode categorical
-    for col, le in encoders.items():
-        if col in df.columns:
-            # Handle unseen labels
-            df[col] = df[col].fillna('Unknown')
-            
-            # Safe transform helper
-            known_labels = set(le.classes_)
-            def safe_transform(val):
-                if val in known_labels:
-                    return le.transform([val])[0]
-                else:
-                    # Fallback to a known label or 0
-                    if 'Unknown' in known_labels:
-                        return le.transform(['Unknown'])[0]
-                    return 0 
-            
-            df[col] = df[col].apply(safe_transform)
-    return df
+    # encoders can be the raw dict from encoders.pkl or an already compiled encoder
+    if not isinstance(encoders, CompiledEncoder):
+        encoders = compile_encoders(encoders)
+    return encoders.transform(df)
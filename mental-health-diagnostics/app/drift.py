@@ -0,0 +1,331 @@
+import bisect
+import json
+import math
+import threading
+import time
+import numpy as np
+
+try:
+    from app.compiled_encoder import to_number
+except ImportError:
+    from compiled_encoder import to_number
+
+# Input drift monitoring. The encoder quietly maps answers it has never seen to 'Unknown'
+# (or code 0), and any gender it doesn't recognise to 'Other', so a change in what clients
+# send never shows up as an error. DriftMonitor counts, per input column:
+#
+#   histogram   how often each encoded value (encoder class, or Age bin) was fed to the model
+#   unseen      answers the encoder didn't know (or an Age that isn't a number)
+#   missing     empty answers
+#   top_unseen  the most frequent raw unseen answers, from a Space-Saving sketch of at most
+#               top_k strings per column
+#
+# and compares each histogram with the same histogram over the training rows (the profile
+# train_model.py stores in the model bundle) using the Jensen-Shannon divergence: 0 for the
+# same distribution, 1 for distributions with nothing in common.
+#
+# Every counter has a fixed size, so memory doesn't grow with traffic, and counting a
+# questionnaire is a few dict lookups. Counts start when the models are loaded.
+
+PROFILE_FORMAT = 1
+# raw unseen answers are cut to this many characters before they go into the sketch
+MAX_VALUE_LENGTH = 100
+
+
+def numeric_edges(values, quantiles=10):
+    # bin edges for a numeric column: the training range split at its deciles. Values below
+    # the smallest or above the largest training value get a bin of their own
+    values = np.asarray(values, dtype=float)
+    values = values[~np.isnan(values)]
+    if not len(values):
+        return []
+    inner = np.quantile(values, np.linspace(0, 1, quantiles + 1)[1:-1])
+    edges = np.unique(np.concatenate([[values.min()], inner, [np.nextafter(values.max(), np.inf)]]))
+    return edges.tolist()
+
+
+def numeric_bins(edges, values):
+    return np.searchsorted(edges, values, side='right')
+
+
+def training_profile(X, encoders, numeric_cols=('Age',)):
+    # histograms of the encoded training rows, in the layout DriftMonitor counts in
+    profile = {"format": PROFILE_FORMAT, "rows": int(len(X)), "categorical": {}, "numeric": {}}
+    for col, le in encoders.items():
+        if col in X.columns:
+            counts = np.bincount(X[col].to_numpy(dtype=np.int64), minlength=len(le.classes_))
+            profile["categorical"][col] = {"classes": le.classes_.tolist(), "counts": counts.tolist()}
+    for col in numeric_cols:
+        if col in X.columns:
+            values = X[col].to_numpy(dtype=float)
+            edges = numeric_edges(values)
+            counts = np.bincount(numeric_bins(edges, values), minlength=len(edges) + 1)
+            profile["numeric"][col] = {"edges": edges, "counts": counts.tolist()}
+    return profile
+
+
+def save_profile(path, profile):
+    with open(path, 'w') as f:
+        json.dump(profile, f)
+
+
+def load_profile(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def js_divergence(expected, observed):
+    # Jensen-Shannon divergence (base 2) between two histograms of counts
+    if expected is None:
+        return None
+    p = np.asarray(expected, dtype=float)
+    q = np.asarray(observed, dtype=float)
+    if len(p) != len(q) or not p.sum() or not q.sum():
+        return None
+    p, q = p / p.sum(), q / q.sum()
+    m = (p + q) / 2
+
+    def kl(a):
+        nz = a > 0
+        return float(np.sum(a[nz] * np.log2(a[nz] / m[nz])))
+
+    return max(0.0, (kl(p) + kl(q)) / 2)
+
+
+class HeavyHitters:
+    # Space-Saving sketch: keeps at most capacity values with their counts. A new value that
+    # doesn't fit replaces the one with the smallest count and inherits that count, so counts
+    # can be too high by at most max_overcount, and every value seen more than total/capacity
+    # times is guaranteed to be kept.
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.counts = {}
+        self.errors = {}
+
+    def add(self, value, count=1):
+        value = value[:MAX_VALUE_LENGTH]
+        if value in self.counts:
+            self.counts[value] += count
+        elif len(self.counts) < self.capacity:
+            self.counts[value] = count
+            self.errors[value] = 0
+        else:
+            smallest = min(self.counts, key=self.counts.get)
+            floor = self.counts.pop(smallest)
+            del self.errors[smallest]
+            self.counts[value] = floor + count
+            self.errors[value] = floor
+
+    def top(self):
+        return [{"value": value, "count": count, "max_overcount": self.errors[value]}
+                for value, count in sorted(self.counts.items(), key=lambda item: -item[1])]
+
+
+def is_missing(val):
+    return val is None or (isinstance(val, float) and math.isnan(val))
+
+
+class FeatureCounts:
+    def __init__(self, bins, top_k):
+        self.histogram = [0] * bins
+        self.unseen = 0
+        self.missing = 0
+        self.unseen_values = HeavyHitters(top_k)
+
+
+class DriftMonitor:
+    # encoder: the CompiledEncoder serving uses, profile: training_profile() of the same
+    # training run, or None (histograms and unseen answers are still counted, with no divergence)
+
+    def __init__(self, encoder, profile=None, top_k=20):
+        self.encoder = encoder
+        self.profile = profile
+        self.lock = threading.Lock()
+        self.started_at = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())
+        self.rows = 0
+        # column -> class labels in code order, or numeric bin edges
+        self.classes = {col: list(table) for col, table in encoder.tables.items()}
+        # answer -> code for the columns whose raw answers are looked up as they are
+        self.known = {col: table for col, table in encoder.tables.items() if col != encoder.gender_col}
+        self.edges = {}
+        for col in encoder.numeric_defaults:
+            if profile is not None and col in profile["numeric"]:
+                self.edges[col] = profile["numeric"][col]["edges"]
+        self.features = {col: FeatureCounts(len(classes), top_k) for col, classes in self.classes.items()}
+        for col in encoder.numeric_defaults:
+            self.features[col] = FeatureCounts(len(self.edges.get(col, [])) + 1, top_k)
+
+    def classify(self, col, val):
+        # (the code the encoder gives val, whether the encoder knew it)
+        encoder = self.encoder
+        if col == encoder.gender_col:
+            code = encoder.gender_codes.get(str(val).lower().strip())
+            return (encoder.gender_other_code, False) if code is None else (code, True)
+        code = encoder.tables[col].get(val)
+        return (encoder.unseen_codes[col], False) if code is None else (code, True)
+
+    def bin(self, col, number):
+        # numeric_bins() for one number
+        edges = self.edges.get(col)
+        return bisect.bisect_right(edges, number) if edges else 0
+
+    def observe_records(self, records):
+        # a few validated payload dicts (the API)
+        with self.lock:
+            self.rows += len(records)
+            for record in records:
+                for col, val in record.items():
+                    counts = self.features.get(col)
+                    if counts is None:
+                        continue
+                    # the common case, a known answer, is one dict lookup
+                    table = self.known.get(col)
+                    if table is not None and val in table:
+                        counts.histogram[table[val]] += 1
+                        continue
+                    if is_missing(val):
+                        counts.missing += 1
+                        if col in self.classes:
+                            counts.histogram[self.encoder.missing_code(col)] += 1
+                        else:
+                            counts.histogram[self.bin(col, self.encoder.numeric_defaults[col])] += 1
+                        continue
+                    if col in self.classes:
+                        code, seen = self.classify(col, val)
+                    else:
+                        number = to_number(val, None)
+                        seen = number is not None
+                        code = self.bin(col, number if seen else self.encoder.numeric_defaults[col])
+                    counts.histogram[code] += 1
+                    if not seen:
+                        counts.unseen += 1
+                        counts.unseen_values.add(str(val))
+
+    def observe_frame(self, df):
+        # a DataFrame of raw answers (batch_predict): one pass per column over its distinct values
+        import pandas as pd
+
+        column_counts = {}
+        for col in self.features:
+            if col not in df.columns:
+                continue
+            values = df[col]
+            if col in self.classes:
+                column_counts[col] = self.count_categorical(col, values, pd)
+            else:
+                column_counts[col] = self.count_numeric(col, values, pd)
+        with self.lock:
+            self.rows += len(df)
+            for col, (histogram, unseen, missing, unseen_values) in column_counts.items():
+                counts = self.features[col]
+                for code in np.flatnonzero(histogram):
+                    counts.histogram[code] += int(histogram[code])
+                counts.unseen += unseen
+                counts.missing += missing
+                for val, count in unseen_values:
+                    counts.unseen_values.add(val, count)
+
+    def count_categorical(self, col, values, pd):
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            codes, uniques = values.cat.codes.to_numpy(), values.cat.categories
+        else:
+            codes, uniques = pd.factorize(values.astype(object))
+        per_unique = np.bincount(codes[codes >= 0], minlength=len(uniques))
+        missing = int((codes < 0).sum())
+        histogram = np.zeros(len(self.classes[col]), dtype=np.int64)
+        histogram[self.encoder.missing_code(col)] += missing
+        unseen, unseen_values = 0, []
+        for val, count in zip(uniques, per_unique.tolist()):
+            if not count:
+                continue
+            code, seen = self.classify(col, val)
+            histogram[code] += count
+            if not seen:
+                unseen += count
+                unseen_values.append((str(val), count))
+        return histogram, unseen, missing, unseen_values
+
+    def count_numeric(self, col, values, pd):
+        missing = values.isna().to_numpy()
+        numbers = pd.to_numeric(values, errors='coerce').to_numpy(dtype=float, copy=True)
+        bad = np.isnan(numbers) & ~missing
+        unseen_values = []
+        if bad.any():
+            raw = values[bad].astype(str).value_counts()
+            unseen_values = list(zip(raw.index, raw.tolist()))
+        numbers[np.isnan(numbers)] = self.encoder.numeric_defaults[col]
+        edges = self.edges.get(col)
+        bins = numeric_bins(edges, numbers) if edges else np.zeros(len(numbers), dtype=np.int64)
+        histogram = np.bincount(bins, minlength=len(self.features[col].histogram))
+        return histogram, int(bad.sum()), int(missing.sum()), unseen_values
+
+    def expected(self, col):
+        # training histogram of col, if the profile has one in the same layout
+        if self.profile is None:
+            return None
+        if col in self.classes:
+            info = self.profile["categorical"].get(col)
+            return info["counts"] if info is not None and info["classes"] == self.classes[col] else None
+        info = self.profile["numeric"].get(col)
+        return info["counts"] if info is not None else None
+
+    def divergences(self):
+        with self.lock:
+            histograms = {col: list(counts.histogram) for col, counts in self.features.items()}
+        return {col: js_divergence(self.expected(col), histogram) if sum(histogram) else None
+                for col, histogram in histograms.items()}
+
+    def report(self, threshold=0.1, min_rows=100):
+        # threshold: divergence above which a feature counts as drifted, once it has been
+        # observed at least min_rows times
+        with self.lock:
+            rows = self.rows
+            snapshot = {col: (list(c.histogram), c.unseen, c.missing, c.unseen_values.top())
+                        for col, c in self.features.items()}
+        features = {}
+        for col, (histogram, unseen, missing, top_unseen) in snapshot.items():
+            observed = sum(histogram)
+            expected = self.expected(col)
+            divergence = js_divergence(expected, histogram) if observed else None
+            entry = {
+                "observed": observed,
+                "divergence": divergence,
+                "drifted": divergence is not None and observed >= min_rows and divergence > threshold,
+                "unseen": unseen,
+                "unseen_rate": unseen / observed if observed else None,
+                "missing": missing,
+                "top_unseen": top_unseen,
+            }
+            if col in self.classes:
+                entry["histogram"] = dict(zip(self.classes[col], histogram))
+            else:
+                entry["bin_edges"] = self.edges.get(col, [])
+                entry["histogram"] = histogram
+            if expected is not None:
+                total = sum(expected)
+                share = [round(count / total, 6) for count in expected]
+                entry["training_share"] = dict(zip(self.classes[col], share)) if col in self.classes else share
+            features[col] = entry
+        scores = [entry["divergence"] for entry in features.values() if entry["divergence"] is not None]
+        return {
+            "since": self.started_at,
+            "rows": rows,
+            "training_profile": self.profile is not None,
+            "threshold": threshold,
+            "min_rows": min_rows,
+            "max_divergence": max(scores) if scores else None,
+            "drifted_features": [col for col, entry in features.items() if entry["drifted"]],
+            "features": features,
+        }
+
+    def collect(self, metrics, family):
+        with self.lock:
+            unseen = {col: counts.unseen for col, counts in self.features.items()}
+        for col, divergence in self.divergences().items():
+            if divergence is not None:
+                metrics.set('input_drift', divergence, {'family': family, 'feature': col})
+            metrics.set('input_unseen_values_total', unseen[col], {'family': family, 'feature': col})
@@ -0,0 +1,160 @@
+import hashlib
+import json
+import os
+import shutil
+import time
+import numpy as np
+import pandas as pd
+import joblib
+from sklearn.preprocessing import LabelEncoder
+from model_bundle import file_hash
+
+# Cache of preprocess_data() output for the training scripts. The first run on a CSV stores
+# the preprocessed frame and the fitted encoders; later runs on the same file load them in
+# milliseconds instead of reading the CSV, cleaning gender row by row and refitting every
+# LabelEncoder.
+#
+#   <data dir>/.feature_cache/<module>-<key>/meta.json   columns, dtypes, encoder classes
+#   <data dir>/.feature_cache/<module>-<key>/c<i>.npy    one column each, memory-mapped on load
+#
+# The key is the SHA-256 of the CSV's content plus the module's PREPROCESS_VERSION and a hash
+# of the module's source, so an edited file or edited preprocessing never hits a stale entry.
+# Integer columns (the label codes) are stored in the smallest int type that holds them,
+# string columns (targets, unused text) as int codes plus their distinct values.
+#
+# Env: FEATURE_CACHE=0 turns it off, FEATURE_CACHE_DIR moves it.
+
+FEATURE_CACHE = os.getenv('FEATURE_CACHE', '1') == '1'
+# entries kept per module and source file name; older ones are removed
+KEEP_ENTRIES = 3
+CACHE_FORMAT = 1
+
+
+def smallest_int(values):
+    lo, hi = (int(values.min()), int(values.max())) if len(values) else (0, 0)
+    for dtype in (np.int8, np.int16, np.int32):
+        info = np.iinfo(dtype)
+        if info.min <= lo and hi <= info.max:
+            return dtype
+    return np.int64
+
+
+def content_hash(filepath, cache_dir):
+    # hashing a big CSV still takes a while, so the hash is remembered per (size, mtime)
+    stat = os.stat(filepath)
+    index_path = os.path.join(cache_dir, 'hashes.json')
+    try:
+        with open(index_path) as f:
+            index = json.load(f)
+    except (FileNotFoundError, ValueError):
+        index = {}
+    path = os.path.abspath(filepath)
+    entry = index.get(path)
+    if entry and entry['size'] == stat.st_size and entry['mtime_ns'] == stat.st_mtime_ns:
+        return entry['sha256']
+    digest = file_hash(filepath)
+    index[path] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': digest}
+    tmp = f"{index_path}.tmp-{os.getpid()}"
+    with open(tmp, 'w') as f:
+        json.dump(index, f)
+    os.replace(tmp, index_path)
+    return digest
+
+
+def cache_key(module, filepath, cache_dir):
+    parts = [content_hash(filepath, cache_dir), str(module.PREPROCESS_VERSION), file_hash(module.__file__), str(CACHE_FORMAT)]
+    return hashlib.sha256('|'.join(parts).encode()).hexdigest()[:20]
+
+
+def store(entry_dir, df, encoders, source):
+    tmp_dir = f"{entry_dir}.tmp-{os.getpid()}"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    columns = []
+    for i, col in enumerate(df.columns):
+        values = df[col]
+        info = {"name": col, "dtype": str(values.dtype)}
+        if pd.api.types.is_integer_dtype(values):
+            array = values.to_numpy()
+            array = array.astype(smallest_int(array))
+        elif pd.api.types.is_float_dtype(values) or pd.api.types.is_bool_dtype(values):
+            array = values.to_numpy()
+        else:
+            # strings: codes plus the distinct values, -1 for missing
+            codes, uniques = pd.factorize(values)
+            array = codes.astype(smallest_int(codes))
+            info["values"] = [str(u) for u in uniques]
+        np.save(os.path.join(tmp_dir, f'c{i}.npy'), np.ascontiguousarray(array))
+        columns.append(info)
+    meta = {
+        "format": CACHE_FORMAT,
+        "source": os.path.abspath(source),
+        "created_at": time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        "rows": len(df),
+        "columns": columns,
+        "encoders": {col: le.classes_.tolist() for col, le in encoders.items()},
+    }
+    with open(os.path.join(tmp_dir, 'meta.json'), 'w') as f:
+        json.dump(meta, f)
+    shutil.rmtree(entry_dir, ignore_errors=True)
+    os.replace(tmp_dir, entry_dir)
+
+
+def load(entry_dir):
+    with open(os.path.join(entry_dir, 'meta.json')) as f:
+        meta = json.load(f)
+    data = {}
+    for i, info in enumerate(meta["columns"]):
+        array = np.load(os.path.join(entry_dir, f'c{i}.npy'), mmap_mode='r')
+        if "values" in info:
+            values = np.array(info["values"] + [np.nan], dtype=object)
+            # code -1 (missing) picks the trailing NaN
+            data[info["name"]] = values[np.asarray(array)]
+        else:
+            data[info["name"]] = array
+    df = pd.DataFrame(data, columns=[info["name"] for info in meta["columns"]])
+    encoders = {}
+    for col, classes in meta["encoders"].items():
+        le = LabelEncoder()
+        le.classes_ = np.array(classes, dtype=object)
+        encoders[col] = le
+    return df, encoders
+
+
+def prune(cache_dir, prefix, source):
+    # drop older entries for the same module and source file
+    entries = []
+    for name in os.listdir(cache_dir):
+        meta_path = os.path.join(cache_dir, name, 'meta.json')
+        if not name.startswith(prefix) or not os.path.exists(meta_path):
+            continue
+        with open(meta_path) as f:
+            if json.load(f).get("source") == os.path.abspath(source):
+                entries.append((os.path.getmtime(meta_path), name))
+    for _, name in sorted(entries, reverse=True)[KEEP_ENTRIES:]:
+        shutil.rmtree(os.path.join(cache_dir, name), ignore_errors=True)
+
+
+def load_features(module, filepath, encoders_path, cache_dir=None):
+    # preprocess_data(filepath, encoders_path, is_training=True) of module, cached
+    if not FEATURE_CACHE:
+        return module.preprocess_data(filepath, encoders_path=encoders_path, is_training=True)
+
+    cache_dir = cache_dir or os.getenv('FEATURE_CACHE_DIR') or os.path.join(os.path.dirname(os.path.abspath(filepath)), '.feature_cache')
+    os.makedirs(cache_dir, exist_ok=True)
+    prefix = module.__name__.split('.')[-1] + '-'
+    entry_dir = os.path.join(cache_dir, prefix + cache_key(module, filepath, cache_dir))
+
+    if os.path.exists(os.path.join(entry_dir, 'meta.json')):
+        start = time.perf_counter()
+        df, encoders = load(entry_dir)
+        # training expects preprocess_data to have written the encoders
+        joblib.dump(encoders, encoders_path)
+        print(f"Loaded cached features for {os.path.basename(filepath)} ({len(df)} rows, "
+              f"{(time.perf_counter() - start) * 1000:.0f} ms)")
+        return df, encoders
+
+    df, encoders = module.preprocess_data(filepath, encoders_path=encoders_path, is_training=True)
+    store(entry_dir, df, encoders, filepath)
+    prune(cache_dir, prefix, filepath)
+    return df, encoders
@@ -0,0 +1,347 @@
+import numpy as np
+import json
+import os
+
+# Flat, array-based copy of a fitted RandomForestClassifier.
+# All trees are concatenated into contiguous node arrays (int32 feature and children, float64
+# threshold and leaf values), skipping sklearn's input validation, DataFrame conversion and
+# per-tree joblib dispatch. Leaves point at themselves, so a row that reaches a leaf early just
+# stays there. A few rows are walked through every tree at once (one numpy step per depth
+# level); bigger batches go tree by tree, which keeps the working set small.
+#
+# Results match sklearn exactly: X is rounded to float32 like sklearn does before comparing
+# with the float64 thresholds, leaf values are taken the same way predict_proba takes them,
+# and the tree probabilities are summed in tree order before dividing by the number of trees.
+#
+# The arrays can be saved as plain .npy files and loaded with mmap, so several processes
+# share one copy of the trees through the page cache.
+#
+# Multi-output forests (one forest predicting several targets) keep the class values of all
+# outputs side by side in one value row; splits marks where each output's classes start. A
+# row is still walked through each tree once, whatever the number of outputs.
+#
+# Only numpy is imported up front: pandas, sklearn and joblib are imported by the functions
+# that need them, so serving from a model bundle never loads them (see FAST_PATH in api.py).
+#
+# vote() is predict_proba with early exit: trees are evaluated a chunk at a time and a row
+# stops once its label is settled, returning probabilities over the trees it used and how
+# many that was.
+
+
+def leaf_fractions():
+    # sklearn >= 1.4 stores class fractions in tree.value, older versions weighted counts
+    import sklearn
+    return tuple(int(p) for p in sklearn.__version__.split('.')[:2]) >= (1, 4)
+
+
+class FlatForest:
+    ARRAYS = ('feature', 'threshold', 'children', 'value', 'roots', 'depths', 'classes', 'splits')
+    # missing from exports written before multi-output support
+    OPTIONAL = ('splits',)
+
+    # up to this many rows are walked through all trees at once
+    ALL_TREES_MAX_ROWS = 32
+    # vote() walks at least this many (row, tree) pairs per pass; a pass costs a fixed numpy
+    # overhead per depth level, so a handful of rows is cheaper through all trees in one go
+    # than in chunks that might stop early
+    VOTE_MIN_PAIRS = 1024
+    # ... and at most this many, so big batches keep a small working set like predict_proba_by_tree
+    VOTE_MAX_PAIRS = 32768
+
+    def __init__(self, feature, threshold, children, value, roots, depths, classes, splits=None):
+        self.feature = feature
+        self.threshold = threshold
+        # children[i] = (left, right); flattened so a step is children[2 * node + go_right]
+        self.children = children
+        self.value = value
+        self.roots = roots
+        self.depths = depths
+        self.classes = classes
+        self.splits = np.asarray([0, len(classes)] if splits is None else splits, dtype=np.int64)
+        self.max_depth = int(depths.max()) if len(depths) else 0
+        self.children_flat = children.reshape(-1)
+
+    @property
+    def n_trees(self):
+        return len(self.roots)
+
+    @property
+    def n_nodes(self):
+        return len(self.feature)
+
+    @property
+    def n_outputs(self):
+        return len(self.splits) - 1
+
+    @classmethod
+    def from_sklearn(cls, model):
+        if not hasattr(model, 'estimators_') or not hasattr(model, 'classes_'):
+            raise ValueError(f"Can only flatten a fitted RandomForestClassifier, got {type(model).__name__}")
+        multi_output = getattr(model, 'n_outputs_', 1) > 1
+        classes = list(model.classes_) if multi_output else [model.classes_]
+        n_classes = [len(c) for c in classes]
+        splits = np.cumsum([0] + n_classes)
+        fractions = leaf_fractions()
+        features, thresholds, children, values, roots, depths = [], [], [], [], [], []
+        offset = 0
+        for est in model.estimators_:
+            tree = est.tree_
+            n = tree.node_count
+            is_leaf = tree.children_left == -1
+            own = np.arange(offset, offset + n)
+
+            features.append(np.where(is_leaf, 0, tree.feature))
+            thresholds.append(tree.threshold)
+            left = np.where(is_leaf, own, tree.children_left + offset)
+            right = np.where(is_leaf, own, tree.children_right + offset)
+            children.append(np.stack([left, right], axis=1))
+
+            # same leaf values DecisionTreeClassifier.predict_proba returns: sklearn >= 1.4 stores
+            # class fractions directly, older versions store weighted counts and normalise them
+            blocks = []
+            for k, n_k in enumerate(n_classes):
+                value = tree.value[:, k, :n_k].astype(np.float64)
+                if not fractions:
+                    normalizer = value.sum(axis=1)[:, np.newaxis]
+                    normalizer[normalizer == 0.0] = 1.0
+                    value = value / normalizer
+                blocks.append(value)
+            values.append(np.hstack(blocks))
+
+            roots.append(offset)
+            depths.append(tree.max_depth)
+            offset += n
+
+        return cls(
+            feature=np.concatenate(features).astype(np.int32),
+            threshold=np.concatenate(thresholds).astype(np.float64),
+            children=np.concatenate(children).astype(np.int32),
+            value=np.concatenate(values),
+            roots=np.asarray(roots, dtype=np.int32),
+            depths=np.asarray(depths, dtype=np.int32),
+            classes=np.concatenate([np.asarray(c) for c in classes]),
+            splits=splits,
+        )
+
+    def save(self, directory):
+        # uncompressed .npy files so load() can memory-map them
+        os.makedirs(directory, exist_ok=True)
+        for name in self.ARRAYS:
+            np.save(os.path.join(directory, name + '.npy'), getattr(self, name))
+
+    @classmethod
+    def load(cls, directory, mmap_mode='r'):
+        arrays = {}
+        for name in cls.ARRAYS:
+            path = os.path.join(directory, name + '.npy')
+            if name in cls.OPTIONAL and not os.path.exists(path):
+                continue
+            # classes and splits are tiny (and classes may hold strings), so they are read normally
+            mode = None if name in ('classes', 'splits') else mmap_mode
+            arrays[name] = np.load(path, mmap_mode=mode)
+        return cls(**arrays)
+
+    def as_array(self, X):
+        if hasattr(X, 'to_numpy'):
+            # a DataFrame
+            X = X.to_numpy()
+        # sklearn trees compare float32 inputs against float64 thresholds
+        return np.ascontiguousarray(np.asarray(X, dtype=np.float32), dtype=np.float64)
+
+    def apply(self, X):
+        # leaf index for every (row, tree) pair, all trees at once
+        return self.walk(self.as_array(X), self.roots, self.max_depth)
+
+    def walk(self, X, roots, depth):
+        # leaf index for every (row, root) pair of the trees starting at roots; X from as_array
+        n_rows, n_features = X.shape
+        X_flat = X.reshape(-1)
+        row_base = (np.arange(n_rows) * n_features)[:, np.newaxis]
+        nodes = np.broadcast_to(roots, (n_rows, len(roots))).copy()
+        for _ in range(depth):
+            go_right = X_flat[row_base + self.feature[nodes]] > self.threshold[nodes]
+            nodes = self.children_flat[nodes * 2 + go_right]
+        return nodes
+
+    def predict_proba(self, X):
+        if len(X) <= self.ALL_TREES_MAX_ROWS:
+            nodes = self.apply(X)
+            # accumulate (not sum, which may add pairwise) so the trees are added one by one
+            # in order, exactly like sklearn's running total
+            proba = np.add.accumulate(self.value[nodes.T], axis=0)[-1]
+        else:
+            proba = self.predict_proba_by_tree(X)
+        proba /= self.n_trees
+        if self.n_outputs > 1:
+            # one array per output, like sklearn
+            return [proba[:, a:b] for a, b in zip(self.splits[:-1], self.splits[1:])]
+        return proba
+
+    def predict_proba_by_tree(self, X):
+        # un-normalised sum of the tree probabilities, one tree at a time
+        X = self.as_array(X)
+        n_rows, n_features = X.shape
+        X_flat = X.reshape(-1)
+        row_base = np.arange(n_rows) * n_features
+        proba = np.zeros((n_rows, self.value.shape[1]), dtype=np.float64)
+        for root, depth in zip(self.roots, self.depths):
+            nodes = np.full(n_rows, root, dtype=np.int32)
+            for _ in range(depth):
+                go_right = X_flat[row_base + self.feature[nodes]] > self.threshold[nodes]
+                nodes = self.children_flat[nodes * 2 + go_right]
+            proba += self.value[nodes]
+        return proba
+
+    def vote(self, X, chunk=16, confidence=None, early_exit=True):
+        # Returns (proba, trees): probabilities shaped like predict_proba's, averaged over the
+        # trees each row evaluated, and that number of trees per row.
+        #
+        # Trees are evaluated in order, chunk at a time. A row stops when, for every output,
+        # the leading class is ahead of the runner-up by more than the number of trees left:
+        # a tree adds at most 1 to any class, so nothing can overtake it and the label is the
+        # full forest's. That point is never before half the trees, so the next check is
+        # pushed to the first tree count at which some row could get there. With confidence
+        # (0..1) a row also stops once the leading class holds that share of the votes so
+        # far; checked after every chunk, faster but no longer guaranteed to match. Only a few
+        # rows (a single /predict) always go through every tree in one pass, see VOTE_MIN_PAIRS.
+        # early_exit=False evaluates every tree: same probabilities and labels as predict_proba.
+        X = self.as_array(X)
+        n_rows = len(X)
+        total = np.zeros((n_rows, self.value.shape[1]), dtype=np.float64)
+        trees = np.zeros(n_rows, dtype=np.int64)
+        active = np.arange(n_rows)
+        done_trees = 0
+        if not early_exit:
+            step = self.n_trees
+        else:
+            # without a confidence bound no row can settle before more than half the trees
+            step = chunk if confidence is not None else max(chunk, self.n_trees // 2 + 1)
+        while done_trees < self.n_trees and len(active):
+            step = max(1, step, self.VOTE_MIN_PAIRS // len(active) if early_exit else 0)
+            step = min(step, max(1, self.VOTE_MAX_PAIRS // len(active)))
+            stop = done_trees + step
+            if self.n_trees - stop < chunk:
+                # not worth another pass for the last few trees
+                stop = self.n_trees
+            nodes = self.walk(X[active], self.roots[done_trees:stop], int(self.depths[done_trees:stop].max()))
+            # added to the running total tree by tree, in order, exactly like predict_proba
+            stacked = np.concatenate([total[active][np.newaxis], self.value[nodes.T]])
+            total[active] = np.add.accumulate(stacked, axis=0)[-1]
+            trees[active] = done_trees = stop
+            if not early_exit or stop == self.n_trees:
+                continue
+            settled, earliest = self.settled(total[active], stop, confidence)
+            active = active[~settled]
+            step = chunk if confidence is not None or not len(active) else max(chunk, int(earliest[~settled].min()))
+
+        proba = total / trees[:, np.newaxis]
+        if self.n_outputs > 1:
+            return [proba[:, a:b] for a, b in zip(self.splits[:-1], self.splits[1:])], trees
+        return proba, trees
+
+    def settled(self, total, done_trees, confidence=None):
+        # per row: whether every output's label is settled after done_trees trees, and how many
+        # more trees it needs at least before the lead can be safe
+        remaining = self.n_trees - done_trees
+        settled = np.ones(len(total), dtype=bool)
+        earliest = np.zeros(len(total), dtype=np.int64)
+        for a, b in zip(self.splits[:-1], self.splits[1:]):
+            if b - a < 2:
+                continue
+            top = np.partition(total[:, a:b], -2, axis=1)
+            margin = top[:, -1] - top[:, -2]
+            # small slack for rounding in the running totals
+            safe = margin > remaining + 1e-9
+            if confidence is not None:
+                safe |= top[:, -1] >= confidence * done_trees
+            settled &= safe
+            # after s more trees the margin is at most margin + s and s fewer trees are left
+            earliest = np.maximum(earliest, np.floor((remaining - margin) / 2).astype(np.int64) + 1)
+        return settled, earliest
+
+    def predict(self, X):
+        proba = self.predict_proba(X)
+        if self.n_outputs > 1:
+            return np.column_stack([self.classes[a:b].take(np.argmax(p, axis=1), axis=0)
+                                    for p, a, b in zip(proba, self.splits[:-1], self.splits[1:])])
+        return self.classes.take(np.argmax(proba, axis=1), axis=0)
+
+
+def export_model(model_path, directory, model_hash):
+    # flatten a pickled forest into directory, unless it already holds an export of the same file
+    import joblib
+
+    meta_path = os.path.join(directory, 'source.json')
+    if os.path.exists(meta_path):
+        with open(meta_path) as f:
+            if json.load(f).get('model_hash') == model_hash:
+                return False
+    FlatForest.from_sklearn(joblib.load(model_path)).save(directory)
+    with open(meta_path, 'w') as f:
+        json.dump({'model_hash': model_hash}, f)
+    return True
+
+
+def validate(flat, model, X):
+    # True when the flat forest reproduces sklearn's labels and probabilities on X exactly
+    flat_proba, proba = flat.predict_proba(X), model.predict_proba(X)
+    if isinstance(proba, list):
+        same_proba = (isinstance(flat_proba, list) and len(flat_proba) == len(proba)
+                      and all(np.array_equal(a, b) for a, b in zip(flat_proba, proba)))
+    else:
+        same_proba = np.array_equal(flat_proba, proba)
+    return same_proba and np.array_equal(flat.predict(X), model.predict(X))
+
+
+def sample_rows(encoder, feature_cols, n_rows=256, seed=0):
+    # random encoded rows covering every class of every categorical feature, used for the
+    # startup check; non-categorical columns (Age) get plausible values
+    import pandas as pd
+
+    df = pd.DataFrame(sample_matrix(encoder, feature_cols, n_rows, seed), columns=feature_cols)
+    # label codes as integer columns, like preprocess_input produces them
+    return df.astype({col: np.int64 for col in feature_cols if col in encoder.tables})
+
+
+def sample_matrix(encoder, feature_cols, n_rows=256, seed=0):
+    # the same rows as a plain float64 array, without pandas
+    rng = np.random.default_rng(seed)
+    X = np.empty((n_rows, len(feature_cols)), dtype=np.float64)
+    for j, col in enumerate(feature_cols):
+        if col in encoder.tables:
+            X[:, j] = rng.integers(0, len(encoder.tables[col]), n_rows)
+        else:
+            X[:, j] = rng.integers(18, 80, n_rows)
+    return X
+
+
+class SmallBatchRouter:
+    # flat evaluation wins for a handful of rows, the ones FlatForest walks through all trees
+    # at once; past that it goes tree by tree and sklearn's compiled tree walk is faster, so
+    # those go to the original model
+    def __init__(self, flat, model, max_rows=FlatForest.ALL_TREES_MAX_ROWS):
+        self.flat = flat
+        self.model = model
+        self.max_rows = max_rows
+
+    def pick(self, X):
+        return self.flat if len(X) <= self.max_rows else self.model
+
+    def predict(self, X):
+        return self.pick(X).predict(X)
+
+    def predict_proba(self, X):
+        return self.pick(X).predict_proba(X)
+
+
+def flatten_checked(model, encoder, feature_cols, max_rows=FlatForest.ALL_TREES_MAX_ROWS):
+    # flatten a model for serving, or return None so the caller keeps using sklearn
+    try:
+        flat = FlatForest.from_sklearn(model)
+    except ValueError as e:
+        print(f"Flat forest not available: {e}")
+        return None
+    if not validate(flat, model, sample_rows(encoder, feature_cols)):
+        print("Flat forest does not match sklearn, falling back to sklearn.")
+        return None
+    return SmallBatchRouter(flat, model, max_rows=max_rows)
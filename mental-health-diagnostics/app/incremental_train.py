@@ -0,0 +1,244 @@
+import argparse
+import json
+import os
+import time
+import numpy as np
+import pandas as pd
+import joblib
+from sklearn.utils.class_weight import compute_sample_weight
+import data_utils
+import data_utils_modified
+from model_bundle import FAMILIES, load_artifacts, write_bundle
+
+# Daily updates from newly labelled checkups without a full retrain. The existing forests are
+# warm-started: new trees are grown on the new rows only and appended to the old ones, the
+# total is capped at --max-trees, and with --retire-oldest the oldest trees are dropped to
+# make room, so the model slowly follows the recent data. No grid search, no full CSV.
+#
+# The new rows are encoded with the existing encoders (encoders.pkl is never refit), through
+# the same CompiledEncoder path the API uses: an unseen answer becomes the column's 'Unknown'
+# code. Rows with an unseen answer in a column that has no 'Unknown' class, or with a label
+# the model doesn't know, are left out, since trees can't learn new classes or codes.
+#
+# A share of the new rows (--holdout) is kept out of the update to score the model before and
+# after it. Every update is appended to models/incremental_log.jsonl.
+#
+#   python incremental_train.py ../data/checkups_2026-10-18.csv --trees 50 --max-trees 500 --retire-oldest
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+MODELS_DIR = os.path.join(BASE_DIR, '..', 'models')
+
+PREPROCESSORS = {'original': data_utils, 'modified': data_utils_modified}
+# target -> its column in the labelled CSV
+LABEL_COLUMNS = {
+    'original': {'condition': 'condition', 'treatment': 'treatment'},
+    'modified': {'treatment': 'Treatment'},
+}
+
+
+def stored_forests(artifacts):
+    # forest name -> the targets it predicts, in output order
+    if artifacts.source == 'bundle':
+        forests = {}
+        for target in artifacts.labels:
+            name, _ = artifacts.forest_name(target)
+            forests[name] = artifacts.joint.get(name, [name])
+        return forests
+    return {target: [target] for target in artifacts.labels}
+
+
+def load_forest(artifacts, name):
+    return artifacts.load_model(name) if artifacts.source == 'bundle' else artifacts.model(name)
+
+
+def encode_rows(df, artifacts, family):
+    # features as training encodes them; returns X, the rows kept and unseen answers per column
+    encoder = PREPROCESSORS[family].compile_encoders(artifacts.encoders)
+    missing = [col for col in artifacts.feature_cols if col not in df.columns and col in encoder.columns]
+    if missing:
+        raise ValueError(f"New data is missing feature columns: {', '.join(missing)}")
+
+    keep = np.ones(len(df), dtype=bool)
+    unseen = {}
+    for col in encoder.columns:
+        if col not in df.columns:
+            continue
+        values = df[col].fillna('Unknown').astype(str)
+        if col == encoder.gender_col:
+            values = values.map(encoder.clean_gender)
+        is_unseen = ~values.isin(encoder.tables[col]).to_numpy()
+        if is_unseen.any():
+            unseen[col] = int(is_unseen.sum())
+            if 'Unknown' not in encoder.tables[col]:
+                keep &= ~is_unseen
+
+    df = df[keep].copy()
+    if 'Age' in df.columns:
+        # same clean-up as preprocess_data: unparseable or out of range ages become the median
+        age = pd.to_numeric(df['Age'], errors='coerce')
+        age = age.fillna(age.median())
+        df['Age'] = age.where((age >= 18) & (age <= 100), age.median())
+    X = encoder.features(encoder.transform(df), artifacts.feature_cols)
+    return X, keep, unseen
+
+
+def encode_labels(df, artifacts, family):
+    # label codes per target (one column each) and a mask of rows whose labels are all known
+    columns = []
+    known = np.ones(len(df), dtype=bool)
+    for target, col in LABEL_COLUMNS[family].items():
+        table = {label: idx for idx, label in enumerate(artifacts.labels[target].classes_)}
+        codes = df[col].astype(str).map(table)
+        known &= codes.notna().to_numpy()
+        columns.append(codes)
+    return pd.concat(columns, axis=1, keys=list(LABEL_COLUMNS[family])), known
+
+
+def pad_classes(X, Y, n_classes):
+    # a warm-started forest re-reads its classes from y, so every known class must be present;
+    # missing ones are added as copies of the first row with zero weight, which are never
+    # drawn into a bootstrap sample and carry no weight in a split
+    extra = []
+    for k, n in enumerate(n_classes):
+        for c in sorted(set(range(n)) - set(np.unique(Y[:, k]))):
+            row = Y[0].copy()
+            row[k] = c
+            extra.append(row)
+    if not extra:
+        return X, Y, np.ones(len(X))
+    X = pd.concat([X, X.iloc[[0] * len(extra)]])
+    return X, np.vstack([Y, extra]), np.concatenate([np.ones(len(Y)), np.zeros(len(extra))])
+
+
+def add_trees(model, X, Y, n_trees, max_trees, retire_oldest):
+    # grows up to n_trees new trees on X, Y; returns (added, retired)
+    before = len(model.estimators_)
+    if not retire_oldest:
+        n_trees = min(n_trees, max_trees - before)
+    if n_trees <= 0:
+        return 0, 0
+
+    n_outputs = getattr(model, 'n_outputs_', 1)
+    n_classes = [len(c) for c in model.classes_] if n_outputs > 1 else [len(model.classes_)]
+    # class weights from the real new rows only ('balanced' would give a padded class an
+    # infinite weight); the forest's own class_weight is put back afterwards
+    class_weight = model.class_weight
+    weight = (compute_sample_weight('balanced' if class_weight == 'balanced_subsample' else class_weight, Y)
+              if class_weight is not None else np.ones(len(Y)))
+    X_fit, Y_fit, padding = pad_classes(X, Y, n_classes)
+    sample_weight = np.concatenate([weight, padding[len(Y):]])
+
+    model.set_params(warm_start=True, n_estimators=before + n_trees, class_weight=None)
+    try:
+        model.fit(X_fit, Y_fit if n_outputs > 1 else Y_fit[:, 0], sample_weight=sample_weight)
+    finally:
+        model.set_params(warm_start=False, class_weight=class_weight)
+
+    retired = max(0, len(model.estimators_) - max_trees)
+    if retired:
+        # oldest first in estimators_, so the newest max_trees stay
+        model.estimators_ = model.estimators_[retired:]
+        model.set_params(n_estimators=len(model.estimators_))
+    return n_trees, retired
+
+
+def accuracy(model, X, Y, targets):
+    if len(X) == 0:
+        return {}
+    pred = model.predict(X).reshape(len(X), -1)
+    return {target: round(float(np.mean(pred[:, k] == Y[:, k])), 6) for k, target in enumerate(targets)}
+
+
+def update(input_file, family='original', models_dir=MODELS_DIR, trees=50, max_trees=500, retire_oldest=False,
+           holdout=0.2, seed=0):
+    start = time.perf_counter()
+    artifacts = load_artifacts(models_dir, family)
+    print(f"Updating model version {artifacts.version} ({artifacts.source}) with {input_file}...")
+    df = pd.read_csv(input_file)
+    df = df.loc[:, ~df.columns.duplicated()]
+    rows_read = len(df)
+
+    labels, known = encode_labels(df, artifacts, family)
+    if not known.all():
+        print(f"Skipping {int((~known).sum())} rows with labels the model doesn't know.")
+    df, labels = df[known], labels[known]
+    X, keep, unseen = encode_rows(df, artifacts, family)
+    Y = labels[keep].to_numpy(dtype=np.int64)
+    for col, count in unseen.items():
+        print(f"  {col}: {count} rows with answers not seen in training")
+    if len(X) == 0:
+        raise ValueError("No usable rows in the new data")
+
+    # holdout rows score the model before and after, they are not trained on
+    order = np.random.default_rng(seed).permutation(len(X))
+    n_holdout = int(len(X) * holdout)
+    test, train = order[:n_holdout], order[n_holdout:]
+    X_train, Y_train, X_test, Y_test = X.iloc[train], Y[train], X.iloc[test], Y[test]
+
+    target_index = {target: k for k, target in enumerate(LABEL_COLUMNS[family])}
+    models = {}
+    forests = {}
+    for name, targets in stored_forests(artifacts).items():
+        model = load_forest(artifacts, name)
+        cols = [target_index[t] for t in targets]
+        before = len(model.estimators_)
+        score_before = accuracy(model, X_test, Y_test[:, cols], targets)
+        added, retired = add_trees(model, X_train, Y_train[:, cols], trees, max_trees, retire_oldest)
+        forests[name] = {"targets": targets, "trees_before": before, "added": added, "retired": retired,
+                         "trees_after": len(model.estimators_), "holdout_accuracy_before": score_before,
+                         "holdout_accuracy_after": accuracy(model, X_test, Y_test[:, cols], targets)}
+        print(f"{name}: {before} trees + {added} new - {retired} retired = {len(model.estimators_)} trees; "
+              f"holdout accuracy {score_before} -> {forests[name]['holdout_accuracy_after']}")
+        if not added:
+            print(f"  {name} is at the {max_trees} tree cap, pass --retire-oldest to replace old trees")
+        models[name] = model
+
+    if not any(info["added"] for info in forests.values()):
+        print("No trees added, models unchanged.")
+        return None
+
+    spec = FAMILIES[family]
+    if not artifacts.joint:
+        # keep the separate pickles in step with the bundle, like the training scripts do
+        for target, model in models.items():
+            joblib.dump(model, os.path.join(models_dir, spec['targets'][target][0]))
+    manifest = write_bundle(models_dir, family, models=models, labels=artifacts.labels, encoders=artifacts.encoders,
+                            feature_cols=artifacts.feature_cols, sample_X=X.iloc[:256], joint=artifacts.joint or None,
+                            profile=artifacts.drift_profile())
+
+    entry = {
+        "updated_at": time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        "family": family,
+        "input_file": os.path.abspath(input_file),
+        "previous_version": artifacts.version,
+        "version": manifest["version"],
+        "rows_read": rows_read,
+        "rows_used": len(X_train),
+        "rows_holdout": len(X_test),
+        "rows_skipped": rows_read - len(X),
+        "unseen_answers": unseen,
+        "forests": forests,
+        "seconds": round(time.perf_counter() - start, 3),
+    }
+    with open(os.path.join(models_dir, 'incremental_log.jsonl'), 'a') as f:
+        f.write(json.dumps(entry) + '\n')
+    if family == 'modified':
+        print("Rebuild the answer table (python answer_table.py) so the API stops falling back to the forest.")
+    print(f"Update done in {entry['seconds']:.1f}s.")
+    return entry
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Add trees trained on newly labelled checkups to the existing models")
+    parser.add_argument('input_file', help="CSV of new questionnaires with their labels")
+    parser.add_argument('--family', choices=sorted(LABEL_COLUMNS), default='original')
+    parser.add_argument('--models-dir', default=MODELS_DIR)
+    parser.add_argument('--trees', type=int, default=50, help="new trees per forest")
+    parser.add_argument('--max-trees', type=int, default=500, help="cap on trees per forest")
+    parser.add_argument('--retire-oldest', action='store_true', help="drop the oldest trees instead of stopping at the cap")
+    parser.add_argument('--holdout', type=float, default=0.2, help="share of the new rows used only to score the update")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    update(args.input_file, args.family, args.models_dir, args.trees, args.max_trees, args.retire_oldest,
+           args.holdout, args.seed)
@@ -0,0 +1,81 @@
+import asyncio
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+
+class Overloaded(Exception):
+    # raised by InferenceExecutor.run when every worker is busy and the wait queue is full
+    def __init__(self, retry_after):
+        super().__init__("Server is busy, try again later")
+        self.retry_after = retry_after
+
+
+class InferenceExecutor:
+    # Dedicated pool for the CPU-bound model calls, so they neither block the event loop nor
+    # compete for FastAPI's shared threadpool. At most max_workers calls run at once and at
+    # most max_queue more wait for a worker; a call beyond that is rejected right away with
+    # Overloaded, which the API turns into a 503 with Retry-After instead of letting the
+    # queue (and everyone's latency) grow without bound.
+    #
+    # kind='thread' runs calls in this process. kind='process' runs them in worker processes;
+    # with fork they inherit the models already loaded in the parent, and restart() replaces
+    # the pool so new workers pick up freshly loaded models. Calls that are already running
+    # finish on the old pool.
+
+    def __init__(self, kind='thread', max_workers=None, max_queue=64, retry_after=1):
+        if kind not in ('thread', 'process'):
+            raise ValueError(f"Unknown executor kind {kind!r}, expected 'thread' or 'process'")
+        self.kind = kind
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.max_queue = max(0, int(max_queue))
+        self.retry_after = retry_after
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.completed = 0
+        self.rejected = 0
+        self.pool = self.make_pool()
+
+    def make_pool(self):
+        if self.kind == 'thread':
+            return ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='inference')
+        context = None
+        if 'fork' in multiprocessing.get_all_start_methods():
+            context = multiprocessing.get_context('fork')
+        return ProcessPoolExecutor(max_workers=self.max_workers, mp_context=context)
+
+    def restart(self):
+        old, self.pool = self.pool, self.make_pool()
+        old.shutdown(wait=False)
+
+    async def run(self, fn, *args):
+        return await self.run_future(lambda: self.pool.submit(fn, *args))
+
+    async def run_future(self, start):
+        # start() hands the work to someone else (the pool, a micro-batcher) and returns a
+        # concurrent.futures.Future; the same limits apply to it
+        with self.lock:
+            if self.in_flight >= self.max_workers + self.max_queue:
+                self.rejected += 1
+                raise Overloaded(self.retry_after)
+            self.in_flight += 1
+        try:
+            return await asyncio.wrap_future(start())
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+                self.completed += 1
+
+    def stats(self):
+        with self.lock:
+            return {
+                "kind": self.kind,
+                "max_workers": self.max_workers,
+                "max_queue": self.max_queue,
+                "in_flight": self.in_flight,
+                "running": min(self.in_flight, self.max_workers),
+                "queued": max(0, self.in_flight - self.max_workers),
+                "completed": self.completed,
+                "rejected": self.rejected,
+            }
@@ -0,0 +1,100 @@
+import io
+import json
+import time
+import numpy as np
+import joblib
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.metrics import make_scorer
+from flat_forest import FlatForest
+import param_search
+
+# One multi-output forest for condition and treatment (train_model.py --joint). Every tree
+# splits on what helps both targets and its leaves hold both class distributions, so serving
+# walks each row through one forest instead of two. The report compares it with the two
+# separate forests on the same test rows: per-target accuracy, prediction latency and size.
+
+
+def mean_accuracy(y_true, y_pred):
+    # accuracy averaged over the targets; sklearn's accuracy doesn't take multi-output labels
+    return float(np.mean(np.asarray(y_true) == np.asarray(y_pred), axis=0).mean())
+
+
+def fit_joint(X_train, Y_train, param_grid, folds, search_config):
+    rf = RandomForestClassifier(random_state=42, class_weight='balanced')
+    return param_search.search(rf, param_grid, X_train, Y_train, folds, search_config, scoring=make_scorer(mean_accuracy))
+
+
+def median_seconds(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return float(np.median(times))
+
+
+def flat_bytes(flat):
+    return sum(getattr(flat, name).nbytes for name in FlatForest.ARRAYS)
+
+
+def pickled_size(model):
+    buffer = io.BytesIO()
+    joblib.dump(model, buffer)
+    return buffer.tell()
+
+
+def compare(separate, joint, targets, X_test, Y_test, single_calls=200, repeat=5):
+    # separate: target -> forest; joint: multi-output forest with one output per target
+    joint_pred = joint.predict(X_test)
+    report = {"targets": {}}
+    for k, target in enumerate(targets):
+        separate_acc = float(np.mean(separate[target].predict(X_test) == Y_test[:, k]))
+        joint_acc = float(np.mean(joint_pred[:, k] == Y_test[:, k]))
+        report["targets"][target] = {"separate_accuracy": round(separate_acc, 6), "joint_accuracy": round(joint_acc, 6),
+                                     "difference": round(joint_acc - separate_acc, 6)}
+
+    flat_separate = [FlatForest.from_sklearn(separate[target]) for target in targets]
+    flat_joint = FlatForest.from_sklearn(joint)
+    rows = [X_test.iloc[i % len(X_test):i % len(X_test) + 1] for i in range(single_calls)]
+
+    def per_row(predictors):
+        # median over single-row calls, like /predict; every predictor once per row
+        return float(np.median([median_seconds(lambda: [p.predict(row) for p in predictors], 1) for row in rows]))
+
+    latency = {
+        "single_row": (per_row([separate[t] for t in targets]), per_row([joint])),
+        "single_row_flat": (per_row(flat_separate), per_row([flat_joint])),
+        f"batch{len(X_test)}": (median_seconds(lambda: [separate[t].predict(X_test) for t in targets], repeat),
+                                median_seconds(lambda: joint.predict(X_test), repeat)),
+    }
+    report["latency_ms"] = {name: {"separate": round(a * 1000, 4), "joint": round(b * 1000, 4),
+                                   "speedup": round(a / b, 2) if b else None}
+                            for name, (a, b) in latency.items()}
+
+    # half the trees, but every joint node carries the class values of both targets (in the
+    # pickle padded to n_outputs x max classes), and fully grown joint trees split until both
+    # targets are pure, so the joint model is not necessarily smaller; measured, not assumed
+    sizes = {
+        "pickle_bytes": (sum(pickled_size(separate[t]) for t in targets), pickled_size(joint)),
+        "flat_bytes": (sum(flat_bytes(f) for f in flat_separate), flat_bytes(flat_joint)),
+        "nodes": (sum(f.n_nodes for f in flat_separate), flat_joint.n_nodes),
+        "trees": (sum(f.n_trees for f in flat_separate), flat_joint.n_trees),
+    }
+    report["size"] = {name: {"separate": int(a), "joint": int(b), "ratio": round(b / a, 4)} for name, (a, b) in sizes.items()}
+    return report
+
+
+def print_report(report):
+    print("\n--- Joint vs separate models ---")
+    for target, acc in report["targets"].items():
+        print(f"{target:<10} accuracy  separate {acc['separate_accuracy']:.4f}  joint {acc['joint_accuracy']:.4f}  "
+              f"({acc['difference']:+.4f})")
+    for name, lat in report["latency_ms"].items():
+        print(f"{name:<16} separate {lat['separate']:9.3f} ms  joint {lat['joint']:9.3f} ms  ({lat['speedup']}x)")
+    for name, size in report["size"].items():
+        print(f"{name:<16} separate {size['separate']:>12}     joint {size['joint']:>12}     ({size['ratio']:.2f}x)")
+
+
+def save_report(path, report):
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2, default=str)
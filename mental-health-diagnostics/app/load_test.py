@@ -0,0 +1,287 @@
+import argparse
+import asyncio
+import json
+import os
+import platform
+import secrets
+import socket
+import subprocess
+import sys
+import threading
+import time
+import numpy as np
+import httpx
+
+import synthetic_data
+
+# HTTP load generator for api.py / api_modified.py. It starts the app itself (uvicorn in a
+# background thread or in a subprocess) or targets --url, sends randomized questionnaires to
+# /predict or /predict/batch, and reports throughput, latency percentiles and errors.
+#
+#   --rps N          open loop: requests are started on a fixed schedule whatever the server
+#                    does, and latency counts from the scheduled start, so a slow server can't
+#                    hide its queueing delay
+#   --concurrency N  closed loop: N clients each send the next request when the last returns
+#
+# When it starts the server it also sets API_SECRET_KEY and sends the key, so the x-api-key
+# check is part of every request. The JSON report uses the same layout as benchmark.py, so
+# reports from two releases can be diffed or compared with `python benchmark.py compare`.
+#
+#   python load_test.py --app api --rps 50 --duration 30 --output load.json
+#   python load_test.py --app api_modified --concurrency 8 --endpoint batch --batch-size 100
+
+LOAD_TEST_FORMAT = 1
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# request fields of PatientData in each app
+PAYLOAD_FIELDS = {
+    'api': ['Age', 'Gender', 'work_interfere', 'family_history', 'benefits', 'care_options', 'leave',
+            'mental_health_consequence', 'self_employed', 'mental_health_interview', 'yoga'],
+    'api_modified': ['Gender', 'Occupation', 'SelfEmployed', 'FamilyHistory', 'MentalHealthHistory', 'DaysIndoors',
+                     'HabitsChange', 'IncreasingStress', 'SocialWeakness', 'CopingStruggles', 'WorkInterest',
+                     'MentalHealthInterview', 'CareOptions', 'MoodSwings'],
+}
+
+
+def make_payloads(app_name, n, seed=0):
+    # realistic answers, spelling variants included; missing answers are sent as "Unknown"
+    make_rows = synthetic_data.original_rows if app_name == 'api' else synthetic_data.modified_rows
+    df = make_rows(n, seed=seed, labels=False)[PAYLOAD_FIELDS[app_name]]
+    df = df.fillna('Unknown').astype(str)
+    return df.to_dict(orient='records')
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def wait_until_up(url, timeout=120.0, process=None):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process is not None and process.poll() is not None:
+            raise RuntimeError(f"Server exited with status {process.returncode} before it came up")
+        try:
+            if httpx.get(url + '/', timeout=1.0).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"Server at {url} did not come up within {timeout:.0f}s")
+
+
+class InProcessServer:
+    # uvicorn in a background thread of this process; simple, but the load generator and the
+    # app share one GIL, so use a subprocess for numbers that size replicas
+    def __init__(self, app_name, port):
+        import uvicorn
+        sys.path.insert(0, APP_DIR)
+        module = __import__(app_name)
+        config = uvicorn.Config(module.app, host='127.0.0.1', port=port, log_level='warning')
+        self.server = uvicorn.Server(config)
+        self.thread = threading.Thread(target=self.server.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.server.should_exit = True
+        self.thread.join(timeout=10)
+
+
+class SubprocessServer:
+    def __init__(self, app_name, port, env):
+        self.process = subprocess.Popen(
+            [sys.executable, '-m', 'uvicorn', f'{app_name}:app', '--host', '127.0.0.1', '--port', str(port),
+             '--log-level', 'warning'],
+            cwd=APP_DIR, env=env, stdout=subprocess.DEVNULL)
+
+    def stop(self):
+        self.process.terminate()
+        try:
+            self.process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+
+
+class LoadTest:
+    def __init__(self, url, path, bodies, api_key, duration, warmup, rps=None, concurrency=None, timeout=30.0,
+                 max_in_flight=1000):
+        self.url = url
+        self.path = path
+        self.bodies = bodies
+        self.headers = {'x-api-key': api_key} if api_key else {}
+        self.duration = duration
+        self.warmup = warmup
+        self.rps = rps
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.max_in_flight = max_in_flight
+        self.latencies = []
+        self.statuses = {}
+        self.dropped = 0
+        self.sent = 0
+
+    async def send(self, client, scheduled, measure):
+        body = self.bodies[self.sent % len(self.bodies)]
+        self.sent += 1
+        try:
+            response = await client.post(self.path, json=body, headers=self.headers)
+            status = str(response.status_code)
+        except httpx.TimeoutException:
+            status = 'timeout'
+        except httpx.HTTPError as e:
+            status = type(e).__name__
+        if measure:
+            self.latencies.append(time.perf_counter() - scheduled)
+            self.statuses[status] = self.statuses.get(status, 0) + 1
+
+    async def open_loop(self, client, end, measure_from):
+        tasks = set()
+        start = time.perf_counter()
+        i = 0
+        while True:
+            scheduled = start + i / self.rps
+            if scheduled >= end:
+                break
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            i += 1
+            if len(tasks) >= self.max_in_flight:
+                # the client side is saturated; count it instead of queueing without bound
+                self.dropped += scheduled >= measure_from
+                continue
+            task = asyncio.create_task(self.send(client, scheduled, scheduled >= measure_from))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        if tasks:
+            await asyncio.wait(tasks)
+
+    async def closed_loop(self, client, end, measure_from):
+        async def worker():
+            while time.perf_counter() < end:
+                now = time.perf_counter()
+                await self.send(client, now, now >= measure_from)
+
+        await asyncio.gather(*(worker() for _ in range(self.concurrency)))
+
+    async def run(self):
+        limits = httpx.Limits(max_connections=self.max_in_flight, max_keepalive_connections=self.max_in_flight)
+        async with httpx.AsyncClient(base_url=self.url, timeout=self.timeout, limits=limits) as client:
+            start = time.perf_counter()
+            measure_from = start + self.warmup
+            end = measure_from + self.duration
+            if self.rps:
+                await self.open_loop(client, end, measure_from)
+            else:
+                await self.closed_loop(client, end, measure_from)
+            self.elapsed = time.perf_counter() - measure_from
+
+    def results(self, rows_per_request):
+        completed = len(self.latencies)
+        ok = self.statuses.get('200', 0)
+        attempted = completed + self.dropped
+        results = {}
+
+        def record(name, value, unit, better):
+            results[name] = {"value": round(float(value), 6), "unit": unit, "better": better}
+
+        record("throughput.requests_per_s", ok / self.elapsed, 'req/s', 'higher')
+        record("throughput.rows_per_s", ok * rows_per_request / self.elapsed, 'rows/s', 'higher')
+        record("error_rate", (attempted - ok) / attempted if attempted else 0.0, 'fraction', 'lower')
+        if completed:
+            latencies = np.array(self.latencies) * 1000
+            for p in (50, 95, 99):
+                record(f"latency.p{p}.ms", np.percentile(latencies, p), 'ms', 'lower')
+            record("latency.mean.ms", latencies.mean(), 'ms', 'lower')
+            record("latency.max.ms", latencies.max(), 'ms', 'lower')
+        return results
+
+
+def print_report(report):
+    config = report["config"]
+    load = f"{config['rps']} req/s open loop" if config['rps'] else f"{config['concurrency']} concurrent clients"
+    print(f"\n{config['app']} {config['endpoint']} ({config['batch_size']} rows/request), {load}, {config['duration']}s")
+    for name, result in report["results"].items():
+        print(f"  {name:<28} {result['value']:>12.3f} {result['unit']}")
+    print(f"  requests by status           {json.dumps(report['statuses'], sort_keys=True)}")
+    if report["dropped"]:
+        print(f"  not sent (client saturated)  {report['dropped']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test the prediction API")
+    parser.add_argument('--app', choices=sorted(PAYLOAD_FIELDS), default='api')
+    parser.add_argument('--server', choices=['subprocess', 'inprocess'], default='subprocess',
+                        help="how to start the app (ignored with --url)")
+    parser.add_argument('--url', help="test an already running server instead of starting one")
+    parser.add_argument('--api-key', help="x-api-key to send; by default a random key is set on the started server")
+    parser.add_argument('--endpoint', choices=['predict', 'batch'], default='predict')
+    parser.add_argument('--batch-size', type=int, default=50, help="questionnaires per /predict/batch request")
+    load = parser.add_mutually_exclusive_group()
+    load.add_argument('--rps', type=float, help="open loop at this many requests per second")
+    load.add_argument('--concurrency', type=int, help="closed loop with this many clients (default 4)")
+    parser.add_argument('--duration', type=float, default=20.0, help="measured seconds")
+    parser.add_argument('--warmup', type=float, default=3.0, help="seconds of load before measuring starts")
+    parser.add_argument('--timeout', type=float, default=30.0, help="per-request timeout in seconds")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="write the JSON report here")
+    args = parser.parse_args()
+    if args.batch_size < 1:
+        parser.error("--batch-size must be at least 1")
+    if not args.rps and not args.concurrency:
+        args.concurrency = 4
+
+    server = None
+    api_key = args.api_key
+    url = args.url
+    if url is None:
+        api_key = api_key or secrets.token_hex(16)
+        os.environ['API_SECRET_KEY'] = api_key
+        port = free_port()
+        url = f'http://127.0.0.1:{port}'
+        print(f"Starting {args.app} ({args.server}) on {url}...")
+        if args.server == 'inprocess':
+            server = InProcessServer(args.app, port)
+            wait_until_up(url)
+        else:
+            server = SubprocessServer(args.app, port, dict(os.environ))
+            wait_until_up(url, process=server.process)
+
+    try:
+        # at least one full batch, however large --batch-size is
+        payloads = make_payloads(args.app, max(10000, args.batch_size), args.seed)
+        if args.endpoint == 'batch':
+            path, rows_per_request = '/predict/batch', args.batch_size
+            bodies = [payloads[i:i + args.batch_size] for i in range(0, len(payloads) - args.batch_size + 1, args.batch_size)]
+        else:
+            path, rows_per_request = '/predict', 1
+            bodies = payloads
+
+        test = LoadTest(url, path, bodies, api_key, args.duration, args.warmup, rps=args.rps,
+                        concurrency=args.concurrency, timeout=args.timeout)
+        asyncio.run(test.run())
+    finally:
+        if server is not None:
+            server.stop()
+
+    report = {
+        "format": LOAD_TEST_FORMAT,
+        "created_at": time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        "config": {"app": args.app, "server": 'external' if args.url else args.server, "endpoint": args.endpoint,
+                   "batch_size": rows_per_request, "rps": args.rps, "concurrency": args.concurrency,
+                   "duration": args.duration, "warmup": args.warmup, "seed": args.seed},
+        "environment": {"python": platform.python_version(), "platform": platform.platform(), "cpu_count": os.cpu_count()},
+        "results": test.results(rows_per_request),
+        "statuses": dict(sorted(test.statuses.items())),
+        "dropped": test.dropped,
+    }
+    print_report(report)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+        print(f"\nReport saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
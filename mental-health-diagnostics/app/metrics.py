@@ -0,0 +1,297 @@
+import bisect
+import contextvars
+import sys
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+# Small in-process metrics registry rendered in the Prometheus text format, so /metrics works
+# without an extra dependency. Recording a value is a lock plus a bisect (about a microsecond),
+# which is noise next to a forest prediction.
+
+# latency buckets in seconds, 50us .. 10s
+DEFAULT_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def label_key(labels):
+    return tuple(sorted(labels.items())) if labels else ()
+
+
+def format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + '}'
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metrics:
+    def __init__(self, namespace, buckets=DEFAULT_BUCKETS):
+        self.namespace = namespace
+        self.buckets = tuple(buckets)
+        self.lock = threading.Lock()
+        # name -> (type, help); name -> {label key -> value}
+        self.meta = {}
+        self.values = {}
+
+    def define(self, name, kind, help_text):
+        self.meta[name] = (kind, help_text)
+        self.values.setdefault(name, {})
+
+    def inc(self, name, value=1, labels=None):
+        key = label_key(labels)
+        with self.lock:
+            series = self.values[name]
+            series[key] = series.get(key, 0) + value
+
+    def set(self, name, value, labels=None):
+        with self.lock:
+            self.values[name][label_key(labels)] = value
+
+    def clear(self, name, labels=None):
+        # every series of name, or only those carrying all of labels
+        with self.lock:
+            if labels is None:
+                self.values[name] = {}
+            else:
+                match = set(label_key(labels))
+                self.values[name] = {key: v for key, v in self.values[name].items() if not match <= set(key)}
+
+    def observe(self, name, value, labels=None):
+        key = label_key(labels)
+        with self.lock:
+            series = self.values[name]
+            hist = series.get(key)
+            if hist is None:
+                # per-bucket counts (not cumulative), then sum and count
+                hist = series[key] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+            hist[bisect.bisect_left(self.buckets, value)] += 1
+            hist[-2] += value
+            hist[-1] += 1
+
+    def render(self):
+        lines = []
+        with self.lock:
+            for name, (kind, help_text) in self.meta.items():
+                full = f'{self.namespace}_{name}'
+                lines.append(f'# HELP {full} {help_text}')
+                lines.append(f'# TYPE {full} {kind}')
+                for key, value in self.values[name].items():
+                    if kind != 'histogram':
+                        lines.append(f'{full}{format_labels(key)} {format_value(value)}')
+                        continue
+                    cumulative = 0
+                    for bound, count in zip(self.buckets + (float('inf'),), value):
+                        cumulative += count
+                        lines.append(f'{full}_bucket{format_labels(key, [("le", format_value(bound))])} {cumulative}')
+                    lines.append(f'{full}_sum{format_labels(key)} {format_value(value[-2])}')
+                    lines.append(f'{full}_count{format_labels(key)} {value[-1]}')
+        return '\n'.join(lines) + '\n'
+
+
+class StageTimer:
+    # Times the stages of one request (or one micro-batch). Each stage goes into the
+    # stage_duration_seconds histogram as soon as it ends and is kept for the Server-Timing
+    # header; repeated stages add up.
+
+    def __init__(self, metrics):
+        self.metrics = metrics
+        self.start = time.perf_counter()
+        self.stages = {}
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def since_start(self, name):
+        # everything from the start of the request up to now, e.g. body parsing and validation
+        self.record(name, time.perf_counter() - self.start)
+
+    def record(self, name, seconds):
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+        self.metrics.observe('stage_duration_seconds', seconds, {'stage': name})
+
+    def server_timing(self):
+        parts = [f'{name};dur={seconds * 1000:.3f}' for name, seconds in self.stages.items()]
+        parts.append(f'total;dur={(time.perf_counter() - self.start) * 1000:.3f}')
+        return ', '.join(parts)
+
+
+class NullTimer:
+    # stands in for StageTimer when metrics are off
+    stages = {}
+
+    def stage(self, name):
+        return nullcontext()
+
+    def since_start(self, name):
+        pass
+
+    def record(self, name, seconds):
+        pass
+
+
+NULL_TIMER = NullTimer()
+
+# the timer of the request being handled; set by MetricsMiddleware, NULL_TIMER outside a request
+current_timer = contextvars.ContextVar('current_timer', default=NULL_TIMER)
+
+
+def api_metrics(namespace='nura'):
+    # the series both APIs export
+    metrics = Metrics(namespace)
+    metrics.define('requests_total', 'counter', 'HTTP requests by endpoint and status code.')
+    metrics.define('request_duration_seconds', 'histogram', 'Time from receiving a request to sending its response.')
+    metrics.define('stage_duration_seconds', 'histogram', 'Time spent in each stage of a prediction.')
+    metrics.define('rows_predicted_total', 'counter', 'Questionnaires sent through the models.')
+    metrics.define('rows_explained_total', 'counter', 'Questionnaires explained by /explain.')
+    metrics.define('model_load_seconds', 'gauge', 'Time the active models took to load and warm up.')
+    metrics.define('model_reloads_total', 'counter', 'Model reloads since start, by result.')
+    metrics.define('model_info', 'gauge', 'Active model version.')
+    metrics.define('inference_in_flight', 'gauge', 'Model calls running or waiting on the inference executor.')
+    metrics.define('inference_rejected_total', 'counter', 'Requests rejected with 503 because the inference queue was full.')
+    metrics.define('cache_hits_total', 'counter', 'Prediction cache hits.')
+    metrics.define('cache_misses_total', 'counter', 'Prediction cache misses.')
+    metrics.define('startup_seconds', 'gauge', 'Cold start: importing the API module and serving its first prediction.')
+    metrics.define('input_drift', 'gauge', 'Jensen-Shannon divergence of each input column from the training data.')
+    metrics.define('input_unseen_values_total', 'counter', 'Answers the encoders had never seen, by input column.')
+    return metrics
+
+
+def collect_runtime(metrics, reloader, executor, family):
+    # copies the state other components already track into the registry before rendering;
+    # model series are labelled with the family, the executor and cache are per process
+    models = reloader.current
+    metrics.clear('model_info', {'family': family})
+    if models is not None:
+        metrics.set('model_load_seconds', reloader.load_seconds, {'family': family})
+        metrics.set('model_info', 1, {'family': family, 'version': models.artifacts.version, 'source': models.artifacts.source})
+        if models.cache is not None:
+            stats = models.cache.stats()
+            metrics.set('cache_hits_total', stats['hits'])
+            metrics.set('cache_misses_total', stats['misses'])
+    metrics.set('model_reloads_total', reloader.reloads, {'family': family, 'result': 'success'})
+    metrics.set('model_reloads_total', reloader.failures, {'family': family, 'result': 'failure'})
+    stats = executor.stats()
+    metrics.set('inference_in_flight', stats['in_flight'])
+    metrics.set('inference_rejected_total', stats['rejected'])
+
+
+def collect_drift(metrics, reloader, family):
+    # input drift of the active models (drift.py), for APIs that monitor it
+    metrics.clear('input_drift', {'family': family})
+    metrics.clear('input_unseen_values_total', {'family': family})
+    monitor = getattr(reloader.current, 'drift', None)
+    if monitor is not None:
+        monitor.collect(metrics, family)
+
+
+class StartupClock:
+    # Cold start of one API module, for scale-to-zero deployments where every start is felt:
+    # how long importing it took (from `started`, read before its first import), how long the
+    # first request that ran the models took, and which heavy libraries were loaded by then.
+    # Model loading is timed by the reloader (model_load_seconds).
+    HEAVY_MODULES = ('pandas', 'sklearn', 'scipy', 'joblib')
+
+    def __init__(self, started):
+        self.started = started
+        self.import_seconds = None
+        self.imported_modules = None
+        self.first_request_seconds = None
+        self.first_request_modules = None
+        self.lock = threading.Lock()
+
+    def heavy_modules(self):
+        return [name for name in self.HEAVY_MODULES if name in sys.modules]
+
+    def imported(self):
+        self.import_seconds = time.perf_counter() - self.started
+        self.imported_modules = self.heavy_modules()
+        print(f"Imported in {self.import_seconds * 1000:.0f} ms "
+              f"(heavy modules loaded: {', '.join(self.imported_modules) or 'none'})")
+
+    @contextmanager
+    def first_request(self):
+        # times the block if no request has been timed yet
+        if self.first_request_seconds is not None:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            with self.lock:
+                if self.first_request_seconds is None:
+                    self.first_request_seconds = time.perf_counter() - start
+                    self.first_request_modules = self.heavy_modules()
+
+    def status(self):
+        return {
+            "import_seconds": self.import_seconds,
+            "heavy_modules_after_import": self.imported_modules,
+            "first_request_seconds": self.first_request_seconds,
+            "heavy_modules_after_first_request": self.first_request_modules,
+        }
+
+    def collect(self, metrics, family):
+        for phase, seconds in (('import', self.import_seconds), ('first_request', self.first_request_seconds)):
+            if seconds is not None:
+                metrics.set('startup_seconds', seconds, {'family': family, 'phase': phase})
+
+
+class MetricsMiddleware:
+    # Plain ASGI middleware (cheaper than BaseHTTPMiddleware): counts requests, times them,
+    # gives each request a StageTimer and optionally adds a Server-Timing header.
+
+    def __init__(self, app, metrics, server_timing=False):
+        self.app = app
+        self.metrics = metrics
+        self.server_timing = server_timing
+        self.paths = None
+
+    def endpoint(self, scope):
+        # label by route path; anything else is 'other' so random URLs can't blow up the series.
+        # An app mounted under a prefix (service.py) sees the prefix in root_path, and keeps it
+        # in the label so /v1/predict and /v2/predict stay apart.
+        if self.paths is None:
+            self.paths = {getattr(route, 'path', None) for route in scope['app'].routes}
+        root, path = scope.get('root_path', ''), scope['path']
+        if root and path.startswith(root):
+            path = path[len(root):]
+        return root + path if path in self.paths else 'other'
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+
+        timer = StageTimer(self.metrics)
+        token = current_timer.set(timer)
+        status = 500
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+                if self.server_timing:
+                    headers = list(message.get('headers', [])) + [(b'server-timing', timer.server_timing().encode())]
+                    message = dict(message, headers=headers)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            current_timer.reset(token)
+            endpoint = self.endpoint(scope)
+            self.metrics.inc('requests_total', labels={'endpoint': endpoint, 'status': str(status)})
+            self.metrics.observe('request_duration_seconds', time.perf_counter() - timer.start, {'endpoint': endpoint})
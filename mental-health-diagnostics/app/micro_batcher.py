@@ -0,0 +1,76 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+
+class MicroBatcher:
+    # Coalesces concurrent single-row predictions into one batched model call.
+    # Request threads call submit(row) and block on a future; one worker thread collects
+    # rows for up to max_wait_ms (or max_batch_size rows), runs predict_fn on the whole
+    # list and hands each caller back its own result.
+    #
+    # The wait is adaptive: when the last batch had a single row (quiet traffic) the worker
+    # only drains what is already queued and dispatches right away, so low load pays no
+    # extra latency. It only holds the batch open once concurrent requests show up.
+
+    def __init__(self, predict_fn, max_batch_size=64, max_wait_ms=5.0):
+        # predict_fn takes a list of rows and returns a list of results in the same order
+        self.predict_fn = predict_fn
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self.queue = queue.Queue()
+        self.last_batch_size = 1
+        self.batches = 0
+        self.rows = 0
+        self.worker = threading.Thread(target=self.run, name="micro-batcher", daemon=True)
+        self.worker.start()
+
+    def submit(self, row):
+        return self.enqueue(row).result()
+
+    def enqueue(self, row):
+        # non-blocking submit, returns the future
+        future = Future()
+        self.queue.put((row, future))
+        return future
+
+    def collect(self):
+        batch = [self.queue.get()]
+        deadline = time.monotonic() + self.max_wait if self.last_batch_size > 1 else None
+        while len(batch) < self.max_batch_size:
+            try:
+                if deadline is None:
+                    batch.append(self.queue.get_nowait())
+                else:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    batch.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def run(self):
+        while True:
+            batch = self.collect()
+            self.last_batch_size = len(batch)
+            self.batches += 1
+            self.rows += len(batch)
+
+            rows = [row for row, _ in batch]
+            try:
+                results = self.predict_fn(rows)
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
+
+    def stats(self):
+        return {
+            "batches": self.batches,
+            "rows": self.rows,
+            "avg_batch_size": self.rows / self.batches if self.batches else 0.0,
+        }
@@ -0,0 +1,418 @@
+import numpy as np
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+
+try:
+    from app.flat_forest import FlatForest, SmallBatchRouter, flatten_checked, validate
+    from app.contributions import ContributionIndex
+    from app.drift import save_profile, load_profile
+except ImportError:
+    from flat_forest import FlatForest, SmallBatchRouter, flatten_checked, validate
+    from contributions import ContributionIndex
+    from drift import save_profile, load_profile
+
+# One versioned directory per model family holding everything a training run produced:
+#
+#   bundle/manifest.json          version, feature schema, encoder and label classes, file hashes
+#   bundle/forests/<target>/*.npy flat tree arrays (uncompressed, memory-mapped on load) and
+#                                 the per-node contribution index for explanations
+#   bundle/forests/<target>.pkl   the sklearn forest (uncompressed joblib, loaded on first use)
+#   bundle/drift_profile.json     input histograms of the training rows, for drift monitoring
+#
+# Loading reads only the manifest; tree arrays are mapped and the sklearn pickle is unpickled
+# lazily, so a cold start costs milliseconds. The manifest ties all pieces to one training run.
+# Without a bundle, load_artifacts() falls back to the six separate pickles.
+#
+# bundle/ is a symlink to a directory per version (bundle-<version>/) that is never changed
+# once written. A new bundle is published by renaming a new symlink over it, so there is
+# always exactly one complete bundle, and a loaded ModelBundle keeps reading the version it
+# opened even after a retrain. The last KEEP_VERSIONS versions are kept for processes that
+# still have an older one loaded.
+#
+# A forest is normally named after the one target it predicts. A joint forest (train_model.py
+# --joint) is one multi-output forest for several targets: it is stored once, under its own
+# name, and the manifest's "joint" section lists its targets in output order.
+
+BUNDLE_FORMAT = 1
+KEEP_VERSIONS = 3
+
+FAMILIES = {
+    'original': {
+        'bundle_dir': 'bundle',
+        'targets': {
+            'condition': ('condition_model.pkl', 'le_condition.pkl'),
+            'treatment': ('treatment_model.pkl', 'le_treatment.pkl'),
+        },
+        'encoders': 'encoders.pkl',
+        'feature_cols': 'feature_cols.pkl',
+        'drift_profile': 'drift_profile.json',
+    },
+    'modified': {
+        'bundle_dir': 'bundle_modified',
+        'targets': {
+            'treatment': ('treatment_model_modified.pkl', 'le_treatment_modified.pkl'),
+        },
+        'encoders': 'encoders_modified.pkl',
+        'feature_cols': 'feature_cols_modified.pkl',
+        'drift_profile': 'drift_profile_modified.json',
+        'answer_table': 'answer_table_modified.npy',
+    },
+}
+
+
+def file_hash(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+class LabelTable:
+    # LabelEncoder stand-in rebuilt from a class list, no sklearn needed
+    def __init__(self, classes):
+        self.classes_ = np.array(classes, dtype=object)
+
+    def transform(self, labels):
+        lookup = {label: idx for idx, label in enumerate(self.classes_)}
+        return np.array([lookup[label] for label in labels], dtype=np.int64)
+
+    def inverse_transform(self, idxs):
+        return self.classes_[np.asarray(idxs, dtype=np.int64)]
+
+
+class LazyModel:
+    # loads the real estimator the first time it is asked to predict
+    def __init__(self, loader):
+        self.loader = loader
+
+    def predict(self, X):
+        return self.loader().predict(X)
+
+    def predict_proba(self, X):
+        return self.loader().predict_proba(X)
+
+
+class OutputView:
+    # one target of a joint forest, for callers that predict targets one at a time
+    def __init__(self, model, output):
+        self.model = model
+        self.output = output
+
+    def predict(self, X):
+        return self.model.predict(X)[:, self.output]
+
+    def predict_proba(self, X):
+        return self.model.predict_proba(X)[self.output]
+
+
+def write_bundle(models_dir, family, models, labels, encoders, feature_cols, sample_X=None, joint=None, profile=None):
+    # models: forest name -> fitted forest, labels: target name -> LabelEncoder; a forest
+    # predicts the target of the same name, unless joint maps its name to a list of targets.
+    # profile: drift.training_profile() of the training rows
+    import joblib
+
+    joint = joint or {}
+
+    bundle_dir = os.path.join(models_dir, FAMILIES[family]['bundle_dir'])
+    tmp_dir = f"{bundle_dir}.tmp-{os.getpid()}"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(os.path.join(tmp_dir, 'forests'))
+
+    targets = {}
+    for name, model in models.items():
+        flat = FlatForest.from_sklearn(model)
+        if sample_X is not None and not validate(flat, model, sample_X):
+            raise ValueError(f"Flat export of the {name} model does not match sklearn")
+        flat.save(os.path.join(tmp_dir, 'forests', name))
+        index = ContributionIndex.from_forest(flat)
+        if sample_X is not None and not index.check(sample_X):
+            raise ValueError(f"Contributions of the {name} model do not add up to its probabilities")
+        index.save(os.path.join(tmp_dir, 'forests', name))
+        joblib.dump(model, os.path.join(tmp_dir, 'forests', name + '.pkl'))
+        for output, target in enumerate(joint.get(name, [name])):
+            targets[target] = {
+                "classes": labels[target].classes_.tolist(),
+                "n_features": int(model.n_features_in_),
+                "n_trees": flat.n_trees,
+                "n_nodes": flat.n_nodes,
+            }
+            if name in joint:
+                targets[target].update(model=name, output=output)
+
+    if profile is not None:
+        save_profile(os.path.join(tmp_dir, 'drift_profile.json'), profile)
+
+    files = {}
+    for root, _, names in os.walk(tmp_dir):
+        for name in sorted(names):
+            path = os.path.join(root, name)
+            rel = os.path.relpath(path, tmp_dir).replace(os.sep, '/')
+            files[rel] = {"sha256": file_hash(path), "size": os.path.getsize(path)}
+
+    content_hash = hashlib.sha256(json.dumps(files, sort_keys=True).encode()).hexdigest()
+    created_at = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())
+    manifest = {
+        "format": BUNDLE_FORMAT,
+        "family": family,
+        "version": time.strftime('%Y%m%dT%H%M%SZ', time.gmtime()) + '-' + content_hash[:8],
+        "created_at": created_at,
+        "feature_cols": list(feature_cols),
+        "encoders": {col: le.classes_.tolist() for col, le in encoders.items()},
+        "targets": targets,
+        "joint": {name: list(names) for name, names in joint.items()},
+        "files": files,
+    }
+    with open(os.path.join(tmp_dir, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=2)
+
+    version_dir = f"{bundle_dir}-{manifest['version']}"
+    if os.path.exists(version_dir):
+        # the same content written again within a second
+        shutil.rmtree(tmp_dir)
+    else:
+        os.replace(tmp_dir, version_dir)
+    publish(bundle_dir, version_dir)
+    prune_versions(bundle_dir)
+    print(f"Model bundle {manifest['version']} saved to {version_dir}")
+    return manifest
+
+
+def publish(bundle_dir, version_dir):
+    # point bundle_dir at version_dir with one rename, so readers see either the old bundle or
+    # the new one and never no bundle at all. The link is relative, so the models directory
+    # can be moved or mounted elsewhere
+    link = f"{bundle_dir}.link-{os.getpid()}"
+    if os.path.lexists(link):
+        os.remove(link)
+    os.symlink(os.path.basename(version_dir), link)
+    if os.path.isdir(bundle_dir) and not os.path.islink(bundle_dir):
+        # a bundle written before versioned directories: a symlink can't replace a directory,
+        # so this one switch-over moves it aside first
+        os.replace(bundle_dir, f"{bundle_dir}-{time.strftime('%Y%m%dT%H%M%SZ', time.gmtime())}-legacy")
+    os.replace(link, bundle_dir)
+
+
+def prune_versions(bundle_dir, keep=KEEP_VERSIONS):
+    models_dir, name = os.path.split(bundle_dir)
+    current = os.path.realpath(bundle_dir)
+    versions = [os.path.join(models_dir, entry) for entry in os.listdir(models_dir) if entry.startswith(name + '-')]
+    versions = [path for path in versions if os.path.isdir(path) and os.path.realpath(path) != current]
+    versions.sort(key=os.path.getmtime, reverse=True)
+    for path in versions[keep - 1:]:
+        shutil.rmtree(path, ignore_errors=True)
+
+
+class ModelBundle:
+    source = 'bundle'
+
+    def __init__(self, bundle_dir, verify='fast'):
+        start = time.perf_counter()
+        # the version directory bundle_dir points to now: everything loaded later, lazily,
+        # comes from the same version as the manifest
+        self.bundle_dir = os.path.realpath(bundle_dir)
+        with open(os.path.join(self.bundle_dir, 'manifest.json')) as f:
+            self.manifest = json.load(f)
+        self.check(verify)
+
+        self.family = self.manifest['family']
+        self.version = self.manifest['version']
+        self.created_at = self.manifest['created_at']
+        self.feature_cols = self.manifest['feature_cols']
+        self.encoders = {col: LabelTable(classes) for col, classes in self.manifest['encoders'].items()}
+        self.labels = {target: LabelTable(info['classes']) for target, info in self.manifest['targets'].items()}
+        # joint forest name -> the targets it predicts, in output order
+        self.joint = self.manifest.get('joint', {})
+        self.forests = {}
+        self.indexes = {}
+        self.models = {}
+        self.lock = threading.Lock()
+        self.load_seconds = time.perf_counter() - start
+
+    def check(self, verify):
+        # 'fast' checks presence and sizes, 'full' also re-hashes every file
+        if self.manifest.get('format') != BUNDLE_FORMAT:
+            raise ValueError(f"Unsupported bundle format {self.manifest.get('format')} in {self.bundle_dir}")
+        for rel, info in self.manifest['files'].items():
+            path = os.path.join(self.bundle_dir, rel)
+            if not os.path.exists(path):
+                raise ValueError(f"Bundle {self.bundle_dir} is missing {rel}")
+            if os.path.getsize(path) != info['size']:
+                raise ValueError(f"Bundle file {rel} has the wrong size")
+            if verify == 'full' and file_hash(path) != info['sha256']:
+                raise ValueError(f"Bundle file {rel} does not match its manifest hash")
+        for target, info in self.manifest['targets'].items():
+            if info['n_features'] != len(self.manifest['feature_cols']):
+                raise ValueError(f"The {target} model expects {info['n_features']} features, "
+                                 f"manifest lists {len(self.manifest['feature_cols'])}")
+
+    def forest_name(self, target):
+        # the stored forest that predicts target, and which of its outputs it is (None if the only one)
+        info = self.manifest['targets'][target]
+        return info.get('model', target), info.get('output')
+
+    def model_hash(self, target):
+        name, _ = self.forest_name(target)
+        return self.manifest['files'][f'forests/{name}.pkl']['sha256']
+
+    def load_forest(self, name):
+        # memory-mapped flat arrays; pages are read from disk only when touched
+        if name not in self.forests:
+            with self.lock:
+                if name not in self.forests:
+                    self.forests[name] = FlatForest.load(os.path.join(self.bundle_dir, 'forests', name), mmap_mode='r')
+        return self.forests[name]
+
+    def contributions(self, name):
+        # per-node contribution index of a forest; bundles written before it existed get
+        # one computed from the tree arrays (kept in memory, not written back)
+        if name not in self.indexes:
+            forest = self.load_forest(name)
+            with self.lock:
+                if name not in self.indexes:
+                    directory = os.path.join(self.bundle_dir, 'forests', name)
+                    self.indexes[name] = (ContributionIndex.load(forest, directory)
+                                          or ContributionIndex.from_forest(forest))
+        return self.indexes[name]
+
+    def load_model(self, name):
+        if name not in self.models:
+            with self.lock:
+                if name not in self.models:
+                    import joblib
+                    self.models[name] = joblib.load(os.path.join(self.bundle_dir, 'forests', name + '.pkl'))
+        return self.models[name]
+
+    def drift_profile(self):
+        # None for bundles written before training profiles existed
+        return load_profile(os.path.join(self.bundle_dir, 'drift_profile.json'))
+
+    def forest(self, target):
+        name, output = self.forest_name(target)
+        forest = self.load_forest(name)
+        return forest if output is None else OutputView(forest, output)
+
+    def model(self, target):
+        name, output = self.forest_name(target)
+        model = self.load_model(name)
+        return model if output is None else OutputView(model, output)
+
+    def forest_predictor(self, name, flat, max_rows):
+        # flat arrays were checked against sklearn when the bundle was written
+        lazy = LazyModel(lambda: self.load_model(name))
+        if flat:
+            return SmallBatchRouter(self.load_forest(name), lazy, max_rows=max_rows)
+        return lazy
+
+    def predictor(self, target, encoder=None, flat=False, max_rows=FlatForest.ALL_TREES_MAX_ROWS):
+        name, output = self.forest_name(target)
+        predictor = self.forest_predictor(name, flat, max_rows)
+        return predictor if output is None else OutputView(predictor, output)
+
+    def joint_name(self, targets):
+        # the joint forest predicting exactly these targets in this order, if there is one
+        for name, names in self.joint.items():
+            if names == list(targets):
+                return name
+        return None
+
+    def joint_predictor(self, targets, encoder=None, flat=False, max_rows=FlatForest.ALL_TREES_MAX_ROWS):
+        # one predictor whose .predict(X) has a column per target, or None and the caller
+        # predicts target by target
+        name = self.joint_name(targets)
+        return None if name is None else self.forest_predictor(name, flat, max_rows)
+
+
+class PickleArtifacts:
+    # the separate pickles written by older training runs
+    source = 'pickles'
+
+    def __init__(self, models_dir, family):
+        import joblib
+
+        start = time.perf_counter()
+        spec = FAMILIES[family]
+        self.family = family
+        self.models_dir = models_dir
+        self.model_paths = {}
+        self.models = {}
+        self.labels = {}
+        self.joint = {}
+        for target, (model_file, label_file) in spec['targets'].items():
+            self.model_paths[target] = os.path.join(models_dir, model_file)
+            if not os.path.exists(self.model_paths[target]):
+                raise FileNotFoundError(self.model_paths[target])
+            self.labels[target] = joblib.load(os.path.join(models_dir, label_file))
+        self.lock = threading.Lock()
+        self.encoders = joblib.load(os.path.join(models_dir, spec['encoders']))
+        self.feature_cols = joblib.load(os.path.join(models_dir, spec['feature_cols']))
+        mtime = max(os.path.getmtime(path) for path in self.model_paths.values())
+        self.created_at = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(mtime))
+        self.version = 'pickles-' + time.strftime('%Y%m%dT%H%M%SZ', time.gmtime(mtime))
+        self.hashes = {}
+        self.load_seconds = time.perf_counter() - start
+
+    def model_hash(self, target):
+        if target not in self.hashes:
+            self.hashes[target] = file_hash(self.model_paths[target])
+        return self.hashes[target]
+
+    def forest(self, target):
+        return FlatForest.from_sklearn(self.model(target))
+
+    def drift_profile(self):
+        name = FAMILIES[self.family].get('drift_profile')
+        return load_profile(os.path.join(self.models_dir, name)) if name else None
+
+    def model(self, target):
+        if target not in self.models:
+            with self.lock:
+                if target not in self.models:
+                    import joblib
+                    self.models[target] = joblib.load(self.model_paths[target])
+        return self.models[target]
+
+    def predictor(self, target, encoder=None, flat=False, max_rows=FlatForest.ALL_TREES_MAX_ROWS):
+        model = self.model(target)
+        if flat:
+            return flatten_checked(model, encoder, self.feature_cols, max_rows) or model
+        return model
+
+    def joint_name(self, targets):
+        # joint forests only exist in bundles
+        return None
+
+    def joint_predictor(self, targets, encoder=None, flat=False, max_rows=FlatForest.ALL_TREES_MAX_ROWS):
+        return None
+
+
+def artifact_signature(models_dir, family):
+    # size and mtime of every file the API loads with the models; changes when training writes
+    # a new bundle or new pickles, or a new drift profile or answer table. The bundle's own
+    # drift_profile.json is covered by its manifest
+    spec = FAMILIES[family]
+    names = [os.path.join(spec['bundle_dir'], 'manifest.json'), spec['encoders'], spec['feature_cols']]
+    for model_file, label_file in spec['targets'].values():
+        names += [model_file, label_file]
+    names += [spec[key] for key in ('drift_profile', 'answer_table') if key in spec]
+    signature = []
+    for name in names:
+        try:
+            stat = os.stat(os.path.join(models_dir, name))
+            signature.append((name, stat.st_size, stat.st_mtime_ns))
+        except FileNotFoundError:
+            signature.append((name, None, None))
+    return tuple(signature)
+
+
+def load_artifacts(models_dir, family, verify=None):
+    # bundle when training wrote one, otherwise the separate pickles
+    verify = verify or os.getenv("BUNDLE_VERIFY", "fast")
+    bundle_dir = os.path.join(models_dir, FAMILIES[family]['bundle_dir'])
+    if os.path.exists(os.path.join(bundle_dir, 'manifest.json')):
+        return ModelBundle(bundle_dir, verify=verify)
+    return PickleArtifacts(models_dir, family)
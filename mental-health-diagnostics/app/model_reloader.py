@@ -0,0 +1,144 @@
+import threading
+import time
+
+
+class ModelReloader:
+    # Holds the live model set and replaces it without restarting the server.
+    # load_fn() builds a complete new set (artifacts, encoders, predictors, cache) and
+    # warm_up_fn(models) runs real predictions through it; only a set that passes both is
+    # swapped in, with a single assignment to .current. Requests read .current once and keep
+    # that reference, so in-flight requests finish on the version they started with and the
+    # old set is freed when the last of them returns. A failed reload keeps the old set.
+    # unload() drops the set the same way; the next reload() loads it again.
+
+    def __init__(self, load_fn, warm_up_fn=None):
+        self.load_fn = load_fn
+        self.warm_up_fn = warm_up_fn
+        self.current = None
+        # held for the whole load, so there is never more than one reload running
+        self.lock = threading.Lock()
+        self.loaded_at = None
+        self.load_seconds = None
+        self.reloads = 0
+        self.failures = 0
+        self.last_error = None
+        self.watcher = None
+        # while unloaded, changed files don't trigger a reload
+        self.unloaded = False
+        # called with the new set right after every swap (not the first load), and with None
+        # after an unload
+        self.listeners = []
+
+    def reload(self, blocking=True):
+        # True when a new set went live, False when it failed, None when another reload
+        # was already running and blocking=False
+        if not self.lock.acquire(blocking=blocking):
+            return None
+        try:
+            return self._reload()
+        finally:
+            self.lock.release()
+
+    def reload_in_background(self):
+        # False when a reload is already running
+        if not self.lock.acquire(blocking=False):
+            return False
+
+        def run():
+            try:
+                self._reload()
+            finally:
+                self.lock.release()
+
+        threading.Thread(target=run, daemon=True).start()
+        return True
+
+    def _reload(self):
+        start = time.perf_counter()
+        try:
+            models = self.load_fn()
+            if self.warm_up_fn is not None:
+                self.warm_up_fn(models)
+        except Exception as e:
+            self.failures += 1
+            self.last_error = f"{type(e).__name__}: {e}"
+            if self.current is not None:
+                print(f"Model reload failed, still serving version {self.current.artifacts.version}: {self.last_error}")
+            return False
+
+        load_seconds = time.perf_counter() - start
+        first_load = self.loaded_at is None
+        if self.current is not None:
+            self.reloads += 1
+            print(f"Switching to model version {models.artifacts.version} ({load_seconds * 1000:.0f} ms to load and warm up).")
+        self.current = models
+        self.load_seconds = load_seconds
+        self.loaded_at = time.time()
+        self.last_error = None
+        self.unloaded = False
+        if not first_load:
+            for listener in self.listeners:
+                listener(models)
+        return True
+
+    def unload(self):
+        # False when a reload is running
+        if not self.lock.acquire(blocking=False):
+            return False
+        try:
+            if self.current is not None:
+                print(f"Unloading model version {self.current.artifacts.version}.")
+                self.current = None
+                for listener in self.listeners:
+                    listener(None)
+            self.unloaded = True
+            return True
+        finally:
+            self.lock.release()
+
+    def watch(self, signature_fn, interval=5.0):
+        # polls signature_fn() (file sizes and mtimes) and reloads once a change has held still
+        # for a full interval, so files that are still being copied are not picked up
+        if self.watcher is not None:
+            return
+
+        def loop():
+            loaded = signature_fn()
+            pending = None
+            while True:
+                time.sleep(interval)
+                signature = signature_fn()
+                if signature == loaded or self.unloaded:
+                    loaded, pending = signature, None
+                elif signature != pending:
+                    pending = signature
+                else:
+                    print("Model files changed, reloading...")
+                    self.reload()
+                    # a failed reload is not retried until the files change again
+                    loaded, pending = signature, None
+
+        self.watcher = threading.Thread(target=loop, daemon=True)
+        self.watcher.start()
+
+    def status(self):
+        models = self.current
+        if models is None:
+            return {"loaded": False, "unloaded": self.unloaded, "reloading": self.lock.locked(), "failures": self.failures,
+                    "last_error": self.last_error}
+        artifacts = models.artifacts
+        return {
+            "loaded": True,
+            "version": artifacts.version,
+            "source": artifacts.source,
+            "created_at": artifacts.created_at,
+            # forests predicting several targets at once, e.g. {"joint": ["condition", "treatment"]}
+            "joint": artifacts.joint,
+            "loaded_at": time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(self.loaded_at)),
+            "load_ms": round(self.load_seconds * 1000, 1),
+            "reloads": self.reloads,
+            "failures": self.failures,
+            "last_error": self.last_error,
+            "reloading": self.lock.locked(),
+            "watching": self.watcher is not None,
+        }
@@ -0,0 +1,191 @@
+import json
+import os
+import time
+import numpy as np
+from sklearn.base import clone
+from sklearn.experimental import enable_halving_search_cv  # noqa: F401 (enables HalvingGridSearchCV)
+from sklearn.model_selection import GridSearchCV, HalvingGridSearchCV, ParameterGrid, StratifiedKFold, ParameterSampler, cross_val_score
+
+# Hyperparameter search for the training scripts. The exhaustive grid fits every combination
+# on every fold, which gets slow on large datasets, so there are two cheaper strategies:
+#
+#   grid     GridSearchCV over the whole grid (the old behaviour)
+#   halving  successive halving: every candidate starts on a small resource (a few trees, or a
+#            sample of the rows) and only the best 1/factor move on to the next, larger round
+#   random   random candidates from the grid until a fit budget or a time limit is used up
+#
+# All strategies score on the same precomputed folds, so the condition and treatment searches
+# (and a comparison run of the full grid) see exactly the same splits.
+#
+# Env: SEARCH_STRATEGY (grid), SEARCH_RESOURCE (n_estimators or n_samples, for halving),
+# SEARCH_FACTOR (3), SEARCH_BUDGET (fits, for random), SEARCH_TIME_LIMIT (seconds, for random),
+# SEARCH_COMPARE_GRID=1 to also run the full grid and report the score gap.
+
+STRATEGIES = ('grid', 'halving', 'random')
+RESOURCES = ('n_estimators', 'n_samples')
+# random search budget in fits when neither a budget nor a time limit is given
+DEFAULT_BUDGET = 60
+
+
+class SearchConfig:
+    def __init__(self, strategy='grid', resource='n_estimators', factor=3, budget=None, time_limit=None,
+                 cv=3, seed=42, compare_grid=False):
+        if strategy not in STRATEGIES:
+            raise ValueError(f"Unknown search strategy {strategy!r}, expected one of {', '.join(STRATEGIES)}")
+        if resource not in RESOURCES:
+            raise ValueError(f"Unknown halving resource {resource!r}, expected one of {', '.join(RESOURCES)}")
+        self.strategy = strategy
+        self.resource = resource
+        self.factor = factor
+        self.budget = budget
+        self.time_limit = time_limit
+        self.cv = cv
+        self.seed = seed
+        self.compare_grid = compare_grid
+
+    @classmethod
+    def from_env(cls, **overrides):
+        budget = os.getenv('SEARCH_BUDGET')
+        time_limit = os.getenv('SEARCH_TIME_LIMIT')
+        config = dict(strategy=os.getenv('SEARCH_STRATEGY', 'grid'),
+                      resource=os.getenv('SEARCH_RESOURCE', 'n_estimators'),
+                      factor=int(os.getenv('SEARCH_FACTOR', '3')),
+                      budget=int(budget) if budget else None,
+                      time_limit=float(time_limit) if time_limit else None,
+                      compare_grid=os.getenv('SEARCH_COMPARE_GRID', '0') == '1')
+        config.update({k: v for k, v in overrides.items() if v is not None})
+        return cls(**config)
+
+    def describe(self):
+        if self.strategy == 'halving':
+            return f"halving on {self.resource}, factor {self.factor}"
+        if self.strategy == 'random':
+            limits = []
+            if self.budget or not self.time_limit:
+                limits.append(f"{self.budget or DEFAULT_BUDGET} fits")
+            if self.time_limit:
+                limits.append(f"{self.time_limit:g}s")
+            return f"random, up to {' / '.join(limits)}"
+        return "full grid"
+
+
+def make_folds(y, cv=3):
+    # the folds GridSearchCV(cv=3) picks for a classifier: StratifiedKFold on y, unshuffled. As
+    # row positions they work for any other target of the same rows too (train_model.py passes
+    # the condition labels and reuses the folds for treatment and the joint model)
+    return list(StratifiedKFold(n_splits=cv).split(np.zeros((len(y), 1)), y))
+
+
+class SearchResult:
+    # the parts of a fitted *SearchCV the training scripts use, plus what the search cost
+    def __init__(self, strategy, best_estimator, best_params, best_score, candidates, fits, seconds):
+        self.strategy = strategy
+        self.best_estimator_ = best_estimator
+        self.best_params_ = best_params
+        self.best_score_ = float(best_score)
+        self.candidates = candidates
+        self.fits = fits
+        self.seconds = seconds
+
+    def summary(self):
+        return {"strategy": self.strategy, "best_params": self.best_params_, "best_score": round(self.best_score_, 6),
+                "candidates": self.candidates, "fits": self.fits, "seconds": round(self.seconds, 3)}
+
+
+def grid_search(estimator, param_grid, X, y, folds, scoring=None):
+    start = time.perf_counter()
+    search = GridSearchCV(estimator=estimator, param_grid=param_grid, cv=folds, scoring=scoring, n_jobs=-1, verbose=1)
+    search.fit(X, y)
+    candidates = len(ParameterGrid(param_grid))
+    return SearchResult('grid', search.best_estimator_, search.best_params_, search.best_score_,
+                        candidates, candidates * len(folds), time.perf_counter() - start)
+
+
+def halving_search(estimator, param_grid, X, y, folds, config, scoring=None):
+    start = time.perf_counter()
+    param_grid = dict(param_grid)
+    if config.resource == 'n_estimators':
+        # trees are the resource: the rounds grow up to the largest n_estimators of the grid
+        max_trees = max(param_grid.pop('n_estimators', [estimator.n_estimators]))
+        search = HalvingGridSearchCV(estimator, param_grid, cv=folds, resource='n_estimators', max_resources=max_trees,
+                                     min_resources='exhaust', factor=config.factor, scoring=scoring, refit=False,
+                                     random_state=config.seed, n_jobs=-1, verbose=1)
+        search.fit(X, y)
+        # 'exhaust' rounds the last round down (e.g. 297 of 300 trees), so refit with the full count
+        best_params = dict(search.best_params_, n_estimators=max_trees)
+        best = clone(estimator).set_params(**best_params).fit(X, y)
+    else:
+        search = HalvingGridSearchCV(estimator, param_grid, cv=folds, resource='n_samples', min_resources='exhaust',
+                                     factor=config.factor, scoring=scoring, random_state=config.seed, n_jobs=-1, verbose=1)
+        search.fit(X, y)
+        best_params, best = search.best_params_, search.best_estimator_
+    return SearchResult('halving', best, best_params, search.best_score_, int(search.n_candidates_[0]),
+                        int(sum(search.n_candidates_)) * len(folds), time.perf_counter() - start)
+
+
+def random_search(estimator, param_grid, X, y, folds, config, scoring=None):
+    # RandomizedSearchCV can't stop on a clock, so candidates are cross-validated one by one and
+    # the search stops before a candidate that would go over the fit budget or (judging by the
+    # average so far) the time limit
+    start = time.perf_counter()
+    budget = config.budget or (None if config.time_limit else DEFAULT_BUDGET)
+    n_candidates = len(ParameterGrid(param_grid))
+    best_score, best_params, fits, tried = None, None, 0, 0
+    for params in ParameterSampler(param_grid, n_iter=n_candidates, random_state=config.seed):
+        elapsed = time.perf_counter() - start
+        if tried and budget is not None and fits + len(folds) > budget:
+            break
+        if tried and config.time_limit is not None and elapsed + elapsed / tried > config.time_limit:
+            break
+        scores = cross_val_score(clone(estimator).set_params(**params), X, y, cv=folds, scoring=scoring, n_jobs=-1)
+        fits += len(folds)
+        tried += 1
+        if best_score is None or scores.mean() > best_score:
+            best_score, best_params = scores.mean(), params
+    print(f"Random search: {tried} of {n_candidates} candidates, {fits} fits")
+    best = clone(estimator).set_params(**best_params).fit(X, y)
+    return SearchResult('random', best, best_params, best_score, tried, fits, time.perf_counter() - start)
+
+
+def search(estimator, param_grid, X, y, folds, config, scoring=None):
+    # scoring: any GridSearchCV scoring, None for the estimator's own accuracy
+    if config.strategy == 'halving':
+        result = halving_search(estimator, param_grid, X, y, folds, config, scoring)
+    elif config.strategy == 'random':
+        result = random_search(estimator, param_grid, X, y, folds, config, scoring)
+    else:
+        result = grid_search(estimator, param_grid, X, y, folds, scoring)
+    print(f"Search ({config.describe()}): best CV score {result.best_score_:.4f} after {result.fits} fits "
+          f"in {result.seconds:.1f}s")
+
+    report = result.summary()
+    if config.compare_grid and config.strategy != 'grid':
+        grid = grid_search(estimator, param_grid, X, y, folds, scoring)
+        report["grid"] = grid.summary()
+        report["score_gap"] = round(grid.best_score_ - result.best_score_, 6)
+        report["speedup"] = round(grid.seconds / result.seconds, 2) if result.seconds else None
+        print(f"Full grid: best CV score {grid.best_score_:.4f} after {grid.fits} fits in {grid.seconds:.1f}s "
+              f"(gap {report['score_gap']:.4f}, {config.strategy} {report['speedup']}x faster)")
+    result.report = report
+    return result
+
+
+def save_report(path, config, reports):
+    with open(path, 'w') as f:
+        json.dump({"search": config.describe(), "targets": reports}, f, indent=2, default=str)
+
+
+def add_arguments(parser):
+    # the training scripts' flags; anything not given falls back to the SEARCH_* env vars
+    parser.add_argument('--search', choices=STRATEGIES, help="hyperparameter search strategy (default grid)")
+    parser.add_argument('--resource', choices=RESOURCES, help="what halving grows between rounds (default n_estimators)")
+    parser.add_argument('--factor', type=int, help="halving keeps 1/factor of the candidates per round (default 3)")
+    parser.add_argument('--budget', type=int, help=f"random search: maximum number of fits (default {DEFAULT_BUDGET})")
+    parser.add_argument('--time-limit', type=float, help="random search: stop starting candidates after this many seconds")
+    parser.add_argument('--compare-grid', action='store_true', default=None,
+                        help="also run the full grid on the same folds and report the score gap")
+
+
+def config_from_args(args):
+    return SearchConfig.from_env(strategy=args.search, resource=args.resource, factor=args.factor, budget=args.budget,
+                                 time_limit=args.time_limit, compare_grid=args.compare_grid)
@@ -1,8 +1,8 @@
 import pandas as pd
 import numpy as np
-import joblib
 import os
-from data_utils import clean_gender, preprocess_input
+from data_utils import clean_gender, preprocess_input, compile_encoders
+from model_bundle import load_artifacts
 
 def get_user_input(feature_cols, encoders):
     input_data = {}
@@ -40,15 +40,18 @@ def predict():
 
     print("Loading models...")
     try:
-        condition_model = joblib.load(os.path.join(MODELS_DIR, 'condition_model.pkl'))
-        treatment_model = joblib.load(os.path.join(MODELS_DIR, 'treatment_model.pkl'))
-        le_condition = joblib.load(os.path.join(MODELS_DIR, 'le_condition.pkl'))
-        le_treatment = joblib.load(os.path.join(MODELS_DIR, 'le_treatment.pkl'))
-        encoders = joblib.load(os.path.join(MODELS_DIR, 'encoders.pkl'))
-        feature_cols = joblib.load(os.path.join(MODELS_DIR, 'feature_cols.pkl'))
+        artifacts = load_artifacts(MODELS_DIR, 'original')
     except FileNotFoundError:
         print("Models not found. Please run train_model.py first.")
         return
+    # a joint model (train_model.py --joint) answers both targets in one call
+    joint_model = artifacts.joint_predictor(['condition', 'treatment'])
+    condition_model = artifacts.model('condition')
+    treatment_model = artifacts.model('treatment')
+    le_condition = artifacts.labels['condition']
+    le_treatment = artifacts.labels['treatment']
+    encoders = artifacts.encoders
+    feature_cols = artifacts.feature_cols
 
     # Get input
     user_input = get_user_input(feature_cols, encoders)
@@ -57,18 +60,23 @@ def predict():
     df = pd.DataFrame([user_input])
     
     # Preprocess
-    df = preprocess_input(df, encoders)
+    encoder = compile_encoders(encoders)
+    df = preprocess_input(df, encoder)
             
     # maintaning correct order
-    X = df[feature_cols]
+    X = encoder.features(df, feature_cols)
     
     print("\n--- Prediction Results ---")
     
-    cond_idx = condition_model.predict(X)[0]
+    if joint_model is not None:
+        cond_idx, treat_idx = joint_model.predict(X)[0]
+    else:
+        cond_idx = condition_model.predict(X)[0]
+        treat_idx = treatment_model.predict(X)[0]
+    
     condition = le_condition.inverse_transform([cond_idx])[0]
     print(f"Predicted Condition: {condition}")
     
-    treat_idx = treatment_model.predict(X)[0]
     treatment = le_treatment.inverse_transform([treat_idx])[0]
     print(f"Treatment Needed: {treatment}")
 
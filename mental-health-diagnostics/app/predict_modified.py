@@ -1,8 +1,8 @@
 import pandas as pd
 import numpy as np
-import joblib
 import os
-from data_utils_modified import clean_gender, preprocess_input
+from data_utils_modified import clean_gender, preprocess_input, compile_encoders
+from model_bundle import load_artifacts
 
 def get_user_input(feature_cols, encoders):
     input_data = {}
@@ -40,13 +40,14 @@ def predict():
 
     print("Loading models...")
     try:
-        treatment_model = joblib.load(os.path.join(MODELS_DIR, 'treatment_model_modified.pkl'))
-        le_treatment = joblib.load(os.path.join(MODELS_DIR, 'le_treatment_modified.pkl'))
-        encoders = joblib.load(os.path.join(MODELS_DIR, 'encoders_modified.pkl'))
-        feature_cols = joblib.load(os.path.join(MODELS_DIR, 'feature_cols_modified.pkl'))
+        artifacts = load_artifacts(MODELS_DIR, 'modified')
     except FileNotFoundError:
         print("Models not found. Please run train_model_modified.py first.")
         return
+    treatment_model = artifacts.model('treatment')
+    le_treatment = artifacts.labels['treatment']
+    encoders = artifacts.encoders
+    feature_cols = artifacts.feature_cols
 
     # Get input
     user_input = get_user_input(feature_cols, encoders)
@@ -55,10 +56,11 @@ def predict():
     df = pd.DataFrame([user_input])
     
     # Preprocess
-    df = preprocess_input(df, encoders)
+    encoder = compile_encoders(encoders)
+    df = preprocess_input(df, encoder)
             
     # maintaning correct order
-    X = df[feature_cols]
+    X = encoder.features(df, feature_cols)
     
     print("\n--- Prediction Results ---")
     
@@ -0,0 +1,89 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class PredictionCache:
+    # In-process LRU cache of predictions keyed on the encoded feature row.
+    # Keys are taken after preprocess_input, so 'male', 'M' and 'Male ' all land on the same
+    # entry. Entries are evicted when the cache is full (least recently used first) or when
+    # they are older than ttl seconds. Callers pass a namespace (model family and version) that
+    # is prepended to every key, so one cache can serve several models; otherwise call clear()
+    # whenever the models change.
+
+    def __init__(self, max_size=10000, ttl=3600):
+        self.max_size = max(1, int(max_size))
+        self.ttl = float(ttl) if ttl else None
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key):
+        # returns (found, value)
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                stored_at, value = entry
+                if self.ttl is None or now - stored_at < self.ttl:
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return True, value
+                del self.entries[key]
+                self.expirations += 1
+            self.misses += 1
+            return False, None
+
+    def put(self, key, value):
+        with self.lock:
+            self.entries[key] = (time.monotonic(), value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def predict(self, X, predict_fn, namespace=()):
+        # predict_fn gets only the rows of X that missed and returns one result per row;
+        # X is a DataFrame or a plain array (api.py's FAST_PATH)
+        if hasattr(X, 'itertuples'):
+            rows, take = X.itertuples(index=False, name=None), lambda idx: X.iloc[idx]
+        else:
+            rows, take = map(tuple, X.tolist()), lambda idx: X[idx]
+        keys = [namespace + row for row in rows]
+        results = [None] * len(keys)
+        missing = []
+        for i, key in enumerate(keys):
+            found, value = self.get(key)
+            if found:
+                results[i] = value
+            else:
+                missing.append(i)
+
+        if missing:
+            computed = predict_fn(take(missing))
+            for i, value in zip(missing, computed):
+                results[i] = value
+                self.put(keys[i], value)
+        return results
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": True,
+                "size": len(self.entries),
+                "max_size": self.max_size,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
@@ -0,0 +1,44 @@
+import threading
+
+try:
+    from app.inference_executor import InferenceExecutor
+    from app.metrics import api_metrics
+    from app.prediction_cache import PredictionCache
+except ImportError:
+    from inference_executor import InferenceExecutor
+    from metrics import api_metrics
+    from prediction_cache import PredictionCache
+
+# The parts of the serving runtime that exist once per process, however many model families
+# it serves (service.py runs api.py and api_modified.py side by side). The first API module to
+# ask creates each piece from its settings; every later one gets the same object:
+#
+#   executor()          one bounded pool for all model calls, so the families share the CPUs
+#                       instead of each sizing a pool for the whole machine
+#   metrics()           one registry; per-family series carry a family label
+#   prediction_cache()  one LRU of predictions; keys carry the model family and version, so
+#                       families never see each other's entries and a reload never serves stale ones
+#
+# A single API in its own process gets exactly what it used to create itself.
+
+lock = threading.Lock()
+shared = {}
+
+
+def get_or_create(name, factory):
+    with lock:
+        if name not in shared:
+            shared[name] = factory()
+        return shared[name]
+
+
+def executor(kind='thread', max_workers=None, max_queue=64, retry_after=1):
+    return get_or_create('executor', lambda: InferenceExecutor(kind, max_workers, max_queue, retry_after))
+
+
+def metrics():
+    return get_or_create('metrics', api_metrics)
+
+
+def prediction_cache(max_size=10000, ttl=3600):
+    return get_or_create('prediction_cache', lambda: PredictionCache(max_size=max_size, ttl=ttl))
@@ -0,0 +1,76 @@
+import importlib
+import os
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import Response
+from dotenv import load_dotenv
+import runtime
+from metrics import collect_runtime, collect_drift
+
+# Both model families behind one server, each under its own version prefix:
+#
+#   /v1/...  api.py           original PatientData schema, condition and treatment
+#   /v2/...  api_modified.py  modified schema, treatment
+#
+# The two APIs are mounted unchanged, so every route of theirs is there under its prefix
+# (/v1/predict, /v2/predict/batch, /v2/model, /v1/admin/reload, ...). They run in one
+# process, so pandas and sklearn are imported once, and they share one inference executor,
+# one metrics registry and one prediction cache (runtime.py): one uvicorn worker serves both
+# and the executor's limits apply to the machine, not to each family.
+#
+# SERVICE_FAMILIES picks the families to serve (default both). A family left out is never
+# imported and its models are never loaded. At runtime POST /v1/admin/unload frees a family's
+# models (its routes answer 503) and POST /v1/admin/reload loads them again.
+#
+#   SERVICE_FAMILIES=original,modified uvicorn service:app --host 0.0.0.0 --port 8000
+
+load_dotenv()
+
+# family -> (route prefix, API module)
+FAMILY_APPS = {
+    'original': ('/v1', 'api'),
+    'modified': ('/v2', 'api_modified'),
+}
+SERVICE_FAMILIES = [f.strip() for f in os.getenv("SERVICE_FAMILIES", "original,modified").split(',') if f.strip()]
+METRICS = os.getenv("METRICS", "1") == "1"
+
+unknown = sorted(set(SERVICE_FAMILIES) - set(FAMILY_APPS))
+if unknown:
+    raise ValueError(f"Unknown model families in SERVICE_FAMILIES: {', '.join(unknown)} "
+                     f"(expected {', '.join(FAMILY_APPS)})")
+
+app = FastAPI(title="Mental Health Diagnostics Service")
+
+# family -> its API module, with the models it loaded on import
+apis = {}
+for family in SERVICE_FAMILIES:
+    prefix, module_name = FAMILY_APPS[family]
+    apis[family] = importlib.import_module(module_name)
+    app.mount(prefix, apis[family].app)
+
+@app.get("/")
+def read_root():
+    return {
+        "message": "Mental Health Diagnostics Service is running",
+        "families": {family: {"prefix": FAMILY_APPS[family][0], "model": api.reloader.status()}
+                     for family, api in apis.items()},
+    }
+
+@app.get("/metrics")
+def metrics_endpoint():
+    # the shared registry with the runtime state of every family collected
+    if not METRICS:
+        raise HTTPException(status_code=404, detail="Metrics are disabled")
+    registry = runtime.metrics()
+    for family, api in apis.items():
+        collect_runtime(registry, api.reloader, api.executor, family)
+        api.startup.collect(registry, family)
+        collect_drift(registry, api.reloader, family)
+    return Response(registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.get("/executor/stats")
+def executor_stats():
+    return runtime.executor().stats()
+
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -0,0 +1,121 @@
+import numpy as np
+import pandas as pd
+import os
+
+# Synthetic questionnaires with the columns and answer values preprocess_data() expects, for
+# benchmarks and load tests. Labels are drawn from a few of the answers plus noise so the
+# forests have something to learn. Rows are generated in vectorized chunks, so millions of
+# rows take seconds.
+
+# answers of the original survey (data_utils); None becomes a missing value
+ORIGINAL_ANSWERS = {
+    'Gender': ['Male', 'Female', 'male', 'M', 'f', 'woman', 'Cis Male', 'non-binary', 'Female '],
+    'self_employed': ['Yes', 'No', None],
+    'family_history': ['Yes', 'No'],
+    'work_interfere': ['Often', 'Rarely', 'Never', 'Sometimes', None],
+    'no_employees': ['1-5', '6-25', '26-100', '100-500', '500-1000', 'More than 1000'],
+    'remote_work': ['Yes', 'No'],
+    'tech_company': ['Yes', 'No'],
+    'benefits': ['Yes', 'No', "Don't know"],
+    'care_options': ['Yes', 'No', 'Not sure'],
+    'wellness_program': ['Yes', 'No', "Don't know"],
+    'seek_help': ['Yes', 'No', "Don't know"],
+    'anonymity': ['Yes', 'No', "Don't know"],
+    'leave': ['Very easy', 'Somewhat easy', 'Somewhat difficult', 'Very difficult', "Don't know"],
+    'mental_health_consequence': ['Yes', 'No', 'Maybe'],
+    'phys_health_consequence': ['Yes', 'No', 'Maybe'],
+    'coworkers': ['Yes', 'No', 'Some of them'],
+    'supervisor': ['Yes', 'No', 'Some of them'],
+    'mental_health_interview': ['Yes', 'No', 'Maybe'],
+    'phys_health_interview': ['Yes', 'No', 'Maybe'],
+    'mental_vs_physical': ['Yes', 'No', "Don't know"],
+    'obs_consequence': ['Yes', 'No'],
+    'yoga': ['Yes', 'No'],
+}
+CONDITIONS = np.array(['Healthy', 'Anxiety', 'Depression', 'High Risk'], dtype=object)
+
+# answers of the modified dataset (data_utils_modified)
+MODIFIED_ANSWERS = {
+    'Gender': ['Male', 'Female'],
+    'Country': ['United States', 'United Kingdom', 'India', 'Canada', 'Australia'],
+    'Occupation': ['Business', 'Corporate', 'Housewife', 'Others', 'Student'],
+    'SelfEmployed': ['No', 'Yes', None],
+    'FamilyHistory': ['No', 'Yes'],
+    'DaysIndoors': ['1-14 days', '15-30 days', '31-60 days', 'Go out Every day', 'More than 2 months'],
+    'HabitsChange': ['Maybe', 'No', 'Yes'],
+    'MentalHealthHistory': ['Maybe', 'No', 'Yes'],
+    'IncreasingStress': ['Maybe', 'No', 'Yes'],
+    'MoodSwings': ['High', 'Low', 'Medium'],
+    'SocialWeakness': ['Maybe', 'No', 'Yes'],
+    'CopingStruggles': ['No', 'Yes'],
+    'WorkInterest': ['Maybe', 'No', 'Yes'],
+    'MentalHealthInterview': ['Maybe', 'No', 'Yes'],
+    'CareOptions': ['No', 'Not sure', 'Yes'],
+}
+
+
+def pick(rng, answers, n):
+    return np.array(answers, dtype=object)[rng.integers(0, len(answers), n)]
+
+
+def original_rows(n, seed=0, labels=True):
+    rng = np.random.default_rng(seed)
+    # a few unparseable and out of range ages, like the real survey
+    age = rng.integers(18, 72, n).astype(object)
+    odd = rng.random(n) < 0.01
+    age[odd] = pick(rng, [-1, 150, 'unknown'], int(odd.sum()))
+    df = pd.DataFrame({'Age': age})
+    for col, answers in ORIGINAL_ANSWERS.items():
+        df[col] = pick(rng, answers, n)
+    if labels:
+        score = ((df['family_history'] == 'Yes').to_numpy(int)
+                 + (df['work_interfere'] == 'Often').to_numpy(int)
+                 + (df['mental_health_consequence'] == 'Yes').to_numpy(int)
+                 + rng.integers(0, 2, n))
+        df['condition'] = CONDITIONS[np.minimum(score, 3)]
+        df['treatment'] = np.where(score + rng.integers(0, 2, n) >= 3, 'Yes', 'No')
+    return df
+
+
+def modified_rows(n, seed=0, labels=True):
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({col: pick(rng, answers, n) for col, answers in MODIFIED_ANSWERS.items()})
+    if labels:
+        score = ((df['FamilyHistory'] == 'Yes').to_numpy(int)
+                 + (df['MentalHealthHistory'] == 'Yes').to_numpy(int)
+                 + (df['CareOptions'] == 'Yes').to_numpy(int)
+                 + rng.integers(0, 2, n))
+        df['Treatment'] = np.where(score >= 2, 'Yes', 'No')
+    return df
+
+
+def write_csv(path, make_rows, n, seed=0, labels=True, chunk_size=500000):
+    # chunked so memory stays flat for millions of rows; each chunk gets its own seed
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    for i, start in enumerate(range(0, n, chunk_size)):
+        chunk = make_rows(min(chunk_size, n - start), seed=seed + i, labels=labels)
+        chunk.to_csv(path, mode='w' if i == 0 else 'a', header=i == 0, index=False)
+    return path
+
+
+def write_datasets(data_dir, n, seed=0):
+    # the two training files train_model.py and train_model_modified.py read
+    return (write_csv(os.path.join(data_dir, 'dataset.csv'), original_rows, n, seed),
+            write_csv(os.path.join(data_dir, 'Mental Health dataset.csv'), modified_rows, n, seed))
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Write synthetic training data for both model families")
+    parser.add_argument('data_dir')
+    parser.add_argument('--rows', type=int, default=10000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--unlabeled', action='store_true', help="write unlabeled_data.csv for batch_predict instead")
+    args = parser.parse_args()
+
+    if args.unlabeled:
+        print(write_csv(os.path.join(args.data_dir, 'unlabeled_data.csv'), original_rows, args.rows, args.seed, labels=False))
+    else:
+        for path in write_datasets(args.data_dir, args.rows, args.seed):
+            print(path)
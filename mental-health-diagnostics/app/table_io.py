@@ -0,0 +1,219 @@
+import os
+import sys
+import pandas as pd
+
+# File formats of batch_predict.py, picked from the file extension:
+#
+#   .parquet .pq        Parquet (needs pyarrow)
+#   .arrow .feather     Arrow IPC file, i.e. Feather v2 (needs pyarrow); memory-mapped on read
+#   .jsonl .ndjson      one JSON object per line; '-' as the output writes JSONL to stdout
+#   anything else       CSV, as before
+#
+# Parquet and Arrow inputs are read column-pruned: only the columns asked for (the model's
+# feature columns, plus any the caller wants to keep) are read from disk. Their string columns
+# come back dictionary-encoded as pandas categoricals, so the encoder looks up every distinct
+# answer once instead of once per row, and typed columns (a numeric Age) need no parsing.
+# Parquet and Arrow outputs store the given categorical columns (the predicted labels)
+# dictionary-encoded with a fixed category list, so every chunk of a streamed run has the
+# same schema.
+
+FORMATS = {
+    '.parquet': 'parquet', '.pq': 'parquet',
+    '.arrow': 'arrow', '.feather': 'arrow',
+    '.jsonl': 'jsonl', '.ndjson': 'jsonl',
+}
+STDOUT = '-'
+
+
+def file_format(path):
+    if path == STDOUT:
+        return 'jsonl'
+    return FORMATS.get(os.path.splitext(path)[1].lower(), 'csv')
+
+
+def require_pyarrow():
+    try:
+        import pyarrow
+    except ImportError:
+        raise ImportError("Parquet and Arrow files need pyarrow: pip install pyarrow") from None
+    return pyarrow
+
+
+def parquet_columns(path, columns, categorical):
+    # the wanted columns that exist in a Parquet file, and which of them to read dictionary-encoded
+    pa = require_pyarrow()
+    import pyarrow.parquet as pq
+
+    schema = pq.read_schema(path)
+    columns = [c for c in columns if c in schema.names] if columns is not None else schema.names
+    dictionary = [c for c in categorical if c in columns and pa.types.is_string(schema.field(c).type)]
+    return columns, dictionary
+
+
+def arrow_table(path, columns=None, categorical=()):
+    # the whole file as a pyarrow Table with only the wanted columns that exist in it
+    pa = require_pyarrow()
+    if file_format(path) == 'parquet':
+        import pyarrow.parquet as pq
+        columns, dictionary = parquet_columns(path, columns, categorical)
+        return pq.read_table(path, columns=columns, read_dictionary=dictionary)
+    # Arrow: memory-mapped, so selecting columns reads nothing else
+    table = pa.ipc.open_file(pa.memory_map(path, 'r')).read_all()
+    if columns is not None:
+        table = table.select([c for c in columns if c in table.column_names])
+    return table
+
+
+def to_frame(table, categorical=()):
+    # pyarrow Table -> DataFrame, the categorical string columns as pandas categoricals
+    pa = require_pyarrow()
+    for name in categorical:
+        if name in table.column_names:
+            i = table.column_names.index(name)
+            column = table.column(i)
+            if pa.types.is_string(column.type) or pa.types.is_large_string(column.type):
+                table = table.set_column(i, name, column.dictionary_encode())
+    return table.to_pandas()
+
+
+def read_frame(path, columns=None, categorical=()):
+    # the whole input as one DataFrame; CSV and JSONL are read in full
+    fmt = file_format(path)
+    if fmt in ('parquet', 'arrow'):
+        return to_frame(arrow_table(path, columns, categorical), categorical)
+    if fmt == 'jsonl':
+        return pd.read_json(path, lines=True, dtype=False)
+    return pd.read_csv(path)
+
+
+def iter_frames(path, chunk_size, skip_rows=0, columns=None, categorical=()):
+    # the input chunk_size rows at a time, starting after skip_rows rows
+    fmt = file_format(path)
+    if fmt == 'csv':
+        # line 0 is the header. A callable rather than range(): pandas turns a range into a set of
+        # every skipped line number, which gets big when resuming far into a file
+        skip = (lambda i: 0 < i <= skip_rows) if skip_rows else None
+        yield from pd.read_csv(path, chunksize=chunk_size, skiprows=skip)
+        return
+    if fmt == 'jsonl':
+        for chunk in pd.read_json(path, lines=True, dtype=False, chunksize=chunk_size):
+            if skip_rows >= len(chunk):
+                skip_rows -= len(chunk)
+                continue
+            yield chunk.iloc[skip_rows:]
+            skip_rows = 0
+        return
+    if fmt == 'parquet':
+        pa = require_pyarrow()
+        import pyarrow.parquet as pq
+        columns, dictionary = parquet_columns(path, columns, categorical)
+        batches = pq.ParquetFile(path, read_dictionary=dictionary).iter_batches(batch_size=chunk_size, columns=columns)
+        for batch in batches:
+            if skip_rows >= batch.num_rows:
+                skip_rows -= batch.num_rows
+                continue
+            yield to_frame(pa.Table.from_batches([batch.slice(skip_rows)]), categorical)
+            skip_rows = 0
+        return
+    table = arrow_table(path, columns, categorical)
+    for start in range(skip_rows, table.num_rows, chunk_size):
+        yield to_frame(table.slice(start, chunk_size), categorical)
+
+
+class FrameWriter:
+    # appends DataFrames to one output file in its format. categories: column -> the full list
+    # of values it can take, stored dictionary-encoded in Parquet and Arrow outputs.
+    # CSV and JSONL files can be cut back to a byte offset and appended to (stream resume);
+    # Parquet and Arrow files are written in one go.
+
+    def __init__(self, path, categories=None, offset=None):
+        self.path = path
+        self.format = file_format(path)
+        self.categories = categories or {}
+        self.writer = None
+        self.schema = None
+        self.text_columns = None
+        if offset is not None and not self.resumable:
+            raise ValueError(f"Cannot resume a {self.format} output, use CSV or JSONL")
+        if self.format in ('parquet', 'arrow'):
+            require_pyarrow()
+        if path == STDOUT:
+            # the process's real stdout, even while progress messages are redirected to stderr
+            self.file = sys.__stdout__
+        elif self.format in ('csv', 'jsonl'):
+            if offset:
+                with open(path, 'r+b') as f:
+                    f.truncate(offset)
+            elif os.path.exists(path):
+                os.remove(path)
+            self.file = open(path, 'a', newline='')
+        else:
+            self.file = None
+
+    @property
+    def resumable(self):
+        return self.path != STDOUT and self.format in ('csv', 'jsonl')
+
+    def write(self, df):
+        if self.format == 'csv':
+            df.to_csv(self.file, index=False, header=self.file.tell() == 0)
+        elif self.format == 'jsonl':
+            text = df.to_json(orient='records', lines=True, force_ascii=False)
+            self.file.write(text if text.endswith('\n') else text + '\n')
+        else:
+            self.write_table(df)
+        self.flush()
+
+    def write_table(self, df):
+        import pyarrow as pa
+
+        df = df.copy()
+        for col, values in self.categories.items():
+            if col in df.columns:
+                df[col] = pd.Categorical(df[col], categories=list(values))
+        if self.text_columns is None:
+            # the schema is fixed by the first chunk, but a CSV column that is empty there reads
+            # as float NaN and may hold text later (mostly-empty free-text answers), and an object
+            # column can hold anything: both are written as strings in every chunk
+            self.text_columns = [col for col in df.columns if col not in self.categories
+                                 and (df[col].dtype == object or df[col].isna().all())]
+        for col in self.text_columns:
+            if col in df.columns:
+                df[col] = df[col].astype('string')
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        if self.writer is None:
+            # dictionary indices as int32 whatever pandas picked for this chunk, so later
+            # chunks with more categories still fit the schema
+            fields = [pa.field(f.name, pa.dictionary(pa.int32(), f.type.value_type)) if pa.types.is_dictionary(f.type) else f
+                      for f in table.schema]
+            self.schema = pa.schema(fields, metadata=table.schema.metadata)
+            if self.format == 'parquet':
+                import pyarrow.parquet as pq
+                self.writer = pq.ParquetWriter(self.path, self.schema)
+            else:
+                self.writer = pa.ipc.new_file(self.path, self.schema)
+        self.writer.write_table(table.cast(self.schema))
+
+    def flush(self):
+        # CSV and JSONL chunks are on disk once write() returns, for the stream checkpoint
+        if self.file is None:
+            return
+        self.file.flush()
+        if self.path != STDOUT:
+            os.fsync(self.file.fileno())
+
+    def tell(self):
+        return os.path.getsize(self.path) if self.resumable else None
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        if self.file is not None and self.path != STDOUT:
+            self.file.close()
+
+    def abort(self):
+        # after a failed run: a Parquet or Arrow file can't be resumed, so don't leave half of it
+        # behind; CSV and JSONL outputs are kept for --resume
+        self.close()
+        if not self.resumable and self.path != STDOUT and os.path.exists(self.path):
+            os.remove(self.path)
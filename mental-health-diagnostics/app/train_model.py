@@ -3,26 +3,43 @@ import numpy as np
 import os
 from sklearn.ensemble import RandomForestClassifier
 from sklearn.preprocessing import LabelEncoder
-from sklearn.model_selection import train_test_split, GridSearchCV
+from sklearn.model_selection import train_test_split
 from sklearn.metrics import classification_report, accuracy_score
 import joblib
-from data_utils import preprocess_data
+import data_utils
+import feature_cache
+from model_bundle import write_bundle
+import param_search
+import joint_model
+import drift
 
-def train():
-    # Get base dir
-    BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-    DATA_DIR = os.path.join(BASE_DIR, '..', 'data')
-    MODELS_DIR = os.path.join(BASE_DIR, '..', 'models')
+# Get base dir
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DATA_DIR = os.path.join(BASE_DIR, '..', 'data')
+MODELS_DIR = os.path.join(BASE_DIR, '..', 'models')
 
+# Hyperparameter tuning
+PARAM_GRID = {
+    'n_estimators': [100, 200, 300],
+    'max_depth': [None, 10, 20, 30],
+    'min_samples_split': [2, 5, 10],
+    'min_samples_leaf': [1, 2, 4]
+}
+
+# JOINT_MODEL=1 (or --joint) also trains one multi-output forest for both targets and serves that
+JOINT_MODEL = os.getenv('JOINT_MODEL', '0') == '1'
+
+def train(data_dir=DATA_DIR, models_dir=MODELS_DIR, param_grid=PARAM_GRID, search_config=None, joint=JOINT_MODEL):
+    search_config = search_config or param_search.SearchConfig.from_env()
     print("Loading and preprocessing data...")
-    df, encoders = preprocess_data(os.path.join(DATA_DIR, 'dataset.csv'), encoders_path=os.path.join(MODELS_DIR, 'encoders.pkl'), is_training=True)
+    df, encoders = feature_cache.load_features(data_utils, os.path.join(data_dir, 'dataset.csv'), os.path.join(models_dir, 'encoders.pkl'))
     
     # Define targets and features
     target_cols = ['condition', 'treatment']
     feature_cols = [col for col in df.columns if col not in target_cols]
     
     X = df[feature_cols]
-    joblib.dump(feature_cols, os.path.join(MODELS_DIR, 'feature_cols.pkl'))
+    joblib.dump(feature_cols, os.path.join(models_dir, 'feature_cols.pkl'))
     y_condition = df['condition']
     y_treatment = df['treatment']
     
@@ -34,27 +51,26 @@ def train():
     y_treatment_encoded = le_treatment.fit_transform(y_treatment)
     
     # Save target encoders
-    joblib.dump(le_condition, os.path.join(MODELS_DIR, 'le_condition.pkl'))
-    joblib.dump(le_treatment, os.path.join(MODELS_DIR, 'le_treatment.pkl'))
+    joblib.dump(le_condition, os.path.join(models_dir, 'le_condition.pkl'))
+    joblib.dump(le_treatment, os.path.join(models_dir, 'le_treatment.pkl'))
     
     # --- Training Condition Model ---
     print("\nTraining Condition Model (Supervised with Tuning)...")
     
     X_train, X_test, y_train, y_test = train_test_split(X, y_condition_encoded, test_size=0.2, random_state=42)
     
+    # Both models split X with random_state=42, so their training rows are the same and
+    # share one set of CV folds, stratified on the (imbalanced) condition labels
+    folds = param_search.make_folds(y_train, search_config.cv)
+    
+    # what the training rows look like, so the API can tell when its input drifts away from it
+    profile = drift.training_profile(X_train, encoders)
+    drift.save_profile(os.path.join(models_dir, 'drift_profile.json'), profile)
+    
     # Using RandomForest with class_weight='balanced' to handle imbalance
     rf = RandomForestClassifier(random_state=42, class_weight='balanced')
     
-    # Hyperparameter tuning
-    param_grid = {
-        'n_estimators': [100, 200, 300],
-        'max_depth': [None, 10, 20, 30],
-        'min_samples_split': [2, 5, 10],
-        'min_samples_leaf': [1, 2, 4]
-    }
-    
-    grid_search = GridSearchCV(estimator=rf, param_grid=param_grid, cv=3, n_jobs=-1, verbose=1)
-    grid_search.fit(X_train, y_train)
+    grid_search = param_search.search(rf, param_grid, X_train, y_train, folds, search_config)
     
     best_rf = grid_search.best_estimator_
     print(f"Best parameters for Condition Model: {grid_search.best_params_}")
@@ -63,7 +79,7 @@ def train():
     print("Condition Model Accuracy:", accuracy_score(y_test, y_pred))
     print(classification_report(y_test, y_pred, target_names=le_condition.classes_, zero_division=0))
     
-    joblib.dump(best_rf, os.path.join(MODELS_DIR, 'condition_model.pkl'))
+    joblib.dump(best_rf, os.path.join(models_dir, 'condition_model.pkl'))
     
     # --- Training Treatment Model ---
     print("\nTraining Treatment Model (Supervised with Tuning)...")
@@ -73,8 +89,7 @@ def train():
     rf_treatment = RandomForestClassifier(random_state=42, class_weight='balanced')
     
     # Reusing the same grid for simplicity, or could define a smaller one
-    grid_search_t = GridSearchCV(estimator=rf_treatment, param_grid=param_grid, cv=3, n_jobs=-1, verbose=1)
-    grid_search_t.fit(X_train_t, y_train_t)
+    grid_search_t = param_search.search(rf_treatment, param_grid, X_train_t, y_train_t, folds, search_config)
     
     best_rf_t = grid_search_t.best_estimator_
     print(f"Best parameters for Treatment Model: {grid_search_t.best_params_}")
@@ -83,10 +98,49 @@ def train():
     print("Treatment Model Accuracy:", accuracy_score(y_test_t, y_pred_t))
     print(classification_report(y_test_t, y_pred_t, target_names=le_treatment.classes_, zero_division=0))
     
-    joblib.dump(best_rf_t, os.path.join(MODELS_DIR, 'treatment_model.pkl'))
+    joblib.dump(best_rf_t, os.path.join(models_dir, 'treatment_model.pkl'))
+    
+    bundle_models = {'condition': best_rf, 'treatment': best_rf_t}
+    joint_targets = None
+    if joint:
+        # --- Training Joint Model ---
+        # same training rows and folds as above, so it is compared on the same test rows
+        print("\nTraining Joint Model (condition and treatment in one forest)...")
+        Y_train = np.column_stack([y_train, y_train_t])
+        Y_test = np.column_stack([y_test, y_test_t])
+        grid_search_j = joint_model.fit_joint(X_train, Y_train, param_grid, folds, search_config)
+        best_rf_j = grid_search_j.best_estimator_
+        print(f"Best parameters for Joint Model: {grid_search_j.best_params_}")
+        
+        joint_report = joint_model.compare({'condition': best_rf, 'treatment': best_rf_t}, best_rf_j,
+                                           target_cols, X_test, Y_test)
+        joint_report["search"] = grid_search_j.report
+        joint_model.print_report(joint_report)
+        joint_model.save_report(os.path.join(models_dir, 'joint_report.json'), joint_report)
+        
+        # the bundle serves the joint forest; the separate pickles above keep the two-model setup
+        bundle_models = {'joint': best_rf_j}
+        joint_targets = {'joint': target_cols}
+    
+    # everything above again as one versioned bundle the API and batch jobs load in one go
+    write_bundle(models_dir, 'original',
+                 models=bundle_models,
+                 labels={'condition': le_condition, 'treatment': le_treatment},
+                 encoders=encoders, feature_cols=feature_cols, sample_X=X_test, joint=joint_targets,
+                 profile=profile)
+    
+    param_search.save_report(os.path.join(models_dir, 'search_report.json'), search_config,
+                             {'condition': grid_search.report, 'treatment': grid_search_t.report})
     
     print("\nModels and encoders saved successfully.")
 
 
 if __name__ == "__main__":
-    train()
+    import argparse
+    
+    parser = argparse.ArgumentParser(description="Train the condition and treatment models")
+    param_search.add_arguments(parser)
+    parser.add_argument('--joint', action='store_true', default=JOINT_MODEL,
+                        help="also train one multi-output forest for both targets, report it against the two models and serve it")
+    args = parser.parse_args()
+    train(search_config=param_search.config_from_args(args), joint=args.joint)
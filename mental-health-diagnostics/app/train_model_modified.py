@@ -3,20 +3,33 @@ import numpy as np
 import os
 from sklearn.ensemble import RandomForestClassifier
 from sklearn.preprocessing import LabelEncoder
-from sklearn.model_selection import train_test_split, GridSearchCV
+from sklearn.model_selection import train_test_split
 from sklearn.metrics import classification_report, accuracy_score
 import joblib
-from data_utils_modified import preprocess_data
+import data_utils_modified
+import feature_cache
+from model_bundle import write_bundle
+import param_search
+import drift
 
-def train():
-    # Get base dir
-    BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-    DATA_DIR = os.path.join(BASE_DIR, '..', 'data')
-    MODELS_DIR = os.path.join(BASE_DIR, '..', 'models')
+# Get base dir
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DATA_DIR = os.path.join(BASE_DIR, '..', 'data')
+MODELS_DIR = os.path.join(BASE_DIR, '..', 'models')
 
+# Hyperparameter tuning
+PARAM_GRID = {
+    'n_estimators': [100, 200],
+    'max_depth': [None, 10, 20],
+    'min_samples_split': [2, 5],
+    'min_samples_leaf': [1, 2]
+}
+
+def train(data_dir=DATA_DIR, models_dir=MODELS_DIR, param_grid=PARAM_GRID, search_config=None):
+    search_config = search_config or param_search.SearchConfig.from_env()
     print("Loading and preprocessing data...")
     # Use the new dataset
-    df, encoders = preprocess_data(os.path.join(DATA_DIR, 'Mental Health dataset.csv'), encoders_path=os.path.join(MODELS_DIR, 'encoders_modified.pkl'), is_training=True)
+    df, encoders = feature_cache.load_features(data_utils_modified, os.path.join(data_dir, 'Mental Health dataset.csv'), os.path.join(models_dir, 'encoders_modified.pkl'))
     
     # Define targets
     target_cols = ['Treatment']
@@ -28,7 +41,7 @@ def train():
     print(f"Training with features: {feature_cols}")
     
     X = df[feature_cols]
-    joblib.dump(feature_cols, os.path.join(MODELS_DIR, 'feature_cols_modified.pkl'))
+    joblib.dump(feature_cols, os.path.join(models_dir, 'feature_cols_modified.pkl'))
     
     y_treatment = df['Treatment']
     
@@ -37,15 +50,7 @@ def train():
     y_treatment_encoded = le_treatment.fit_transform(y_treatment)
     
     # Save target encoders
-    joblib.dump(le_treatment, os.path.join(MODELS_DIR, 'le_treatment_modified.pkl'))
-    
-    # Hyperparameter tuning
-    param_grid = {
-        'n_estimators': [100, 200],
-        'max_depth': [None, 10, 20],
-        'min_samples_split': [2, 5],
-        'min_samples_leaf': [1, 2]
-    }
+    joblib.dump(le_treatment, os.path.join(models_dir, 'le_treatment_modified.pkl'))
     
     # --- Training Treatment Model ---
     print("\nTraining Treatment Model (Supervised with Tuning)...")
@@ -55,8 +60,12 @@ def train():
     rf_treatment = RandomForestClassifier(random_state=42, class_weight='balanced')
     
     # Reusing the same grid
-    grid_search_t = GridSearchCV(estimator=rf_treatment, param_grid=param_grid, cv=3, n_jobs=-1, verbose=1)
-    grid_search_t.fit(X_train_t, y_train_t)
+    folds = param_search.make_folds(y_train_t, search_config.cv)
+    
+    # what the training rows look like, so the API can tell when its input drifts away from it
+    profile = drift.training_profile(X_train_t, encoders)
+    drift.save_profile(os.path.join(models_dir, 'drift_profile_modified.json'), profile)
+    grid_search_t = param_search.search(rf_treatment, param_grid, X_train_t, y_train_t, folds, search_config)
     
     best_rf_t = grid_search_t.best_estimator_
     print(f"Best parameters for Treatment Model: {grid_search_t.best_params_}")
@@ -65,10 +74,24 @@ def train():
     print("Treatment Model Accuracy:", accuracy_score(y_test_t, y_pred_t))
     print(classification_report(y_test_t, y_pred_t, target_names=le_treatment.classes_, zero_division=0))
     
-    joblib.dump(best_rf_t, os.path.join(MODELS_DIR, 'treatment_model_modified.pkl'))
+    joblib.dump(best_rf_t, os.path.join(models_dir, 'treatment_model_modified.pkl'))
+    
+    # everything above again as one versioned bundle the API loads in one go
+    write_bundle(models_dir, 'modified',
+                 models={'treatment': best_rf_t},
+                 labels={'treatment': le_treatment},
+                 encoders=encoders, feature_cols=feature_cols, sample_X=X_test_t,
+                 profile=profile)
+    
+    param_search.save_report(os.path.join(models_dir, 'search_report_modified.json'), search_config,
+                             {'treatment': grid_search_t.report})
     
     print("\nModels and encoders saved successfully.")
 
 
 if __name__ == "__main__":
-    train()
+    import argparse
+    
+    parser = argparse.ArgumentParser(description="Train the treatment model on the modified dataset")
+    param_search.add_arguments(parser)
+    train(search_config=param_search.config_from_args(parser.parse_args()))
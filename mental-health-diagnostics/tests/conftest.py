@@ -0,0 +1,6 @@
+import os
+import sys
+
+# the app modules import each other by bare name (from compiled_encoder import ...), like when
+# they are run from app/
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'app'))
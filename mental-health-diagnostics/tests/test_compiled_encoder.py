@@ -0,0 +1,147 @@
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.preprocessing import LabelEncoder
+
+import data_utils
+import data_utils_modified
+
+# CompiledEncoder has to give exactly the codes of the original preprocess_input: LabelEncoder
+# per column, clean_gender first, unseen and missing answers -> 'Unknown' if the column has it,
+# else code 0, Age coerced to a number with 30 as the default. Below is that code as it was
+# before compiled_encoder.py, as the reference.
+
+
+def reference_clean_gender(gender):
+    gender = str(gender).lower().strip()
+    if gender in ['male', 'm', 'male-ish', 'maile', 'cis male', 'mal', 'male (cis)', 'make', 'male ', 'man', 'msle', 'mail', 'malr', 'cis man', 'guy (-ish) ^_^']:
+        return 'Male'
+    if gender in ['female', 'f', 'woman', 'femake', 'female ', 'cis-female/femme', 'female (cis)', 'femail', 'cis female', 'trans-female', 'trans woman', 'female (trans)']:
+        return 'Female'
+    return 'Other'
+
+
+def reference_preprocess_input(df, encoders):
+    if 'Gender' in df.columns:
+        df['Gender'] = df['Gender'].apply(reference_clean_gender)
+
+    if 'Age' in df.columns:
+        df['Age'] = pd.to_numeric(df['Age'], errors='coerce')
+        df['Age'] = df['Age'].fillna(30)
+
+    for col, le in encoders.items():
+        if col in df.columns:
+            df[col] = df[col].fillna('Unknown')
+            known_labels = set(le.classes_)
+
+            def safe_transform(val):
+                if val in known_labels:
+                    return le.transform([val])[0]
+                if 'Unknown' in known_labels:
+                    return le.transform(['Unknown'])[0]
+                return 0
+
+            df[col] = df[col].apply(safe_transform)
+    return df
+
+
+def fit(values):
+    le = LabelEncoder()
+    le.fit(values)
+    return le
+
+
+# Gender with its three cleaned classes, a column with an 'Unknown' class and one without
+ENCODERS = {
+    'Gender': fit(['Female', 'Male', 'Other']),
+    'self_employed': fit(['No', 'Unknown', 'Yes']),
+    'work_interfere': fit(['Never', 'Often', 'Rarely', 'Sometimes']),
+}
+FEATURE_COLS = ['Age', 'Gender', 'self_employed', 'work_interfere']
+
+GENDERS = ['Male', 'M', ' female ', 'F', 'cis man', 'Cis Male', 'trans woman', 'Female (trans)',
+           'guy (-ish) ^_^', 'nonbinary', 'Other', '', None, np.nan, 42]
+SELF_EMPLOYED = ['Yes', 'No', 'Unknown', 'Maybe', 'yes', '', None, np.nan, 1]
+WORK_INTERFERE = ['Often', 'Never', 'Sometimes', 'Rarely', 'Unknown', 'always', '', None, np.nan, 0]
+AGES = [35, 42.5, '29', ' 41 ', '1e2', 'abc', '', None, np.nan, '1_000', '٣٠', 'NaN', -5]
+
+
+def raw_frame(n=None):
+    # every value of every column at least once, in combinations
+    n = n or max(len(GENDERS), len(SELF_EMPLOYED), len(WORK_INTERFERE), len(AGES))
+    return pd.DataFrame({
+        'Age': [AGES[i % len(AGES)] for i in range(n)],
+        'Gender': [GENDERS[i % len(GENDERS)] for i in range(n)],
+        'self_employed': [SELF_EMPLOYED[(i * 7) % len(SELF_EMPLOYED)] for i in range(n)],
+        'work_interfere': [WORK_INTERFERE[(i * 3) % len(WORK_INTERFERE)] for i in range(n)],
+    }, dtype=object)
+
+
+def expected(df, encoders=ENCODERS, feature_cols=FEATURE_COLS):
+    return reference_preprocess_input(df.copy(), encoders)[feature_cols].astype(np.float64)
+
+
+def test_clean_gender_matches_reference():
+    for gender in GENDERS + ['MALE', 'woman ', 'malr', 'femail']:
+        assert data_utils.clean_gender(gender) == reference_clean_gender(gender)
+        assert data_utils_modified.clean_gender(gender) == reference_clean_gender(gender)
+
+
+def test_transform_matches_reference():
+    df = raw_frame(60)
+    encoder = data_utils.compile_encoders(ENCODERS)
+    got = encoder.features(encoder.transform(df.copy()), FEATURE_COLS).astype(np.float64)
+    pd.testing.assert_frame_equal(got, expected(df))
+
+
+def test_preprocess_input_accepts_raw_encoders():
+    df = raw_frame()
+    got = data_utils.preprocess_input(df.copy(), ENCODERS)[FEATURE_COLS].astype(np.float64)
+    pd.testing.assert_frame_equal(got, expected(df))
+
+
+@pytest.mark.parametrize('col', ['Gender', 'self_employed', 'work_interfere'])
+def test_encode_column_matches_reference(col):
+    df = raw_frame(60)
+    encoder = data_utils.compile_encoders(ENCODERS)
+    want = expected(df)[col].to_numpy()
+    assert np.array_equal(encoder.encode_column(col, df[col]), want)
+    # dictionary-encoded input (Parquet/Arrow) takes the categorical branch
+    assert np.array_equal(encoder.encode_column(col, df[col].astype('category')), want)
+
+
+def test_encode_records_matches_reference():
+    df = raw_frame(60)
+    encoder = data_utils.compile_encoders(ENCODERS)
+    records = df.to_dict('records')
+    got = encoder.encode_records(records, FEATURE_COLS)
+    assert np.array_equal(got, expected(df).to_numpy())
+
+
+def test_encode_records_fills_missing_columns_with_zero():
+    encoder = data_utils.compile_encoders(ENCODERS)
+    got = encoder.encode_records([{'Gender': 'f'}], FEATURE_COLS + ['extra'])
+    want = encoder.features(encoder.transform(pd.DataFrame({'Gender': ['f']}, dtype=object)), FEATURE_COLS + ['extra'])
+    assert np.array_equal(got, want.to_numpy(dtype=np.float64))
+
+
+def test_modified_family_matches_reference():
+    # no Age and a column whose classes don't include 'Unknown'
+    encoders = {
+        'Gender': fit(['Female', 'Male']),
+        'Occupation': fit(['Business', 'Corporate', 'Student']),
+        'MoodSwings': fit(['High', 'Low', 'Medium', 'Unknown']),
+    }
+    feature_cols = list(encoders)
+    df = pd.DataFrame({
+        'Gender': GENDERS,
+        'Occupation': ['Student', 'Corporate', 'Astronaut', '', None, np.nan, 'student', 'Business',
+                       3, 'Housewife', 'Others', 'Corporate', 'Business', 'Student', None],
+        'MoodSwings': ['High', 'Low', 'Medium', 'Unknown', 'Extreme', None, np.nan, '', 'low',
+                       'High', 'Medium', 7, 'Low', 'High', 'Medium'],
+    }, dtype=object)
+    encoder = data_utils_modified.compile_encoders(encoders)
+    want = expected(df, encoders, feature_cols)
+    got = encoder.features(encoder.transform(df.copy()), feature_cols).astype(np.float64)
+    pd.testing.assert_frame_equal(got, want)
+    assert np.array_equal(encoder.encode_records(df.to_dict('records'), feature_cols), want.to_numpy())